@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Persistent cache of UDPipe/MeCab analyses shared across scripts.
+
+Analyses of a string are stored as a list of (form, lemma, pos, tag) tuples
+in an SQLite file, keyed by a hash of (analyzer, model file hash, dictionary,
+input string). Scripts that analyze the same EOMW surfaces with the same
+model/dictionary (e.g. tokenize_wn-wikt.py and wnwikt2json_udpipe.py) share
+the entries.
+
+python wnwikt2json_udpipe.py ... --cache data/analysis.cache.db
+python tokenize_wn-wikt.py ... --cache data/analysis.cache.db
+
+python analysis_cache.py data/analysis.cache.db  # show statistics
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+DEFAULT_MAX_ENTRIES = 2000000
+
+
+def file_digest(filename, blocksize=1 << 20):
+    """Return SHA1 hex digest of a file"""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+class AnalysisCache(object):
+    """Content-addressed cache of analyses backed by SQLite.
+
+    Entries beyond `max_entries` are evicted in the least-recently-used
+    order when the cache is closed."""
+
+    def __init__(self, filename, analyzer, path_model=None, dictionary='',
+                 lang='', max_entries=DEFAULT_MAX_ENTRIES):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # Wait for other processes (e.g. parallel pipeline steps) writing
+        self.conn = sqlite3.connect(filename, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS analyses '
+                          '(key TEXT PRIMARY KEY, value TEXT, atime REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS analyses_atime '
+                          'ON analyses (atime)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS digests '
+                          '(path TEXT PRIMARY KEY, size INTEGER, '
+                          'mtime REAL, digest TEXT)')
+        model_digest = '' if path_model is None \
+            else self.model_digest(path_model)
+        self.namespace = '\0'.join([analyzer, model_digest, dictionary,
+                                    lang])
+
+    def model_digest(self, path_model):
+        """Hash a model file (memoized by path, size and mtime)"""
+        path_model = os.path.abspath(path_model)
+        st = os.stat(path_model)
+        row = self.conn.execute(
+            'SELECT size, mtime, digest FROM digests WHERE path = ?',
+            (path_model,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+            return row[2]
+        digest = file_digest(path_model)
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO digests VALUES '
+                              '(?, ?, ?, ?)',
+                              (path_model, st.st_size, st.st_mtime, digest))
+        return digest
+
+    def key(self, s):
+        return hashlib.sha1(
+            (self.namespace + '\0' + s).encode('utf_8')).hexdigest()
+
+    def get_many(self, strings, batch_size=500):
+        """Return a dict from cached strings to their analyses"""
+        keys = {self.key(s): s for s in strings}
+        found = {}
+        key_list = list(keys)
+        now = time.time()
+        for i in range(0, len(key_list), batch_size):
+            batch = key_list[i:i + batch_size]
+            rows = self.conn.execute(
+                'SELECT key, value FROM analyses WHERE key IN ({})'.format(
+                    ','.join('?' * len(batch))), batch).fetchall()
+            for key, value in rows:
+                found[keys[key]] = [tuple(t) for t in json.loads(value)]
+            with self.conn:
+                self.conn.executemany(
+                    'UPDATE analyses SET atime = ? WHERE key = ?',
+                    [(now, key) for key, _ in rows])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, analyses):
+        """Store a dict from strings to lists of (form, lemma, pos, tag)"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)',
+                [(self.key(s), json.dumps(value, ensure_ascii=False), now)
+                 for s, value in analyses.items()])
+
+    def evict(self):
+        """Drop least-recently-used entries beyond `max_entries`"""
+        n = self.conn.execute('SELECT COUNT(*) FROM analyses').fetchone()[0]
+        if n <= self.max_entries:
+            return 0
+        with self.conn:
+            self.conn.execute(
+                'DELETE FROM analyses WHERE key IN (SELECT key FROM analyses '
+                'ORDER BY atime LIMIT ?)', (n - self.max_entries,))
+        self.evicted += n - self.max_entries
+        return n - self.max_entries
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total > 0 else 0.0,
+                'evicted': self.evicted}
+
+    def close(self):
+        self.evict()
+        self.conn.close()
+
+
+def analyze_with_cache(words, analyze_batch, cache=None):
+    """Analyze words with `analyze_batch` (list of words -> list of analyses)
+    only if they are not cached, and return a dict from words to analyses"""
+    if cache is None:
+        return dict(zip(words, analyze_batch(words)))
+    analyses = cache.get_many(words)
+    missing = [w for w in words if w not in analyses]
+    if len(missing) > 0:
+        new = dict(zip(missing, analyze_batch(missing)))
+        cache.put_many(new)
+        analyses.update(new)
+    return analyses
+
+
+def main(args):
+    conn = sqlite3.connect(args.path_cache)
+    n, size = conn.execute('SELECT COUNT(*), SUM(LENGTH(value)) '
+                           'FROM analyses').fetchone()
+    print('entries\t{}'.format(n))
+    print('bytes\t{}'.format(size or 0))
+    if args.max_entries is not None:
+        cache = AnalysisCache(args.path_cache, 'n/a',
+                              max_entries=args.max_entries)
+        cache.close()
+        print('evicted\t{}'.format(cache.evicted))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path_cache', help='path to a cache file')
+    parser.add_argument('--max-entries', type=int,
+                        help='evict least-recently-used entries beyond this')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""UDPipe/MeCab analyzers shared by the lexicon-building scripts.
+
+An analyzer takes a list of strings and returns, for each of them, a list of
+(form, lemma, pos, tag) tuples.
+"""
+
+from itertools import chain
+import multiprocessing
+
+from analysis_cache import DEFAULT_MAX_ENTRIES
+from analysis_cache import AnalysisCache
+from analysis_cache import analyze_with_cache
+
+SYMBOLS = {'～', '…'}  # skipped in MWE entries
+
+MECAB_BOS_NODE, MECAB_EOS_NODE = 2, 3  # MeCab.Node.stat
+
+
+def setup_mecab_tagger(dict_name):
+    """Return (MeCab.Tagger, whether features are reformatted by -O)"""
+    import MeCab
+    import subprocess
+
+    if dict_name not in ['ipadic', 'unidic']:
+        raise NotImplementedError('Unknown dictionary: ' + dict_name)
+    dir_dict = subprocess.check_output(
+        'mecab-config --dicdir'.split()).strip().decode('utf_8')
+    opt = ''
+    if dict_name == 'unidic':
+        opt += '--dicdir={}/unidic -Oipadic'.format(dir_dict)
+    return MeCab.Tagger(opt), '-O' in opt
+
+
+def mecab_tokens(tagger, word, formatted=False):
+    """Analyze a word with MeCab's node API. With `formatted`, features are
+    taken from the output format (e.g. -Oipadic) instead of the dictionary"""
+    tokens = []
+    node = tagger.parseToNode(word)
+    while node is not None:
+        if node.stat in (MECAB_BOS_NODE, MECAB_EOS_NODE):
+            node = node.next
+            continue
+        form = node.surface
+        if formatted:
+            feats = tagger.formatNode(node).rstrip('\n').split('\t', 1)[-1]
+        else:
+            feats = node.feature
+        feats = feats.split(',')
+        lemma = feats[6] if len(feats) == 9 else form
+        tokens.append((form, lemma, feats[0], ''))
+        node = node.next
+    return tokens
+
+
+def mecab_dictionary_file(dict_name):
+    """Return the path of the system dictionary (sys.dic) of a tagger"""
+    tagger, _ = setup_mecab_tagger(dict_name)
+    return tagger.dictionary_info().filename
+
+
+def setup_mecab_analyzer(dict_name):
+    tagger, formatted = setup_mecab_tagger(dict_name)
+    return lambda words: [mecab_tokens(tagger, w, formatted=formatted)
+                          for w in words]
+
+
+def setup_udpipe_analyzer(lang, path_model, batch_size=256):
+    import spacy_udpipe
+
+    assert path_model is not None
+    nlp = spacy_udpipe.load_from_path(lang, path_model)
+    return lambda words: [
+        [(token.text, token.lemma_, token.pos_, token.tag_) for token in doc]
+        for doc in nlp.pipe(words, batch_size=batch_size)]
+
+
+def setup_whitespace_analyzer():
+    """Stand-in analyzer (whitespace tokenization, lemma = lowercased form)
+    for benchmarks without UDPipe/MeCab models"""
+    return lambda words: [[(form, form.lower(), 'X', '_')
+                           for form in word.split()] for word in words]
+
+
+def setup_analyzer(analyzer, lang=None, path_model=None, dictionary=None,
+                   batch_size=256):
+    """Return a function that analyzes a list of strings"""
+    if analyzer == 'whitespace':
+        return setup_whitespace_analyzer()
+    if analyzer == 'mecab':
+        return setup_mecab_analyzer(dictionary)
+    if analyzer == 'udpipe':
+        return setup_udpipe_analyzer(lang, path_model, batch_size=batch_size)
+    raise NotImplementedError('Unknown analyzer: ' + analyzer)
+
+
+def open_cache(path_cache, analyzer, lang=None, path_model=None,
+               dictionary=None, max_entries=DEFAULT_MAX_ENTRIES):
+    """Open a cache whose keys include the analyzer, the hash of its model
+    (UDPipe) or system dictionary (MeCab) and the language"""
+    if path_cache is None:
+        return None
+    if analyzer == 'mecab':
+        return AnalysisCache(path_cache, analyzer,
+                             path_model=mecab_dictionary_file(dictionary),
+                             dictionary=dictionary, max_entries=max_entries)
+    return AnalysisCache(path_cache, analyzer, path_model=path_model,
+                         lang=lang or '', max_entries=max_entries)
+
+
+_analyze_batch = None  # analyzer loaded in each worker process
+
+
+def _init_worker(*setup_args):
+    global _analyze_batch
+    _analyze_batch = setup_analyzer(*setup_args)
+
+
+def _analyze_worker(words):
+    return _analyze_batch(words)
+
+
+def analyze_words(words, analyzer, lang=None, path_model=None,
+                  dictionary=None, batch_size=256, workers=1, cache=None):
+    """Analyze unique words in batches (optionally with a process pool, each
+    worker loading its own model) and return a dict from a word to its
+    analysis. Only words missing in `cache` are analyzed."""
+    setup_args = (analyzer, lang, path_model, dictionary, batch_size)
+
+    def analyze_all(words):
+        batches = [words[i:i + batch_size]
+                   for i in range(0, len(words), batch_size)]
+        if workers <= 1:
+            analyze_batch = setup_analyzer(*setup_args)
+            return list(chain.from_iterable(map(analyze_batch, batches)))
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=setup_args) as pool:
+            results = pool.imap(_analyze_worker, batches)
+            return list(chain.from_iterable(results))
+    return analyze_with_cache(words, analyze_all, cache=cache)
+
+
+_analyze_mecab_batches = None  # analyzers of each dictionary in a worker
+
+
+def _init_mecab_worker(dictionaries):
+    global _analyze_mecab_batches
+    _analyze_mecab_batches = [setup_mecab_analyzer(dictionary)
+                              for dictionary in dictionaries]
+
+
+def _analyze_mecab_worker(words):
+    return [analyze_batch(words) for analyze_batch in _analyze_mecab_batches]
+
+
+def analyze_words_mecab(words, dictionaries, batch_size=256, workers=1,
+                        caches=None):
+    """Analyze unique words with several MeCab dictionaries in one pass (each
+    worker process holding a Tagger per dictionary) and return a dict from a
+    dictionary to {word: analysis}. `caches` maps dictionaries to caches;
+    words cached for all the dictionaries are not analyzed."""
+    caches = caches or {}
+    found = {dictionary: caches[dictionary].get_many(words)
+             if caches.get(dictionary) is not None else {}
+             for dictionary in dictionaries}
+    missing = [w for w in words
+               if any(w not in found[dictionary] for dictionary in dictionaries)]
+    batches = [missing[i:i + batch_size]
+               for i in range(0, len(missing), batch_size)]
+    if workers <= 1:
+        _init_mecab_worker(dictionaries)
+        results = map(_analyze_mecab_worker, batches)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_mecab_worker,
+                                    initargs=(dictionaries,))
+        results = pool.imap(_analyze_mecab_worker, batches)
+    new = {dictionary: {} for dictionary in dictionaries}
+    for batch, analyses in zip(batches, results):
+        for dictionary, batch_analyses in zip(dictionaries, analyses):
+            new[dictionary].update(zip(batch, batch_analyses))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    for dictionary in dictionaries:
+        new_analyses = {w: a for w, a in new[dictionary].items()
+                        if w not in found[dictionary]}
+        if caches.get(dictionary) is not None and len(new_analyses) > 0:
+            caches[dictionary].put_many(new_analyses)
+        found[dictionary].update(new_analyses)
+    return found
+
+
+def to_mwe_entry(tokens, analyzer):
+    """Convert an analysis into a `form@@@lemma@@@pos` entry (joined with
+    tabs) as counted by utils.write_mwe_json. Return None for one-token
+    entries."""
+    buff = []
+    for form, lemma, pos, tag in tokens:
+        if form in SYMBOLS:  # skip symbols
+            continue
+        if analyzer == 'udpipe':
+            if not isinstance(lemma, str) or len(lemma) == 0:
+                lemma = form
+            buff.append('@@@'.join([form, lemma.lower(), f'{pos}-{tag}']))
+        else:
+            buff.append('@@@'.join([form, lemma, pos]))
+    if len(buff) == 1:
+        return None
+    return '\t'.join(buff)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Approximate nearest-neighbour (cosine) index of embeddings for
+evaluate_bli.py.
+
+python ann_index.py emb/wiki.en.mwe.npy -o emb/wiki.en.mwe.ivf --n-probe 4 16 64 -v
+
+builds an inverted-file (IVF) index: the vectors are clustered by spherical
+k-means into `--lists` lists (about 4 x sqrt(# of words) by default) and a
+query is compared only with the vectors of its `--n-probe` nearest lists.
+The vectors are written reordered by list to a memory-mapped
+emb/wiki.en.mwe.ivf.vectors.npy as they are normalized (so the matrix is
+never copied in memory) and memory-mapped when loaded. After building,
+recall@10 against exact search (over blocks of the matrix) and queries/sec
+are reported for each `--n-probe` on `--recall-sample` vocabulary words.
+"""
+
+from os import path
+import argparse
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+
+from embeddings import load_embeddings
+from metrics import Metrics
+from metrics import add_metrics_arguments
+
+verbose = False
+logger = None
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+def top_k(scores, k):
+    """Return the column indexes of the `k` largest scores of each row,
+    in descending order"""
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def normalize_rows(matrix):
+    matrix = np.array(matrix, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-8)
+    return matrix
+
+
+def assign(matrix, centroids, batch_size=4096):
+    """Return the nearest centroid of each (normalized) row"""
+    labels = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), batch_size):
+        block = normalize_rows(matrix[start:start + batch_size])
+        labels[start:start + batch_size] = np.argmax(block @ centroids.T,
+                                                     axis=1)
+    return labels
+
+
+def spherical_kmeans(sample, n_clusters, n_iter=10, seed=0):
+    """Cluster unit vectors by cosine similarity and return the centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        labels = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = np.flatnonzero(np.bincount(labels, minlength=n_clusters) == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty),
+                                        replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex(object):
+    """Inverted-file index: vectors (reordered by list) of list l are
+    `vectors[offsets[l]:offsets[l + 1]]` and their rows are `ids[...]`"""
+
+    def __init__(self, centroids, offsets, ids, vectors):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, matrix, n_lists=0, n_iter=10, sample_size=100000,
+              dtype='float32', seed=0, path_vectors=None):
+        """Build an index of the rows of `matrix` (normalized in the index).
+        The vectors are written to a memory-mapped `path_vectors` if given"""
+        n = len(matrix)
+        if n_lists <= 0:
+            n_lists = max(1, int(4 * np.sqrt(n)))
+        n_lists = min(n_lists, n)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, min(n, max(sample_size, n_lists)),
+                                    replace=False))
+        centroids = spherical_kmeans(normalize_rows(matrix[sample]), n_lists,
+                                     n_iter=n_iter, seed=seed)
+        labels = assign(matrix, centroids)
+        ids = np.argsort(labels, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+        if path_vectors is None:
+            vectors = np.empty((n, matrix.shape[1]), dtype=dtype)
+        else:
+            vectors = np.lib.format.open_memmap(
+                path_vectors, mode='w+', dtype=dtype,
+                shape=(n, matrix.shape[1]))
+        for start in range(0, n, 65536):
+            vectors[start:start + 65536] = normalize_rows(
+                matrix[ids[start:start + 65536]])
+        if path_vectors is not None:
+            vectors.flush()
+        return cls(centroids, offsets, ids, vectors)
+
+    def save(self, prefix):
+        for name in ['centroids', 'offsets', 'ids', 'vectors']:
+            filename = '{}.{}.npy'.format(prefix, name)
+            array = getattr(self, name)
+            if isinstance(array, np.memmap) and \
+                    array.filename == path.abspath(filename):
+                array.flush()  # Built in place
+                continue
+            np.save(filename, array)
+        with open(prefix + '.json', 'w') as f:
+            json.dump({'words': len(self), 'lists': len(self.centroids),
+                       'dim': self.vectors.shape[1],
+                       'dtype': str(self.vectors.dtype)}, f, indent=2)
+
+    @classmethod
+    def load(cls, prefix):
+        """Load an index (ids and vectors memory-mapped)"""
+        load = lambda name, mmap_mode=None: np.load(
+            '{}.{}.npy'.format(prefix, name), mmap_mode=mmap_mode)
+        return cls(load('centroids'), load('offsets'), load('ids', 'r'),
+                   load('vectors', 'r'))
+
+    def search(self, queries, k=10, n_probe=16, batch_size=4096):
+        """Return (similarities, rows) of the approximate `k` nearest
+        neighbours of (normalized) queries; missing ones are (-inf, -1)"""
+        n_probe = min(n_probe, len(self.centroids))
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for start in range(0, len(queries), batch_size):
+            block = np.asarray(queries[start:start + batch_size],
+                               dtype=np.float32)
+            probes = top_k(block @ self.centroids.T, n_probe)
+            # Group the queries by list to score each list in one product
+            lists = probes.ravel()
+            order = np.argsort(lists, kind='stable')
+            owners = np.repeat(np.arange(len(block)), n_probe)[order]
+            bounds = np.searchsorted(lists[order], np.arange(
+                len(self.centroids) + 1))
+            best_scores = scores[start:start + len(block)]
+            best_rows = rows[start:start + len(block)]
+            for l in np.unique(lists):
+                begin, end = self.offsets[l], self.offsets[l + 1]
+                if begin == end:
+                    continue
+                qs = owners[bounds[l]:bounds[l + 1]]
+                sims = block[qs] @ np.asarray(self.vectors[begin:end],
+                                              dtype=np.float32).T
+                local = top_k(sims, k)
+                merged_scores = np.concatenate(
+                    [best_scores[qs],
+                     np.take_along_axis(sims, local, axis=1)], axis=1)
+                merged_rows = np.concatenate(
+                    [best_rows[qs], np.asarray(self.ids[begin:end])[local]],
+                    axis=1)
+                best = top_k(merged_scores, k)
+                best_scores[qs] = np.take_along_axis(merged_scores, best,
+                                                     axis=1)
+                best_rows[qs] = np.take_along_axis(merged_rows, best, axis=1)
+        return scores, rows
+
+
+def exact_search(queries, matrix, k=10, batch_size=256, block_size=65536,
+                 normalize=False):
+    """Return (similarities, rows) of the exact `k` nearest neighbours of
+    (normalized) queries. `matrix` (e.g. memory-mapped) is read once in blocks
+    of `block_size` rows, which are normalized if `normalize`"""
+    k = min(k, len(matrix))
+    scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    rows = np.full(scores.shape, -1, dtype=np.int64)
+    for begin in range(0, len(matrix), block_size):
+        block = matrix[begin:begin + block_size]
+        block = normalize_rows(block) if normalize \
+            else np.asarray(block, dtype=np.float32)
+        for start in range(0, len(queries), batch_size):
+            end = start + batch_size
+            sims = np.asarray(queries[start:end], dtype=np.float32) @ block.T
+            local = top_k(sims, k)
+            merged_scores = np.concatenate(
+                [scores[start:end], np.take_along_axis(sims, local, axis=1)],
+                axis=1)
+            merged_rows = np.concatenate([rows[start:end], local + begin],
+                                         axis=1)
+            best = top_k(merged_scores, k)
+            scores[start:end] = np.take_along_axis(merged_scores, best, axis=1)
+            rows[start:end] = np.take_along_axis(merged_rows, best, axis=1)
+    return scores, rows
+
+
+def recall_at_k(rows, exact_rows):
+    """Ratio of the exact neighbours found"""
+    found = [len(set(a) & set(b)) for a, b in zip(rows.tolist(),
+                                                 exact_rows.tolist())]
+    return sum(found) / max(exact_rows.size, 1)
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    metrics = Metrics.from_args('ann_index', args)
+    with metrics.stage('read') as stage:
+        emb = load_embeddings(args.path_input, max_vocab=args.max_vocab)
+        stage['items'] = len(emb)
+    prefix = args.path_output or path.splitext(args.path_input)[0] + '.ivf'
+    time_start = time.time()
+    with metrics.stage('build') as stage:
+        index = IVFIndex.build(emb.matrix, n_lists=args.lists,
+                               n_iter=args.iterations,
+                               sample_size=args.sample_size, dtype=args.dtype,
+                               seed=args.seed,
+                               path_vectors=prefix + '.vectors.npy')
+        index.save(prefix)
+        stage['items'] = len(index)
+    if verbose:
+        logger.info('Indexed {} vectors in {} lists in {:.1f} sec ({}.*)'.format(
+            len(index), len(index.centroids), time.time() - time_start,
+            prefix))
+
+    if args.recall_sample <= 0:
+        metrics.finish(logger if verbose else None)
+        return 0
+    rng = np.random.default_rng(args.seed)
+    sample = np.sort(rng.choice(len(emb), min(args.recall_sample, len(emb)),
+                                replace=False))
+    queries = normalize_rows(emb.matrix[sample])
+    with metrics.stage('search:exact') as stage:
+        _, exact_rows = exact_search(queries, emb.matrix, k=10,
+                                     normalize=not emb.normalized)
+        stage['items'] = len(queries)
+    exact_qps = len(queries) / max(stage['wall_seconds'], 1e-9)
+    print('\t'.join(['n_probe', 'recall@10', 'queries/sec']))
+    print('\t'.join(['exact', '1.0000', '{:.1f}'.format(exact_qps)]))
+    for n_probe in args.n_probe:
+        with metrics.stage('search:{}'.format(n_probe)) as stage:
+            _, rows = index.search(queries, k=10, n_probe=n_probe)
+            stage['items'] = len(queries)
+        qps = len(queries) / max(stage['wall_seconds'], 1e-9)
+        print('\t'.join([str(n_probe),
+                         '{:.4f}'.format(recall_at_k(rows, exact_rows)),
+                         '{:.1f}'.format(qps)]), flush=True)
+    metrics.finish(logger if verbose else None)
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('ANN')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path_input',
+                        help='path to embeddings (a store of embeddings.py '
+                             'or a text file)')
+    parser.add_argument('-o', '--output', dest='path_output',
+                        help='output prefix (default: input without its '
+                             'extension + .ivf)')
+    parser.add_argument('--lists', type=int, default=0,
+                        help='number of lists (0: 4 x sqrt(# of words))')
+    parser.add_argument('--iterations', type=int, default=10,
+                        help='number of k-means iterations')
+    parser.add_argument('--sample-size', type=int, default=100000,
+                        help='number of vectors for k-means')
+    parser.add_argument('--dtype', choices=['float32', 'float16'],
+                        default='float32', help='type of indexed vectors')
+    parser.add_argument('--max-vocab', type=int, default=0,
+                        help='index only the first words (0: all)')
+    parser.add_argument('--recall-sample', type=int, default=1000,
+                        help='number of words to measure recall with')
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[4, 16, 64],
+                        help='numbers of probed lists to measure recall with')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
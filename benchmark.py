@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark the lexicon-building stages on synthetic data.
+
+Synthetic wn-wikt-*.tab files, cupt files, JSON lexicons and corpora are
+generated in a temporary directory (sizes multiplied by `--scale`), and the
+whitespace analyzer (analyzers.setup_whitespace_analyzer) stands in for
+UDPipe/MeCab. Results are written as JSON:
+
+{"meta": {...}, "results": [{"name": ..., "seconds": ..., "items": ...,
+                             "items_per_sec": ..., "peak_bytes": ...}, ...]}
+
+python benchmark.py --scale 1 -o bench.json -v
+python benchmark.py --only cupt2json pretokenize --memory
+"""
+
+from argparse import Namespace
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from metrics import peak_rss
+
+verbose = False
+logger = None
+
+TYPES = ['LVC.full', 'VPC.full', 'IAV', 'VID', 'IRV']
+POS = [('NOUN', 'NN'), ('VERB', 'VB'), ('ADJ', 'JJ'), ('ADP', 'IN'),
+       ('DET', 'DT')]
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+def make_vocab(rng, size):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return sorted(set(''.join(rng.choice(letters)
+                              for _ in range(rng.randint(2, 9)))
+                      for _ in range(size)))
+
+
+def make_phrase(rng, vocab, max_len=4):
+    return ' '.join(rng.choice(vocab) for _ in range(rng.randint(1, max_len)))
+
+
+def generate_tab(filename, rng, vocab, n_synsets, code='eng'):
+    """Write a wn-wikt-*.tab file (some lines with `,`-separated lemmas)"""
+    with open(filename, 'w') as f:
+        f.write('# Wiktionary\thttp://wiktionary.org/\tCC BY-SA\n')
+        for i in range(n_synsets):
+            synset = '{:08d}-{}'.format(i, rng.choice('nvar'))
+            for _ in range(rng.randint(1, 3)):
+                lemmas = [make_phrase(rng, vocab)
+                          for _ in range(rng.choice([1, 1, 1, 2, 3]))]
+                sep = rng.choice([', ', '，'])
+                f.write('{}\t{}:lemma\t{}\n'.format(synset, code,
+                                                     sep.join(lemmas)))
+
+
+def generate_cupt(filename, rng, vocab, n_sentences):
+    """Write a cupt file with contiguous and discontinuous MWEs"""
+    with open(filename, 'w') as f:
+        for s in range(n_sentences):
+            f.write('# sent_id = {}\n'.format(s))
+            n = rng.randint(5, 25)
+            tags = ['*'] * n
+            for mwe_id in range(1, rng.randint(0, 3) + 1):
+                i = rng.randrange(n)
+                j = min(n - 1, i + rng.choice([1, 1, 2, 3]))
+                if i == j:
+                    continue
+                for k, tag in [(i, '{}:{}'.format(mwe_id, rng.choice(TYPES))),
+                               (j, str(mwe_id))]:
+                    tags[k] = tag if tags[k] == '*' else tags[k] + ';' + tag
+            for i in range(n):
+                form = rng.choice(vocab)
+                upos, xpos = rng.choice(POS)
+                f.write('\t'.join([str(i + 1), form, form.lower(), upos, xpos,
+                                   '_', '_', '_', '_', '_', tags[i]]) + '\n')
+            f.write('\n')
+
+
+def generate_lexicon(filename, rng, vocab, n_entries, source='EOMW'):
+    """Write an MWE lexicon in JSON format"""
+    with open(filename, 'w') as f:
+        for _ in range(n_entries):
+            n = rng.randint(2, 4)
+            tokens = [rng.choice(vocab) for _ in range(n)]
+            row = {'token': ' '.join(tokens),
+                   'lemma': ' '.join(tokens).lower(),
+                   'pos': ' '.join('-'.join(rng.choice(POS))
+                                   for _ in range(n)),
+                   'freq': rng.randint(1, 100),
+                   'source': source}
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def generate_corpus(filename, rng, vocab, mwes, n_lines):
+    """Write a whitespace-tokenized corpus containing some lexicon MWEs"""
+    with open(filename, 'w') as f:
+        for _ in range(n_lines):
+            tokens = []
+            while len(tokens) < 25:
+                if rng.random() < 0.05 and len(mwes) > 0:
+                    tokens.extend(rng.choice(mwes))
+                else:
+                    tokens.append(rng.choice(vocab))
+            f.write(' '.join(tokens) + '\n')
+
+
+def measure(name, func, memory=False, repeat=1):
+    """Run func (returning the number of processed items) and its stats"""
+    best = None
+    for _ in range(repeat):
+        if memory:
+            tracemalloc.start()
+        time_start = time.perf_counter()
+        cpu_start = time.process_time()
+        items = func()
+        seconds = time.perf_counter() - time_start
+        cpu = time.process_time() - cpu_start
+        peak = None
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if best is None or seconds < best['seconds']:
+            best = {'name': name, 'seconds': seconds, 'cpu_seconds': cpu,
+                    'items': items,
+                    'items_per_sec': items / seconds if seconds > 0 else None,
+                    'peak_bytes': peak}
+    if verbose:
+        logger.info('{}: {:.3f} sec, {} items ({:.1f}/sec)'.format(
+            name, best['seconds'], best['items'], best['items_per_sec'] or 0))
+    return best
+
+
+def benchmarks(dir_work, scale=1.0, seed=0):
+    """Generate synthetic data and return [(name, func)]"""
+    import combine_json
+    import cupt2json
+    import extract_mwe_pairs
+    import json2xml
+    import pretokenize
+    import split_eomw_entry
+    from analyzers import analyze_words
+
+    rng = random.Random(seed)
+    n = lambda k: max(1, int(k * scale))
+    vocab = make_vocab(rng, n(20000))
+    path = lambda name: os.path.join(dir_work, name)
+
+    generate_tab(path('wn-wikt-eng.tab'), rng, vocab, n(50000), code='eng')
+    generate_tab(path('wn-wikt-spa.tab'), rng, vocab, n(50000), code='spa')
+    generate_cupt(path('train.cupt'), rng, vocab, n(50000))
+    generate_lexicon(path('a.json'), rng, vocab, n(50000))
+    generate_lexicon(path('b.json'), rng, vocab, n(50000), source='PARSEME')
+    mwes = [tuple(row['lemma'].split()) for row in
+            map(json.loads, open(path('a.json')))]
+    generate_corpus(path('corpus.txt'), rng, vocab, mwes[:1000], n(100000))
+
+    def bench_split():
+        counter = 0
+        for dat in split_eomw_entry.read_tab(path('wn-wikt-eng.tab')):
+            counter += 1
+        return counter
+
+    def bench_analyze():
+        words = sorted(set(row[2] for row in
+                           split_eomw_entry.read_tab(path('wn-wikt-eng.tab'))))
+        return len(analyze_words(words, 'whitespace'))
+
+    def bench_cupt():
+        return sum(1 for _ in cupt2json.iter_mwes(path('train.cupt')))
+
+    def bench_combine():
+        combine_json.main(Namespace(path_input=[path('a.json'),
+                                                path('b.json')],
+                                    path_output=path('combined.json'),
+                                    max_entries=None, dir_tmp=None,
+                                    verbose=False))
+        return n(50000) * 2
+
+    def bench_json2xml():
+        json2xml.main(Namespace(path_input=[path('a.json'), path('b.json')],
+                                path_output=path('out.xml'), col='lemma',
+                                presorted=False, max_entries=None,
+                                dir_tmp=None, gzip=False, verbose=False))
+        return n(50000) * 2
+
+    def bench_pairs():
+        tabs = {}
+        for code in ['eng', 'spa']:
+            with open(path(f'wn-wikt-{code}.split.tkn.tab'), 'w') as f:
+                f.write('# header\n')
+                for synset, lemma, word in split_eomw_entry.read_tab(
+                        path(f'wn-wikt-{code}.tab')):
+                    if synset.startswith('#'):
+                        continue
+                    f.write('\t'.join([synset, lemma,
+                                       word.replace(' ', '_')]) + '\n')
+            tabs[code] = extract_mwe_pairs.read_lexicon(
+                path(f'wn-wikt-{code}.split.tkn.tab'))
+        _, counter = extract_mwe_pairs.write_pairs(tabs['eng'], tabs['spa'],
+                                                   path('en-es.mwe.txt'))
+        return counter
+
+    def bench_pretokenize():
+        trie = pretokenize.build_trie(pretokenize.load_lexicon(
+            [path('a.json'), path('b.json')]))
+        counter = 0
+        with open(path('corpus.txt')) as f:
+            for _ in pretokenize.pretokenize_lines(f, trie):
+                counter += 1
+        return counter
+
+    def bench_pretokenize_gappy():
+        trie = pretokenize.build_trie(pretokenize.load_lexicon(
+            [path('a.json'), path('b.json')]))
+        counter = 0
+        with open(path('corpus.txt')) as f:
+            for _ in pretokenize.pretokenize_lines(f, trie, max_gap=2):
+                counter += 1
+        return counter
+
+    return [('split_eomw_entry.read_tab', bench_split),
+            ('analyzers.analyze_words(whitespace)', bench_analyze),
+            ('cupt2json.read_cupt', bench_cupt),
+            ('combine_json', bench_combine),
+            ('json2xml', bench_json2xml),
+            ('extract_mwe_pairs', bench_pairs),
+            ('pretokenize', bench_pretokenize),
+            ('pretokenize(max_gap=2)', bench_pretokenize_gappy)]
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    dir_work = tempfile.mkdtemp(prefix='mwe-bench.', dir=args.dir_tmp)
+    try:
+        if verbose:
+            logger.info('Generate synthetic data in ' + dir_work)
+        time_start = time.perf_counter()
+        benches = benchmarks(dir_work, scale=args.scale, seed=args.seed)
+        time_generate = time.perf_counter() - time_start
+        results = []
+        for name, func in benches:
+            if args.only is not None \
+               and not any(name.startswith(o) for o in args.only):
+                continue
+            results.append(measure(name, func, memory=args.memory,
+                                   repeat=args.repeat))
+    finally:
+        shutil.rmtree(dir_work)
+
+    report = {'meta': {'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'cpus': os.cpu_count(),
+                       'scale': args.scale,
+                       'seed': args.seed,
+                       'repeat': args.repeat,
+                       'generate_seconds': time_generate,
+                       'peak_rss_bytes': peak_rss(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+              'results': results}
+    if args.path_output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.path_output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('Bench')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier of the synthetic data sizes')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='report the best of this many runs')
+    parser.add_argument('--only', nargs='+',
+                        help='run benchmarks whose names start with these')
+    parser.add_argument('--memory', action='store_true', default=False,
+                        help='measure peak Python memory with tracemalloc '
+                             '(slows down the benchmarks)')
+    parser.add_argument('--tmp-dir', dest='dir_tmp',
+                        help='directory for synthetic data')
+    parser.add_argument('-o', '--output', dest='path_output',
+                        help='path to a JSON report (default: stdout)')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Analyze an EOMW file once and write both the tokenized TSV (as
+tokenize_wn-wikt.py) and the MWE lexicon in JSON (as wnwikt2json_*.py), and
+optionally its XML (as json2xml.py).
+
+python build_eomw_lexicon.py data/wikt/wn-wikt-eng.split.tab --lang en \
+    --model udpipe_models/english-ud-2.0-conll17-170315.udpipe \
+    --tkn-output data/wikt/wn-wikt-eng.split.tkn.tab \
+    --json-output data/mwelex/en-eomw.v1.json \
+    --xml-output data/mwelex/en-eomw.v1.xml -v
+
+python build_eomw_lexicon.py data/wikt/wn-wikt-jpn.split.tab --analyzer mecab --dict ipadic \
+    --tkn-output data/wikt/wn-wikt-jpn-ipadic.split.tkn.tab \
+    --json-output data/mwelex/ja-ipadic-eomw.v1.json -v
+
+The tokenized TSV has the rows kept by tokenize_wn-wikt.py (lines with at
+least three fields that do not start with '#') and the lexicon the surfaces
+read by wnwikt2json_*.py (utils.read_surfaces), so both files are identical
+to theirs. build_lexicon() is shared with build_lexicons.py.
+"""
+
+from collections import defaultdict
+import argparse
+import logging
+import sys
+
+from analysis_cache import DEFAULT_MAX_ENTRIES
+from analyzers import analyze_words
+from analyzers import open_cache
+from analyzers import to_mwe_entry
+from metrics import Metrics
+from metrics import add_metrics_arguments
+from opencc_convert import get_converter
+from utils import escape
+from utils import read_surfaces
+from utils import read_tab_rows
+from utils import write_json2xml
+from utils import write_mwe_json
+from utils import write_tokenized_tab
+
+verbose = False
+logger = None
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+def count_mwes(words, analyses, analyzer):
+    counter = defaultdict(int)
+    for word in words:
+        entry = to_mwe_entry(analyses[word], analyzer)
+        if entry is None:
+            continue
+        counter[entry] += 1
+    return counter
+
+
+def lemma_of(entry):
+    """Return the space-separated lemma of a `form@@@lemma@@@pos` entry"""
+    return ' '.join(token.split('@@@')[1] for token in entry.split('\t'))
+
+
+def build_lexicon(path_input, analyze, analyzer, path_tkn=None,
+                  path_json=None, path_xml=None, source='EOMW',
+                  convert_input=None, convert_output=None, metrics=None):
+    """Analyze the words of a wn-wikt-*.tab file once with `analyze` (a list
+    of words -> {word: analysis}) and write the tokenized TSV, JSON and XML
+    lexicons (if their paths are given). Strings are converted by OpenCC
+    configurations `convert_input` before analysis and `convert_output`
+    when written. Return a dict of statistics"""
+    if metrics is None:
+        metrics = Metrics('build_eomw_lexicon')
+    with metrics.stage('read') as stage:
+        rows, skipped = read_tab_rows(path_input)
+        n_rows, surfaces = read_surfaces(path_input)
+        convert = get_converter(convert_input)
+        if convert is not None:
+            for row in rows:
+                if isinstance(row, list):
+                    row[2] = convert(row[2])
+            surfaces = set(map(convert, surfaces))
+        words = sorted(set(row[2] for row in rows if isinstance(row, list))
+                       | surfaces)
+        stage['items'] = len(rows)
+
+    with metrics.stage('analysis') as stage:
+        analyses = analyze(words)
+        stage['items'] = len(words)
+    analysis_seconds = stage['wall_seconds']
+
+    convert = get_converter(convert_output)
+    if path_tkn is not None:
+        with metrics.stage('write:tkn') as stage:
+            write_tokenized_tab(path_tkn, rows, analyses, convert=convert)
+            stage['items'] = len(rows)
+
+    with metrics.stage('aggregation') as stage:
+        counter = count_mwes(sorted(surfaces), analyses, analyzer)
+        stage['items'] = len(surfaces)
+    if path_json is not None:
+        with metrics.stage('write:json') as stage:
+            write_mwe_json(path_json, counter, source=source, convert=convert)
+            stage['items'] = len(counter)
+    if path_xml is not None:
+        lemmas = map(lemma_of, counter)
+        if convert is not None:
+            lemmas = map(convert, lemmas)
+        mwes = {escape(lemma): None for lemma in lemmas}
+        with metrics.stage('write:xml') as stage:
+            write_json2xml(path_xml, mwes)
+            stage['items'] = len(mwes)
+    return {'rows': n_rows, 'skipped': skipped, 'words': len(words),
+            'entries': len(counter), 'analysis_seconds': analysis_seconds}
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    if args.analyzer == 'udpipe' and (args.path_model is None
+                                      or args.lang is None):
+        logger.error('--model and --lang are required for UDPipe')
+        return 1
+
+    metrics = Metrics.from_args('build_eomw_lexicon', args)
+    cache = open_cache(args.path_cache, args.analyzer, lang=args.lang,
+                       path_model=args.path_model, dictionary=args.dict,
+                       max_entries=args.cache_size)
+
+    def analyze(words):
+        if verbose:
+            logger.info('# of words: ' + str(len(words)))
+        return analyze_words(words, args.analyzer, lang=args.lang,
+                             path_model=args.path_model, dictionary=args.dict,
+                             batch_size=args.batch_size,
+                             workers=args.workers, cache=cache)
+
+    if verbose:
+        logger.info('Read ' + args.path_input)
+    stats = build_lexicon(args.path_input, analyze, args.analyzer,
+                          path_tkn=args.path_tkn, path_json=args.path_json,
+                          path_xml=args.path_xml, source=args.source,
+                          metrics=metrics)
+    skipped = stats['skipped']
+    for i, line in skipped:
+        logger.warning('Skip [{}]'.format(i) + line)
+    if cache is not None:
+        cache.close()
+        if verbose:
+            logger.info('Cache: {}'.format(cache.stats()))
+    if verbose:
+        logger.info('Analyzed {} words in {:.1f} sec ({:.1f} words/sec)'.format(
+            stats['words'], stats['analysis_seconds'],
+            stats['words'] / max(stats['analysis_seconds'], 1e-9)))
+        for filename in [args.path_tkn, args.path_json, args.path_xml]:
+            if filename is not None:
+                logger.info('Wrote ' + filename)
+        logger.info('# of entries: {}'.format(stats['entries']))
+
+    metrics.finish(logger if verbose else None)
+
+    if len(skipped) > 0:
+        logger.warning('Skipped {} lines'.format(len(skipped)))
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('EOMW')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path_input', help='path to input file')
+    parser.add_argument('--analyzer', choices=['udpipe', 'mecab', 'whitespace'],
+                        default='udpipe', help='analyzer')
+    parser.add_argument('--lang', help='language (UDPipe)')
+    parser.add_argument('--model', dest='path_model',
+                        help='path to a model file (UDPipe)')
+    parser.add_argument('--dict', choices=['ipadic', 'unidic'],
+                        default='ipadic', help='MeCab dictionary')
+    parser.add_argument('--tkn-output', dest='path_tkn',
+                        help='path to a tokenized TSV file')
+    parser.add_argument('--json-output', dest='path_json',
+                        help='path to an MWE lexicon in JSON format')
+    parser.add_argument('--xml-output', dest='path_xml',
+                        help='path to an MWE lexicon in XML format')
+    parser.add_argument('-s', '--source', default='EOMW',
+                        help='data source')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='number of words analyzed at once')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes '
+                             '(each loads its own model)')
+    parser.add_argument('--cache', dest='path_cache',
+                        help='path to an analysis cache (SQLite) file')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_ENTRIES,
+                        help='maximum number of cached analyses')
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
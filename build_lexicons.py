@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Build the EOMW MWE lexicons (as wnwikt2json_*.py) and tokenized lexicons
+(as tokenize_wn-wikt.py) of many languages concurrently.
+
+python build_lexicons.py --langs en es de ja-ipadic zh --workers 4 --max-models 1 \
+    --cache data/analysis.cache.db -v
+
+Each language is a job run by one of `--workers` processes: it reads
+wn-wikt-*.split.tab, analyzes its surfaces once for both outputs and writes
+them as soon as it is done (build_eomw_lexicon.build_lexicon, so the outputs
+are identical to those of build_eomw_lexicon.py). A worker keeps at most
+`--max-models` models loaded (least recently used ones are released), so at
+most workers x max_models models are in memory; `--workers` defaults to 1.
+Progress of all the running languages is logged every `--progress-interval`
+seconds.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+import argparse
+import asyncio
+import gc
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from analysis_cache import DEFAULT_MAX_ENTRIES
+from analysis_cache import analyze_with_cache
+from analyzers import open_cache
+from analyzers import setup_analyzer
+from build_eomw_lexicon import build_lexicon
+from metrics import Metrics
+from metrics import add_metrics_arguments
+from pipeline import ALL_LANGS
+from pipeline import EOMW
+from pipeline import UDPIPE_MODEL
+
+verbose = False
+logger = None
+
+_models = OrderedDict()  # LRU of analyzers loaded in a worker process
+_max_models = 1
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+class Job(object):
+    """Analysis of the EOMW lexicon of a language"""
+
+    def __init__(self, lang, analyzer, path_input, path_json, path_tkn,
+                 model_lang=None, path_model=None, dictionary=None,
+                 convert_input=None, convert_output=None):
+        self.lang = lang
+        self.analyzer = analyzer
+        self.path_input = path_input
+        self.path_json = path_json
+        self.path_tkn = path_tkn
+        self.model_lang = model_lang
+        self.path_model = path_model
+        self.dictionary = dictionary
+        self.convert_input = convert_input
+        self.convert_output = convert_output
+
+    def __repr__(self):
+        return 'Job({})'.format(self.lang)
+
+
+def make_jobs(langs, dir_data='data', dir_models='udpipe_models'):
+    """Return jobs of languages (file names as pipeline.py)"""
+    wikt = lambda name: path.join(dir_data, 'wikt', 'wn-wikt-{}'.format(name))
+    lex = lambda name: path.join(dir_data, 'mwelex', name)
+    model = lambda name: path.join(dir_models, UDPIPE_MODEL.format(name))
+    jobs = []
+    for lang in langs:
+        if lang in EOMW:
+            code, name = EOMW[lang]
+            jobs.append(Job(lang, 'udpipe', wikt(code) + '.split.tab',
+                            lex(f'{lang}-eomw.v1.json'),
+                            wikt(code) + '.split.tkn.tab',
+                            model_lang=lang, path_model=model(name)))
+        elif lang == 'ja-unidic':
+            jobs.append(Job(lang, 'udpipe', wikt('jpn.split.tab'),
+                            lex('ja-unidic-eomw.v1.json'),
+                            wikt('jpn-unidic.split.tkn.tab'),
+                            model_lang='ja', path_model=model('japanese')))
+        elif lang == 'ja-ipadic':
+            jobs.append(Job(lang, 'mecab', wikt('jpn.split.tab'),
+                            lex('ja-ipadic-eomw.v1.json'),
+                            wikt('jpn-ipadic.split.tkn.tab'),
+                            dictionary='ipadic'))
+        elif lang == 'zh':
+            jobs.append(Job(lang, 'udpipe', wikt('cmn.split.tab'),
+                            lex('zh-eomw.v1.json'),
+                            wikt('cmn-simp.split.tkn.tab'),
+                            model_lang='zh', path_model=model('chinese'),
+                            convert_input='s2t', convert_output='t2s'))
+        else:
+            raise ValueError('Unknown language: ' + lang)
+    return jobs
+
+
+def _init_worker(max_models):
+    global _max_models
+    _max_models = max_models
+
+
+def get_model(analyzer, lang, path_model, dictionary, batch_size):
+    """Return an analyzer from the LRU of loaded models"""
+    key = (analyzer, lang, path_model, dictionary, batch_size)
+    if key in _models:
+        _models.move_to_end(key)
+        return _models[key]
+    while len(_models) >= _max_models:
+        _models.popitem(last=False)
+        gc.collect()
+    _models[key] = setup_analyzer(*key)
+    return _models[key]
+
+
+def run_job(job, queue, batch_size=256, path_cache=None,
+            cache_size=DEFAULT_MAX_ENTRIES, metrics_options=None):
+    """Analyze and write the lexicons of a language in a worker process.
+    Progress is put to `queue` as (lang, # of analyzed words, # of words).
+    Its stages (`LANG:STAGE`) are measured with Metrics(**metrics_options)
+    and returned for the report of the parent."""
+    time_start = time.time()
+    cache = open_cache(path_cache, job.analyzer, lang=job.model_lang,
+                       path_model=job.path_model, dictionary=job.dictionary,
+                       max_entries=cache_size)
+
+    def analyze_batches(words):
+        model = get_model(job.analyzer, job.model_lang, job.path_model,
+                          job.dictionary, batch_size)
+        analyses = []
+        for i in range(0, len(words), batch_size):
+            analyses.extend(model(words[i:i + batch_size]))
+            queue.put((job.lang, len(analyses), len(words)))
+        return analyses
+
+    def analyze(words):
+        queue.put((job.lang, 0, len(words)))
+        analyses = analyze_with_cache(words, analyze_batches, cache=cache)
+        queue.put((job.lang, len(words), len(words)))
+        return analyses
+
+    for filename in [job.path_tkn, job.path_json]:
+        os.makedirs(path.dirname(filename) or '.', exist_ok=True)
+    metrics = Metrics('build_lexicons.' + job.lang, **(metrics_options or {}))
+    stats = build_lexicon(job.path_input, analyze, job.analyzer,
+                          path_tkn=job.path_tkn, path_json=job.path_json,
+                          convert_input=job.convert_input,
+                          convert_output=job.convert_output, metrics=metrics)
+    if cache is not None:
+        cache.close()
+    for record in metrics.stages:
+        record['stage'] = '{}:{}'.format(job.lang, record['stage'])
+    return {'lang': job.lang, 'words': stats['words'],
+            'entries': stats['entries'], 'skipped': len(stats['skipped']),
+            'seconds': time.time() - time_start,
+            'cache': None if cache is None else cache.stats(),
+            'stages': metrics.stages}
+
+
+async def report_progress(queue, interval=10.0):
+    """Log the progress of running languages every `interval` seconds"""
+    loop = asyncio.get_running_loop()
+    progress = {}
+    last = time.time()
+    while True:
+        item = await loop.run_in_executor(None, queue.get)
+        if item is None:
+            break
+        lang, done, total = item
+        progress[lang] = (done, total)
+        running = ['{} {}/{}'.format(lang, done, total)
+                   for lang, (done, total) in sorted(progress.items())
+                   if done < total]
+        if verbose and len(running) > 0 and time.time() - last >= interval:
+            last = time.time()
+            logger.info('Progress: ' + ', '.join(running))
+
+
+async def build(jobs, workers=1, max_models=1, batch_size=256,
+                path_cache=None, cache_size=DEFAULT_MAX_ENTRIES,
+                interval=10.0, metrics_options=None):
+    """Run jobs in a process pool and return (results, failed jobs)"""
+    loop = asyncio.get_running_loop()
+    results, failed = [], []
+    with multiprocessing.Manager() as manager, \
+            ProcessPoolExecutor(workers, initializer=_init_worker,
+                                initargs=(max_models,)) as pool:
+        queue = manager.Queue()
+        progress = asyncio.ensure_future(report_progress(queue, interval))
+
+        async def run(job):
+            try:
+                result = await loop.run_in_executor(
+                    pool, run_job, job, queue, batch_size, path_cache,
+                    cache_size, metrics_options)
+            except Exception as e:
+                logger.error('{}: failed ({!r})'.format(job.lang, e))
+                failed.append(job)
+                return
+            results.append(result)
+            if verbose:
+                logger.info('{}: wrote {} entries to {} and {} '
+                            '({} words, {:.1f} sec)'.format(
+                                job.lang, result['entries'], job.path_json,
+                                job.path_tkn, result['words'],
+                                result['seconds']))
+
+        await asyncio.gather(*[run(job) for job in jobs])
+        queue.put(None)
+        await progress
+    return results, failed
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    jobs = make_jobs(args.langs, dir_data=args.dir_data,
+                     dir_models=args.dir_models)
+    # Largest inputs first so that they do not finish last
+    jobs.sort(key=lambda job: path.getsize(job.path_input)
+              if path.exists(job.path_input) else 0, reverse=True)
+    metrics = Metrics.from_args('build_lexicons', args)
+    # Stages of the jobs are measured in the workers and merged here
+    metrics_options = {'profile': metrics.profile,
+                       'dir_profile': metrics.dir_profile,
+                       'trace_memory': metrics.trace_memory}
+    time_start = time.time()
+    with metrics.stage('build') as stage:
+        results, failed = asyncio.run(build(
+            jobs, workers=args.workers, max_models=args.max_models,
+            batch_size=args.batch_size, path_cache=args.path_cache,
+            cache_size=args.cache_size, interval=args.progress_interval,
+            metrics_options=metrics_options))
+        stage['items'] = len(results)
+    for result in results:
+        metrics.stages.extend(result['stages'])
+    if verbose:
+        logger.info('Built {} languages in {:.1f} sec ({} failed)'.format(
+            len(results), time.time() - time_start, len(failed)))
+    metrics.finish(logger if verbose else None)
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('Build')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--langs', nargs='+', default=ALL_LANGS,
+                        help='languages')
+    parser.add_argument('--data', dest='dir_data', default='data',
+                        help='path to the data directory')
+    parser.add_argument('--models', dest='dir_models', default='udpipe_models',
+                        help='path to the UDPipe model directory')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (each keeps up to '
+                             '--max-models models in memory)')
+    parser.add_argument('--max-models', type=int, default=1,
+                        help='number of models kept loaded in a worker')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='number of words analyzed at once')
+    parser.add_argument('--cache', dest='path_cache',
+                        help='path to an analysis cache (SQLite) file')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_ENTRIES,
+                        help='maximum number of cached analyses')
+    parser.add_argument('--progress-interval', type=float, default=10.0,
+                        help='seconds between progress reports')
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
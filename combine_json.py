@@ -1,9 +1,27 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+"""Combine MWE lexicons in JSON format, summing `freq` of the same
+token@@@lemma@@@pos entries.
+
+With `--max-entries N`, inputs are combined with bounded memory: entries are
+sorted by key on disk in runs of N entries, k-way merged while summing
+`freq`, and sorted by freq with an external sort. The output is the same as
+the default (in-memory) mode.
+
+python combine_json.py shards/*.json -o combined.json --max-entries 1000000 -v
+"""
+
+from operator import itemgetter
 import argparse
 import logging
 import json
+import sys
+
+from extsort import external_sort
+from extsort import reduce_sorted
+from metrics import Metrics
+from metrics import add_metrics_arguments
 
 verbose = False
 logger = None
@@ -17,31 +35,89 @@ def init_logger(name='logger'):
     return logger
 
 
-def main(args):
-    global verbose
-    verbose = args.verbose
-
-    dat = {}
-    for path_input in args.path_input:
+def read_entries(paths_input):
+    """Yield (key, order, entry) of entries in the input files"""
+    n = 0
+    for path_input in paths_input:
         counter = 0
         with open(path_input) as f:
             for line in f:
                 entry = json.loads(line)
                 entry_id = '@@@'.join([entry['token'], entry['lemma'], entry['pos']])
-                if entry_id in dat:
-                    dat[entry_id]['freq'] += entry['freq']
-                else:
-                    dat[entry_id] = entry
+                yield entry_id, n, entry
+                n += 1
                 counter += 1
         if verbose:
             logger.info('Read {} entries from {}'.format(counter, path_input))
 
+
+def _sum_freq(a, b):
+    """Keep the first entry (as the in-memory mode) and add up freq"""
+    a[2]['freq'] += b[2]['freq']
+    return a
+
+
+def combine_external(paths_input, path_output, max_entries=1000000,
+                     dir_tmp=None):
+    """Combine entries holding at most `max_entries` of them in memory.
+    Return the number of combined entries."""
+    records = external_sort(read_entries(paths_input),
+                            key=itemgetter(0, 1), max_items=max_entries,
+                            dir_tmp=dir_tmp)
+    records = reduce_sorted(records, key=itemgetter(0), reduce=_sum_freq)
+    # freq desc, then the first occurrence (= the order of the in-memory mode)
+    records = external_sort(records, key=lambda r: (-r[2]['freq'], r[1]),
+                            max_items=max_entries, dir_tmp=dir_tmp)
+    counter = 0
+    with open(path_output, 'w') as f:
+        for _, _, entry in records:
+            f.write(json.dumps(entry) + '\n')
+            counter += 1
+    return counter
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    metrics = Metrics.from_args('combine_json', args)
+    if args.max_entries is not None:
+        with metrics.stage('combine') as stage:
+            counter = combine_external(args.path_input, args.path_output,
+                                       max_entries=args.max_entries,
+                                       dir_tmp=args.dir_tmp)
+            stage['items'] = counter
+        if verbose:
+            logger.info('Wrote {} entries to {}'.format(counter, args.path_output))
+        metrics.finish(logger if verbose else None)
+        return 0
+
+    dat = {}
+    with metrics.stage('read') as stage:
+        stage['items'] = 0
+        for path_input in args.path_input:
+            counter = 0
+            with open(path_input) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    entry_id = '@@@'.join([entry['token'], entry['lemma'], entry['pos']])
+                    if entry_id in dat:
+                        dat[entry_id]['freq'] += entry['freq']
+                    else:
+                        dat[entry_id] = entry
+                    counter += 1
+            if verbose:
+                logger.info('Read {} entries from {}'.format(counter, path_input))
+            stage['items'] += counter
+
     if verbose:
         logger.info('Write {} entries to {}'.format(len(dat), args.path_output))
-    with open(args.path_output, 'w') as f:
+    with metrics.stage('write') as stage, open(args.path_output, 'w') as f:
         for entry in sorted(dat.values(), key=lambda item: item['freq'], reverse=True):
             f.write(json.dumps(entry) + '\n')
+        stage['items'] = len(dat)
 
+    metrics.finish(logger if verbose else None)
     return 0
 
 
@@ -52,8 +128,14 @@ if __name__ == '__main__':
                         nargs='+')
     parser.add_argument('-o', '--output', dest='path_output',
                         required=True, help='path to output file')
+    parser.add_argument('--max-entries', type=int,
+                        help='combine with external sorting, holding at most '
+                             'this many entries in memory')
+    parser.add_argument('--tmp-dir', dest='dir_tmp',
+                        help='directory for temporary files')
+    add_metrics_arguments(parser)
     parser.add_argument('-v', '--verbose',
                         action='store_true', default=False,
                         help='verbose output')
     args = parser.parse_args()
-    main(args)
+    sys.exit(main(args))
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Count corpus frequencies of lexicon MWEs and write them to the lexicons.
+
+python count_mwes.py corpus.en.txt --lexicon data/mwelex/en-{eomw,parseme}.v1.json \
+    -o data/mwelex/en-{eomw,parseme}.v1.counted.json --min-count 5 -i --workers 4 -v
+
+Every (contiguous) occurrence of an MWE in a whitespace-tokenized corpus is
+counted exactly, including occurrences overlapping other MWEs. The counts are
+written to the `corpus_freq` field of the entries (`freq` is the count in the
+lexicon source), and entries occurring less than `--min-count` times are
+dropped. As in pretokenize.py, the corpus is split into chunks processed by
+`--workers` processes.
+
+With `--sketch-ngrams N`, n-grams (2 to N tokens) not in the lexicons are also
+counted approximately in a count-min sketch (`--sketch-width` x
+`--sketch-depth` counters, summed over the workers) and the `--top-k` most
+frequent ones are written to `--sketch-output` (estimated count and n-gram,
+tab-separated). An estimate exceeds the true count by at most
+e x (# of n-grams) / width with probability 1 - exp(-depth).
+"""
+
+from array import array
+import argparse
+import codecs
+import gc
+import json
+import logging
+import multiprocessing
+import sys
+import zlib
+
+from metrics import Metrics
+from metrics import add_metrics_arguments
+from pretokenize import END
+from pretokenize import split_chunks
+from utils import read_mwe_json
+
+verbose = False
+logger = None
+
+_worker = None  # state shared with worker processes
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+class CountMinSketch(object):
+    """Count-min sketch of strings (hashes are stable across processes, so
+    sketches of workers can be summed)"""
+
+    def __init__(self, width=1 << 18, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = [array('q', [0]) * width for _ in range(depth)]
+        self.total = 0
+
+    def indexes(self, key):
+        data = key.encode('utf_8')
+        h1 = zlib.crc32(data)
+        h2 = zlib.adler32(data) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Add `count` to `key` and return its new estimate"""
+        estimate = None
+        for row, k in zip(self.table, self.indexes(key)):
+            row[k] += count
+            if estimate is None or row[k] < estimate:
+                estimate = row[k]
+        self.total += count
+        return estimate
+
+    def estimate(self, key):
+        return min(row[k] for row, k in zip(self.table, self.indexes(key)))
+
+    def update(self, other):
+        """Add the counts of a sketch of the same shape"""
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('Sketches of different shapes')
+        for row, other_row in zip(self.table, other.table):
+            for k, count in enumerate(other_row):
+                if count:
+                    row[k] += count
+        self.total += other.total
+
+
+class TopNgrams(object):
+    """Candidates of the most frequent n-grams by their sketch estimates"""
+
+    def __init__(self, k=1000):
+        self.k = k
+        self.estimates = {}
+        self.floor = 0
+
+    def add(self, ngram, estimate):
+        if estimate <= self.floor:
+            return
+        self.estimates[ngram] = estimate
+        if len(self.estimates) >= 2 * self.k:
+            top = sorted(self.estimates.items(), key=lambda t: t[1],
+                         reverse=True)[:self.k]
+            self.estimates = dict(top)
+            self.floor = top[-1][1]
+
+
+def build_id_trie(mwes):
+    """Compile token sequences into a trie whose terminals are their indexes"""
+    trie = {}
+    for i, mwe in enumerate(mwes):
+        node = trie
+        for token in mwe:
+            node = node.setdefault(token, {})
+        node[END] = i
+    return trie
+
+
+def count_tokens(keys, trie, counts):
+    """Count every occurrence of the MWEs of `trie` in a token sequence"""
+    n = len(keys)
+    for i in range(n):
+        node = trie.get(keys[i])
+        j = i + 1
+        while node is not None:
+            if END in node:
+                counts[node[END]] += 1
+            if j == n:
+                break
+            node = node.get(keys[j])
+            j += 1
+
+
+def sketch_tokens(keys, lexicon, max_n, sketch, top):
+    """Add n-grams (2 to `max_n` tokens) not in `lexicon` to a sketch"""
+    n = len(keys)
+    for i in range(n - 1):
+        for j in range(i + 2, min(i + max_n, n) + 1):
+            ngram = ' '.join(keys[i:j])
+            if ngram in lexicon:
+                continue
+            top.add(ngram, sketch.add(ngram))
+
+
+class CountState(object):
+    """Compiled lexicon and counting options (shared with workers)"""
+
+    def __init__(self, trie, n_mwes, lower=False, lexicon=None,
+                 sketch_ngrams=0, sketch_width=1 << 18, sketch_depth=4,
+                 top_k=1000):
+        self.trie = trie
+        self.n_mwes = n_mwes
+        self.lower = lower
+        self.lexicon = lexicon  # MWEs as strings (for the sketch)
+        self.sketch_ngrams = sketch_ngrams
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+        self.top_k = top_k
+
+
+def _init_worker(state):
+    global _worker
+    _worker = state
+
+
+def _count_chunk(task):
+    """Count MWEs (and n-grams) in a byte range of a file"""
+    filename, start, end = task
+    state = _worker
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf_8')
+    if state.lower:
+        text = text.lower()
+    counts = array('q', [0]) * state.n_mwes
+    sketch, top = None, None
+    if state.sketch_ngrams > 1:
+        sketch = CountMinSketch(state.sketch_width, state.sketch_depth)
+        top = TopNgrams(state.top_k)
+    n_lines = 0
+    for line in text.splitlines():
+        keys = line.split()
+        count_tokens(keys, state.trie, counts)
+        if sketch is not None:
+            sketch_tokens(keys, state.lexicon, state.sketch_ngrams, sketch,
+                          top)
+        n_lines += 1
+    return n_lines, counts, sketch, None if top is None else top.estimates
+
+
+def count_corpus(filenames, state, workers=1, chunk_bytes=64 << 20):
+    """Return (# of lines, MWE counts, sketch, candidate n-grams)"""
+    tasks = [(filename, start, end) for filename in filenames
+             for start, end in split_chunks(filename, chunk_bytes)]
+    if verbose:
+        logger.info('{} chunks, {} workers'.format(len(tasks), workers))
+    _init_worker(state)
+    if workers > 1 and len(tasks) > 1:
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            ctx = multiprocessing.get_context()
+        gc.freeze()  # keep the trie pages shared with forked workers
+        pool = ctx.Pool(workers, initializer=_init_worker, initargs=(state,))
+        results = pool.imap_unordered(_count_chunk, tasks)
+    else:
+        pool = None
+        results = map(_count_chunk, tasks)
+
+    n_lines = 0
+    counts = array('q', [0]) * state.n_mwes
+    sketch, candidates = None, set()
+    for n, chunk_counts, chunk_sketch, chunk_top in results:
+        n_lines += n
+        for i, count in enumerate(chunk_counts):
+            if count:
+                counts[i] += count
+        if chunk_sketch is not None:
+            if sketch is None:
+                sketch = chunk_sketch
+            else:
+                sketch.update(chunk_sketch)
+            candidates.update(chunk_top)
+    if pool is not None:
+        pool.close()
+        pool.join()
+        gc.unfreeze()
+    return n_lines, counts, sketch, candidates
+
+
+def lexicon_key(entry, col='lemma', lower=False):
+    mwe = entry[col].lower() if lower else entry[col]
+    return tuple(mwe.split())
+
+
+def write_counted_json(filename, entries, freqs, min_count=0):
+    """Write entries with their corpus frequencies and return the number of
+    written entries"""
+    counter = 0
+    with codecs.open(filename, 'w', encoding='utf_8') as f:
+        for entry, freq in zip(entries, freqs):
+            if freq < min_count:
+                continue
+            entry['corpus_freq'] = freq
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            counter += 1
+    return counter
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    if args.in_place:
+        path_output = args.path_lexicon
+    elif args.path_output is not None \
+            and len(args.path_output) == len(args.path_lexicon):
+        path_output = args.path_output
+    else:
+        logger.error('Give one output file for each lexicon (or --in-place)')
+        return 1
+    if args.sketch_ngrams > 1 and args.path_sketch is None:
+        logger.error('--sketch-ngrams requires --sketch-output')
+        return 1
+
+    metrics = Metrics.from_args('count_mwes', args)
+    with metrics.stage('read') as stage:
+        lexicons = [list(read_mwe_json(filename))
+                    for filename in args.path_lexicon]
+        ids = {}
+        for entries in lexicons:
+            for entry in entries:
+                ids.setdefault(lexicon_key(entry, col=args.col,
+                                           lower=args.lower), len(ids))
+        mwes = sorted(ids, key=ids.get)
+        trie = build_id_trie(mwes)
+        stage['items'] = len(mwes)
+    if verbose:
+        logger.info('Compiled {} MWEs from {} lexicon(s)'.format(
+            len(mwes), len(lexicons)))
+
+    state = CountState(trie, len(mwes), lower=args.lower,
+                       sketch_ngrams=args.sketch_ngrams,
+                       sketch_width=args.sketch_width,
+                       sketch_depth=args.sketch_depth, top_k=args.top_k)
+    if args.sketch_ngrams > 1:
+        state.lexicon = set(' '.join(mwe) for mwe in mwes)
+    with metrics.stage('count') as stage:
+        n_lines, counts, sketch, candidates = count_corpus(
+            args.path_input, state, workers=args.workers,
+            chunk_bytes=args.chunk_bytes)
+        stage['items'] = n_lines
+    if verbose:
+        logger.info('Counted {} MWE occurrences in {} lines'.format(
+            sum(counts), n_lines))
+
+    with metrics.stage('write') as stage:
+        stage['items'] = 0
+        for filename, entries, path_lex in zip(path_output, lexicons,
+                                                args.path_lexicon):
+            freqs = [counts[ids[lexicon_key(entry, col=args.col,
+                                            lower=args.lower)]]
+                     for entry in entries]
+            n = write_counted_json(filename, entries, freqs,
+                                   min_count=args.min_count)
+            stage['items'] += n
+            if verbose:
+                logger.info('{}: wrote {}/{} entries to {}'.format(
+                    path_lex, n, len(entries), filename))
+        if sketch is not None:
+            top = sorted(((sketch.estimate(ngram), ngram)
+                          for ngram in candidates),
+                         key=lambda t: (-t[0], t[1]))[:args.top_k]
+            with open(args.path_sketch, 'w', encoding='utf_8') as f:
+                f.write(''.join('{}\t{}\n'.format(count, ngram)
+                                for count, ngram in top))
+            if verbose:
+                logger.info('Wrote {} n-grams to {} ({} n-grams counted)'.format(
+                    len(top), args.path_sketch, sketch.total))
+    metrics.finish(logger if verbose else None)
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('Count')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path_input', nargs='+', help='path to corpus file')
+    parser.add_argument('--lexicon', dest='path_lexicon', nargs='+',
+                        required=True,
+                        help='path to MWE lexicon(s) in JSON format')
+    parser.add_argument('-o', '--output', dest='path_output', nargs='+',
+                        help='path to output file (one for each lexicon)')
+    parser.add_argument('--in-place', action='store_true', default=False,
+                        help='overwrite the lexicons')
+    parser.add_argument('--min-count', type=int, default=0,
+                        help='drop entries occurring less than this')
+    parser.add_argument('--col', choices=['lemma', 'token'], default='lemma',
+                        help='lexicon field to match against corpus tokens')
+    parser.add_argument('-i', '--ignore-case', dest='lower',
+                        action='store_true', default=False,
+                        help='lowercase lexicon entries and corpus tokens '
+                             'before matching')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--chunk-bytes', type=int, default=64 << 20,
+                        help='approximate size of a chunk (in bytes) '
+                             'processed by a worker')
+    parser.add_argument('--sketch-ngrams', type=int, default=0,
+                        help='count n-grams up to this length not in the '
+                             'lexicons with a count-min sketch')
+    parser.add_argument('--sketch-width', type=int, default=1 << 18,
+                        help='number of counters in a row of the sketch')
+    parser.add_argument('--sketch-depth', type=int, default=4,
+                        help='number of rows (hash functions) of the sketch')
+    parser.add_argument('--top-k', type=int, default=1000,
+                        help='number of most frequent n-grams to write')
+    parser.add_argument('--sketch-output', dest='path_sketch',
+                        help='path to output file of frequent n-grams')
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -2,14 +2,37 @@
 # -*- coding: utf-8 -*-
 
 """Extract MWEs from cupt format and save them in JSON format
+
+With `--max-keys N`, MWEs are counted in a streaming mode with bounded
+memory: token fields are interned, MWE types are counted per entry, and
+partial counts are spilled to temporary files (`--tmp-dir`) whenever more
+than N entries are held in memory, then merged on disk. The output is the
+same as the default (in-memory) mode.
+
+python cupt2json.py auto-annotated/*.cupt -o data/mwelex/en-auto.v1.json --max-keys 1000000 -v
+
+With `--workers N`, each file is split into chunks of about `--chunk-bytes`
+at sentence boundaries and the chunks are processed by N processes. Counts are
+merged in the order of chunks, so the output is identical to the serial mode.
 """
 
 from collections import defaultdict
+from operator import itemgetter
 from tqdm import tqdm
 import argparse
 import codecs
 import json
 import logging
+import multiprocessing
+import os
+import sys
+
+from extsort import external_sort
+from extsort import merge_runs
+from extsort import reduce_sorted
+from extsort import write_run
+from metrics import Metrics
+from metrics import add_metrics_arguments
 
 verbose = False
 logger = None
@@ -23,96 +46,256 @@ def init_logger(name='logger'):
     return logger
 
 
+def mwe_row(mwe, freq, types, source='n/a'):
+    token, lemma, upos = zip(*[entry.split('@@@') for entry in mwe.split('\t')])
+    return {'token': ' '.join(token),
+            'lemma': ' '.join(lemma),
+            'pos': ' '.join(upos),
+            'parseme_tag': ' '.join(sorted(list(set(types)))),
+            'freq': freq,
+            'source': source}
+
+
 def write_mwe_json(filename, mwes, types, source='n/a'):
     with codecs.open(filename, 'w', encoding='utf_8') as f:
         for mwe, freq in sorted(mwes.items(), key=lambda t: t[1], reverse=True):
-            token, lemma, upos = zip(*[entry.split('@@@') for entry in mwe.split('\t')])
-            row = {'token': ' '.join(token),
-                   'lemma': ' '.join(lemma),
-                   'pos': ' '.join(upos),
-                   'parseme_tag': ' '.join(sorted(list(set(types[mwe])))),
-                   'freq': freq,
-                   'source': source}
+            row = mwe_row(mwe, freq, types[mwe], source=source)
             f.write(json.dumps(row, ensure_ascii=False) + '\n')
 
 
-def read_cupt(filename):
-    """Read a file in CoNLL format and yield mwes"""
+def read_cupt(filename, compact=False):
+    """Read a file in CoNLL format and yield mwes
+
+    If `compact`, tokens are tuples of the first five (interned) fields."""
 
     if verbose:
         logger.info('Read ' + filename)
 
+    with codecs.open(filename, encoding='utf_8') as f:
+        yield from parse_cupt(tqdm(f), compact=compact)
+
+
+def parse_cupt(lines, compact=False):
+    """Yield mwes of each sentence in lines of CoNLL format"""
     tokens = []
     mwes = defaultdict(list)
     mwe_types = {}
-    with codecs.open(filename, encoding='utf_8') as f:
-        for line in tqdm(f):
-            line = line.strip()
-            if len(line) == 0:
-                yield mwes, mwe_types
-                tokens = []
-                mwes = defaultdict(list)
-                mwe_types = {}
-                continue
-            if line.startswith('#'):
-                continue
-            token = line.split('\t')
-            tokens.append(token)
-            if token[-1] == '*':  # not in an MWE
-                continue
-            for tag in token[-1].split(';'):
-                mwe_id = int(tag.split(':')[0])
-                mwes[mwe_id].append(token)
-                try:
-                    mwe_type = tag.split(':')[1]
-                    mwe_types[mwe_id] = mwe_type
-                except IndexError:
-                    pass
-                if len(mwes[mwe_id]) > 1:
-                    idx1, idx2 = int(mwes[mwe_id][-1][0]), int(mwes[mwe_id][-2][0])
-                    if idx1 - idx2  == 2:
-                        if tokens[idx1 - 2][3] == 'DET':  # insert a determinor
-                            mwes[mwe_id].insert(-1, tokens[idx1 - 2])
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            yield mwes, mwe_types
+            tokens = []
+            mwes = defaultdict(list)
+            mwe_types = {}
+            continue
+        if line.startswith('#'):
+            continue
+        token = line.split('\t')
+        tags = token[-1]
+        if compact:
+            token = tuple(sys.intern(field) for field in token[:5])
+        tokens.append(token)
+        if tags == '*':  # not in an MWE
+            continue
+        for tag in tags.split(';'):
+            mwe_id = int(tag.split(':')[0])
+            mwes[mwe_id].append(token)
+            try:
+                mwe_type = tag.split(':')[1]
+                mwe_types[mwe_id] = mwe_type
+            except IndexError:
+                pass
+            if len(mwes[mwe_id]) > 1:
+                idx1, idx2 = int(mwes[mwe_id][-1][0]), int(mwes[mwe_id][-2][0])
+                if idx1 - idx2  == 2:
+                    if tokens[idx1 - 2][3] == 'DET':  # insert a determinor
+                        mwes[mwe_id].insert(-1, tokens[idx1 - 2])
 
     if len(mwes) > 0:
         yield mwes, mwe_types
 
 
+def iter_mwes(filename, compact=False):
+    """Yield (MWE entry, MWE type) of each MWE occurrence in a cupt file"""
+    return extract_mwes(read_cupt(filename, compact=compact))
+
+
+def extract_mwes(sentences):
+    """Yield (MWE entry, MWE type) of each MWE occurrence in sentences
+    (as yielded by read_cupt)"""
+    for mwes, mwe_types in sentences:
+        for mwe_id, tokens in mwes.items():
+            buff = []
+            for token in tokens:
+                form, lemma, upos = token[1], token[2], f'{token[3]}-{token[4]}'
+                if not isinstance(form, str) \
+                   and not isinstance(lemma, str):
+                    buff =[]  # invalid entry. skip.
+                    break
+                if not isinstance(form, str):
+                    form = lemma
+                if not isinstance(lemma, str):
+                    lemma = form
+                entry = ['{}'.format(form),
+                         '{}'.format(lemma.lower()),
+                         '{}'.format(upos)]
+                buff.append('@@@'.join(entry))
+            if len(buff) <= 1:
+                continue
+            yield '\t'.join(buff), mwe_types[mwe_id]
+
+
+def _merge_counts(a, b):
+    """Merge two (entry, freq, first occurrence, {type: count}) records"""
+    types = dict(a[3])
+    for mwe_type, count in b[3].items():
+        types[mwe_type] = types.get(mwe_type, 0) + count
+    return a[0], a[1] + b[1], min(a[2], b[2]), types
+
+
+def count_streaming(paths_input, max_keys=1000000, dir_tmp=None):
+    """Count MWEs holding at most `max_keys` entries in memory.
+
+    Return (entry, freq, first occurrence, {type: count}) records in the
+    output order of write_mwe_json (freq desc, then first occurrence)."""
+    counts = {}  # entry -> [freq, first occurrence, {type: count}]
+    paths_run = []
+    n = 0
+    for path_input in paths_input:
+        for mwe, mwe_type in iter_mwes(path_input, compact=True):
+            count = counts.get(mwe)
+            if count is None:
+                count = counts[mwe] = [0, n, {}]
+            count[0] += 1
+            count[2][mwe_type] = count[2].get(mwe_type, 0) + 1
+            n += 1
+            if len(counts) >= max_keys:
+                paths_run.append(write_run(
+                    ((k, ) + tuple(v) for k, v in sorted(counts.items())),
+                    dir_tmp=dir_tmp))
+                counts = {}
+                if verbose:
+                    logger.info('Spilled {} partial counts'.format(max_keys))
+    if len(paths_run) == 0:
+        records = [(k, ) + tuple(v) for k, v in counts.items()]
+    else:
+        paths_run.append(write_run(
+            ((k, ) + tuple(v) for k, v in sorted(counts.items())),
+            dir_tmp=dir_tmp))
+        counts = None
+        records = reduce_sorted(merge_runs(paths_run, key=itemgetter(0)),
+                                key=itemgetter(0), reduce=_merge_counts)
+    return external_sort(records, key=lambda r: (-r[1], r[2]),
+                         max_items=max_keys, dir_tmp=dir_tmp)
+
+
+def split_sentence_chunks(filename, chunk_bytes):
+    """Split a cupt file into (start, end) byte ranges, each ending with a
+    blank line (i.e. a sentence boundary) or at the end of the file"""
+    size = os.path.getsize(filename)
+    chunks = []
+    with open(filename, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()  # skip a partial line
+            while True:
+                line = f.readline()
+                if len(line) == 0 or len(line.strip()) == 0:
+                    break
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def _count_chunk(task):
+    """Count MWEs in a byte range of a cupt file in a worker process.
+    Return {entry: [freq, {type: count}]} in the order of first occurrence"""
+    filename, start, end = task
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf_8')
+    counts = {}
+    for mwe, mwe_type in extract_mwes(parse_cupt(text.splitlines())):
+        count = counts.get(mwe)
+        if count is None:
+            count = counts[mwe] = [0, {}]
+        count[0] += 1
+        count[1][mwe_type] = count[1].get(mwe_type, 0) + 1
+    return counts
+
+
+def count_parallel(paths_input, workers=2, chunk_bytes=16 << 20):
+    """Count MWEs with a process pool and merge the per-chunk counts in the
+    order of chunks, so that the order of entries (and the output) is the
+    same as in the serial mode"""
+    tasks = [(path_input, start, end) for path_input in paths_input
+             for start, end in split_sentence_chunks(path_input, chunk_bytes)]
+    if verbose:
+        logger.info('{} chunks, {} workers'.format(len(tasks), workers))
+    counter = defaultdict(int)
+    types = defaultdict(dict)
+    with multiprocessing.Pool(workers) as pool:
+        for counts in pool.imap(_count_chunk, tasks):
+            for mwe, (freq, mwe_types) in counts.items():
+                counter[mwe] += freq
+                merged = types[mwe]
+                for mwe_type, count in mwe_types.items():
+                    merged[mwe_type] = merged.get(mwe_type, 0) + count
+    return counter, types
+
+
 def main(args):
     global verbose
     verbose = args.verbose
 
-    counter = defaultdict(int)
-    types = defaultdict(list)
-
-    for path_input in args.path_input:
-        for mwes, mwe_types in read_cupt(path_input):
-            for mwe_id, tokens in mwes.items():
-                buff = []
-                for token in tokens:
-                    form, lemma, upos = token[1], token[2], f'{token[3]}-{token[4]}'
-                    if not isinstance(form, str) \
-                       and not isinstance(lemma, str):
-                        buff =[]  # invalid entry. skip.
-                        break
-                    if not isinstance(form, str):
-                        form = lemma
-                    if not isinstance(lemma, str):
-                        lemma = form
-                    entry = ['{}'.format(form),
-                             '{}'.format(lemma.lower()),
-                             '{}'.format(upos)]
-                    buff.append('@@@'.join(entry))
-                if len(buff) <= 1:
-                    continue
-                counter['\t'.join(buff)] += 1
-                types['\t'.join(buff)].append(mwe_types[mwe_id])
+    if args.max_keys is not None and args.workers > 1:
+        logger.error('--max-keys cannot be used with --workers')
+        return 1
+
+    metrics = Metrics.from_args('cupt2json', args)
+    if args.max_keys is not None:
+        n_entries, n_total = 0, 0
+        with metrics.stage('count') as stage, \
+                codecs.open(args.path_output, 'w', encoding='utf_8') as f:
+            for mwe, freq, _, types in count_streaming(
+                    args.path_input, max_keys=args.max_keys,
+                    dir_tmp=args.dir_tmp):
+                row = mwe_row(mwe, freq, types, source=args.source)
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                n_entries += 1
+                n_total += freq
+            stage['items'] = n_total
+        if verbose:
+            logger.info('Wrote {} entries to {}'.format(n_entries, args.path_output))
+            logger.info('Total count: {}'.format(n_total))
+        metrics.finish(logger if verbose else None)
+        return 0
+
+    with metrics.stage('count') as stage:
+        if args.workers > 1:
+            counter, types = count_parallel(args.path_input,
+                                            workers=args.workers,
+                                            chunk_bytes=args.chunk_bytes)
+        else:
+            counter = defaultdict(int)
+            types = defaultdict(list)
+
+            for path_input in args.path_input:
+                for mwe, mwe_type in iter_mwes(path_input):
+                    counter[mwe] += 1
+                    types[mwe].append(mwe_type)
+        stage['items'] = sum(counter.values())
 
     if verbose:
         logger.info('Write {} entries to {}'.format(len(counter), args.path_output))
-        logger.info('Total count: {}'.format(sum(counter.values())))
-    write_mwe_json(args.path_output, counter, types, source=args.source)
+        logger.info('Total count: {}'.format(stage['items']))
+    with metrics.stage('write') as stage:
+        write_mwe_json(args.path_output, counter, types, source=args.source)
+        stage['items'] = len(counter)
 
+    metrics.finish(logger if verbose else None)
     return 0
 
 
@@ -125,8 +308,19 @@ if __name__ == '__main__':
                         help='data source')
     parser.add_argument('-o', '--output', dest='path_output',
                         help='path to output file')
+    parser.add_argument('--max-keys', type=int,
+                        help='count in a streaming mode holding at most this '
+                             'many entries in memory')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--chunk-bytes', type=int, default=16 << 20,
+                        help='approximate size of a chunk (in bytes) '
+                             'processed by a worker')
+    parser.add_argument('--tmp-dir', dest='dir_tmp',
+                        help='directory for temporary files (streaming mode)')
+    add_metrics_arguments(parser)
     parser.add_argument('-v', '--verbose',
                         action='store_true', default=False,
                         help='verbose output')
     args = parser.parse_args()
-    main(args)
+    sys.exit(main(args))
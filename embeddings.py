@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Read word embeddings, and convert word2vec/fastText text files into a
+binary store that is memory-mapped when loaded.
+
+python embeddings.py emb/wiki.en.mwe.vec -o emb/wiki.en.mwe --dtype float16 --normalize -v
+
+writes emb/wiki.en.mwe.vocab (one word per line), emb/wiki.en.mwe.npy (the
+matrix), emb/wiki.en.mwe.json (its shape, dtype and whether the rows are
+L2-normalized), and emb/wiki.en.mwe.sorted.vocab and
+emb/wiki.en.mwe.sorted.npy (the sorted vocabulary and its rows) for lookups;
+all five files are needed. `load_embeddings('emb/wiki.en.mwe.npy')`
+memory-maps the matrix, so processes evaluating the same language share its
+pages and only the rows used (e.g. of dictionary words) are read from disk.
+"""
+
+from bisect import bisect_left
+from os import path
+import argparse
+import json
+import logging
+import os
+import sys
+import warnings
+
+import numpy as np
+
+from metrics import Metrics
+from metrics import add_metrics_arguments
+
+verbose = False
+logger = None
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+class Embeddings(object):
+    """Words and their vectors (rows of `matrix`)"""
+
+    def __init__(self, words, matrix, normalized=False):
+        self._words = words
+        self._index = None
+        self.matrix = matrix
+        self.normalized = normalized
+
+    @property
+    def words(self):
+        return self._words
+
+    @property
+    def index(self):
+        """Dict from words to rows (built on first use)"""
+        if self._index is None:
+            self._index = dict(zip(self.words, range(len(self.words))))
+        return self._index
+
+    def get(self, word):
+        """Return the row of a word, or None"""
+        return self.index.get(word)
+
+    def __len__(self):
+        return len(self.matrix)
+
+
+class StoredEmbeddings(Embeddings):
+    """Embeddings of a store. The matrix is memory-mapped, and words are
+    looked up by binary search in the sorted vocabulary instead of building
+    a dict of millions of words"""
+
+    def __init__(self, prefix, max_vocab=0):
+        path_vocab, path_matrix, path_info = store_paths(prefix)
+        with open(path_info) as f:
+            info = json.load(f)
+        matrix = np.load(path_matrix, mmap_mode='r')
+        if max_vocab > 0:
+            matrix = matrix[:max_vocab]
+        super().__init__(None, matrix, normalized=info['normalized'])
+        self.path_vocab = path_vocab
+        with open(prefix + '.sorted.vocab', encoding='utf_8') as f:
+            self.sorted_words = f.read().split('\n')[:info['words']]
+        self.sorted_rows = np.load(prefix + '.sorted.npy', mmap_mode='r')
+
+    @property
+    def words(self):
+        if self._words is None:
+            with open(self.path_vocab, encoding='utf_8') as f:
+                self._words = f.read().split('\n')[:len(self.matrix)]
+        return self._words
+
+    def get(self, word):
+        i = bisect_left(self.sorted_words, word)
+        if i == len(self.sorted_words) or self.sorted_words[i] != word:
+            return None
+        row = int(self.sorted_rows[i])
+        return row if row < len(self.matrix) else None
+
+
+def read_text_header(f):
+    """Return (# of words or None, dimension, lines to be parsed) from the
+    first line of a word2vec text file"""
+    first = f.readline()
+    # Rows usually end with a space: skip blank fields
+    fields = [field for field in first.rstrip().split(' ') if field != '']
+    if len(fields) == 2:
+        return int(fields[0]), int(fields[1]), []
+    return None, len(fields) - 1, [first]
+
+
+def to_floats(text):
+    """Parse space-separated values; an empty array if one is malformed"""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            return np.fromstring(text, dtype=np.float32, sep=' ')
+    except (ValueError, DeprecationWarning):
+        return np.empty(0, dtype=np.float32)
+
+
+def iter_text_batches(f, dim, pending=(), batch_size=10000):
+    """Yield (words, matrix) batches of a word2vec text file. Lines of the
+    wrong dimension are skipped"""
+    def parse(lines):
+        words, rests = [], []
+        for line in lines:
+            word, _, rest = line.rstrip().partition(' ')
+            if rest.count(' ') != dim - 1:
+                # Tabs or repeated spaces, or the wrong number of values
+                rest = ' '.join(rest.split())
+                if rest.count(' ') != dim - 1:
+                    continue
+            words.append(word)
+            rests.append(rest)
+        values = to_floats(' '.join(rests))
+        if len(values) == len(words) * dim:
+            return words, values.reshape(len(words), dim)
+        # Some value is malformed: parse the lines one by one
+        rows = [(word, to_floats(rest)) for word, rest in zip(words, rests)]
+        rows = [(word, row) for word, row in rows if len(row) == dim]
+        return ([word for word, _ in rows],
+                np.array([row for _, row in rows],
+                         dtype=np.float32).reshape(-1, dim))
+
+    lines = list(pending)
+    for line in f:
+        lines.append(line)
+        if len(lines) >= batch_size:
+            yield parse(lines)
+            lines = []
+    if len(lines) > 0:
+        yield parse(lines)
+
+
+def load_text_embeddings(filename, max_vocab=0):
+    """Read embeddings in word2vec text format (with or without the
+    `# of words, dimension` header line)"""
+    words, seen, batches = [], set(), []
+    with open(filename, encoding='utf_8', errors='replace') as f:
+        _, dim, pending = read_text_header(f)
+        for batch_words, batch in iter_text_batches(f, dim, pending):
+            keep = []
+            for i, word in enumerate(batch_words):
+                if word in seen:
+                    continue
+                if max_vocab > 0 and len(words) >= max_vocab:
+                    break
+                seen.add(word)
+                words.append(word)
+                keep.append(i)
+            batches.append(batch[keep] if len(keep) < len(batch) else batch)
+            if max_vocab > 0 and len(words) >= max_vocab:
+                break
+    if len(words) == 0:
+        raise ValueError('No vectors of dimension {} in {}'.format(dim,
+                                                                   filename))
+    return Embeddings(words, np.concatenate(batches))
+
+
+def count_lines(filename):
+    """Number of lines, including a last one without a newline"""
+    n, last = 0, b'\n'
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            n += block.count(b'\n')
+            last = block[-1:]
+    return n if last == b'\n' else n + 1
+
+
+def store_paths(prefix):
+    return prefix + '.vocab', prefix + '.npy', prefix + '.json'
+
+
+def store_prefix(filename):
+    """`emb/wiki.en.mwe.npy` -> `emb/wiki.en.mwe`"""
+    return filename[:-len('.npy')] if filename.endswith('.npy') else filename
+
+
+def convert_text(filename, prefix, dtype='float32', normalize=False,
+                 max_vocab=0):
+    """Convert a word2vec text file into a store and return its size.
+    Vectors are written to a memory-mapped .npy file as they are parsed"""
+    path_vocab, path_matrix, path_info = store_paths(prefix)
+    with open(filename, encoding='utf_8', errors='replace') as f:
+        n, dim, pending = read_text_header(f)
+        if n is None:
+            n = count_lines(filename)
+        if max_vocab > 0:
+            n = min(n, max_vocab)
+        matrix = np.lib.format.open_memmap(path_matrix, mode='w+',
+                                           dtype=dtype, shape=(n, dim))
+        words, seen = [], set()
+        for batch_words, batch in iter_text_batches(f, dim, pending):
+            keep = []
+            for i, word in enumerate(batch_words):
+                if word in seen or len(words) + len(keep) >= n:
+                    continue
+                seen.add(word)
+                keep.append(i)
+            batch = batch[keep]
+            if normalize:
+                batch /= np.maximum(np.linalg.norm(batch, axis=1,
+                                                   keepdims=True), 1e-8)
+            matrix[len(words):len(words) + len(batch)] = batch
+            words.extend(batch_words[i] for i in keep)
+            if len(words) >= n:
+                break
+        matrix.flush()
+    if len(words) == 0:
+        del matrix
+        os.remove(path_matrix)
+        raise ValueError('No vectors of dimension {} in {}'.format(dim,
+                                                                   filename))
+    if len(words) < n:
+        # Skipped lines: shrink the matrix
+        del matrix
+        old = np.load(path_matrix, mmap_mode='r')
+        np.save(path_matrix + '.tmp.npy', old[:len(words)])
+        del old
+        os.replace(path_matrix + '.tmp.npy', path_matrix)
+    with open(path_vocab, 'w', encoding='utf_8') as f:
+        f.write('\n'.join(words) + '\n')
+    rows = sorted(range(len(words)), key=words.__getitem__)
+    with open(prefix + '.sorted.vocab', 'w', encoding='utf_8') as f:
+        f.write('\n'.join(words[i] for i in rows) + '\n')
+    np.save(prefix + '.sorted.npy', np.array(rows, dtype=np.int64))
+    with open(path_info, 'w') as f:
+        json.dump({'words': len(words), 'dim': dim, 'dtype': dtype,
+                   'normalized': normalize,
+                   'source': path.abspath(filename)}, f, indent=2)
+    return len(words), dim
+
+
+def load_embeddings(filename, max_vocab=0):
+    """Load a store (`*.npy`) or read a text file"""
+    if filename.endswith('.npy'):
+        return StoredEmbeddings(store_prefix(filename), max_vocab=max_vocab)
+    return load_text_embeddings(filename, max_vocab=max_vocab)
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    metrics = Metrics.from_args('embeddings', args)
+    prefix = args.path_output or path.splitext(args.path_input)[0]
+    try:
+        with metrics.stage('convert') as stage:
+            n, dim = convert_text(args.path_input, prefix, dtype=args.dtype,
+                                  normalize=args.normalize,
+                                  max_vocab=args.max_vocab)
+            stage['items'] = n
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+    if verbose:
+        logger.info('Wrote {} x {} ({}) vectors to {}.{{vocab,npy,json,'
+                    'sorted.vocab,sorted.npy}}'.format(n, dim, args.dtype,
+                                                       prefix))
+    metrics.finish(logger if verbose else None)
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('Emb')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path_input',
+                        help='path to embeddings in word2vec text format')
+    parser.add_argument('-o', '--output', dest='path_output',
+                        help='output prefix (default: input without its '
+                             'extension)')
+    parser.add_argument('--dtype', choices=['float32', 'float16'],
+                        default='float32', help='type of stored vectors')
+    parser.add_argument('--normalize', action='store_true', default=False,
+                        help='store L2-normalized vectors')
+    parser.add_argument('--max-vocab', type=int, default=0,
+                        help='convert only the first words (0: all)')
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
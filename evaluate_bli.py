@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Evaluate cross-lingual (MWE) embeddings on bilingual lexicon induction
+with the dictionaries of extract_mwe_pairs.py.
+
+python evaluate_bli.py --emb 'emb/wiki.{lang}.mwe.vec' --pairs en-es es-en \
+    --dict-dir data/wikt/mwe-dict -o bli.json -v
+python evaluate_bli.py --emb 'emb/wiki.{lang}.mwe.vec' --all -v  # every *.mwe.txt
+
+For each source word of a `{src}-{tgt}.mwe.txt` dictionary, target words are
+retrieved by cosine similarity (nn) or CSLS (csls) and P@1/5/10 is the ratio
+of source words with a gold translation among the top 1/5/10. Pairs with a
+word missing from the embeddings are skipped (see `coverage`).
+
+Similarities are computed by matrix products of `--batch-size` queries at a
+time (batch-size x vocabulary scores in memory), so NumPy's BLAS uses all the
+cores (set OMP_NUM_THREADS or OPENBLAS_NUM_THREADS to limit them). The
+embeddings of each language are read once and `--max-vocab` limits them to
+the most frequent words. Embeddings are word2vec text files, or stores of
+embeddings.py (`--emb 'emb/wiki.{lang}.mwe.npy'`), which are memory-mapped
+and, if stored normalized, used without copying.
+
+With `--index 'emb/wiki.{lang}.mwe.ivf'`, targets are retrieved from the ANN
+indexes of ann_index.py (`--n-probe` lists per query; CSLS reranks the
+`--candidates` nearest targets) and the recall@10 of the index against exact
+search is reported for `--recall-sample` queries of each direction.
+"""
+
+from collections import defaultdict
+from os import path
+import argparse
+import glob
+import json
+import logging
+import sys
+
+import numpy as np
+
+from ann_index import IVFIndex
+from ann_index import exact_search
+from ann_index import recall_at_k
+from ann_index import top_k
+from embeddings import load_embeddings
+from extract_mwe_pairs import LANGS
+from metrics import Metrics
+from metrics import add_metrics_arguments
+
+verbose = False
+logger = None
+
+KS = (1, 5, 10)
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+def normalize(matrix, center=False):
+    """Return L2-normalized (and mean-centered) rows as float32"""
+    matrix = np.array(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-8)
+    if center:
+        matrix -= matrix.mean(axis=0, keepdims=True)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-8)
+    return matrix
+
+
+def read_dictionary(filename, src, tgt):
+    """Read `src_word tgt_word` lines and return ({source index: set of
+    target indexes}, # of pairs, # of covered pairs)"""
+    gold = defaultdict(set)
+    n_pairs, n_covered = 0, 0
+    with open(filename, encoding='utf_8') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 2:
+                continue
+            n_pairs += 1
+            i, j = src.get(fields[0]), tgt.get(fields[1])
+            if i is None or j is None:
+                continue
+            gold[i].add(j)
+            n_covered += 1
+    return gold, n_pairs, n_covered
+
+
+def mean_top_k_similarity(queries, targets, k=10, batch_size=256):
+    """Return the mean similarity of each query to its `k` nearest targets
+    (the CSLS penalty)"""
+    k = min(k, len(targets))
+    means = np.empty(len(queries), dtype=np.float32)
+    for start in range(0, len(queries), batch_size):
+        scores = queries[start:start + batch_size] @ targets.T
+        part = np.partition(scores, scores.shape[1] - k, axis=1)
+        means[start:start + batch_size] = part[:, -k:].mean(axis=1)
+    return means
+
+
+def retrieve(queries, targets, k=10, batch_size=256, penalty=None):
+    """Return indexes of the `k` nearest targets of each query by cosine
+    similarity, or by CSLS given the penalty of the targets"""
+    predictions = np.empty((len(queries), min(k, len(targets))),
+                           dtype=np.int64)
+    for start in range(0, len(queries), batch_size):
+        scores = queries[start:start + batch_size] @ targets.T
+        if penalty is not None:
+            # The penalty of a query does not change its ranking
+            scores *= 2
+            scores -= penalty
+        predictions[start:start + batch_size] = top_k(scores, k)
+    return predictions
+
+
+def precision_at_k(predictions, gold, ks=KS):
+    """Return {`P@k`: ratio of queries with a gold target in their top k}"""
+    hits = np.array([[j in targets for j in row]
+                     for row, targets in zip(predictions.tolist(), gold)],
+                    dtype=bool)
+    return {'P@{}'.format(k): float(hits[:, :k].any(axis=1).mean())
+            if len(hits) > 0 else 0.0 for k in ks}
+
+
+def evaluate(gold, src_matrix, tgt_matrix, method='nn', csls_k=10,
+             batch_size=256):
+    """Return {`P@k`: precision} of retrieving gold targets of the source
+    words of `gold` ({source index: set of target indexes})"""
+    queries = sorted(gold)
+    # Only the rows of queries are read from a memory-mapped source matrix
+    query_matrix = np.asarray(src_matrix[queries], dtype=np.float32)
+    tgt_matrix = np.asarray(tgt_matrix, dtype=np.float32)
+    penalty = None
+    if method == 'csls':
+        penalty = mean_top_k_similarity(
+            tgt_matrix, np.asarray(src_matrix, dtype=np.float32), k=csls_k,
+            batch_size=batch_size)
+    predictions = retrieve(query_matrix, tgt_matrix, k=max(KS),
+                           batch_size=batch_size, penalty=penalty)
+    return precision_at_k(predictions, [gold[i] for i in queries])
+
+
+def evaluate_ann(gold, src_matrix, tgt_matrix, tgt_index, src_index=None,
+                 method='nn', csls_k=10, n_probe=16, n_candidates=100,
+                 batch_size=256):
+    """As evaluate(), retrieving targets from an IVFIndex. CSLS reranks the
+    `n_candidates` nearest targets, with penalties from `src_index` (or
+    exact ones if it is None)"""
+    queries = sorted(gold)
+    query_matrix = np.asarray(src_matrix[queries], dtype=np.float32)
+    if method == 'nn':
+        _, predictions = tgt_index.search(query_matrix, k=max(KS),
+                                          n_probe=n_probe)
+    else:
+        sims, candidates = tgt_index.search(query_matrix, k=n_candidates,
+                                            n_probe=n_probe)
+        rows = np.unique(candidates[candidates >= 0])
+        targets = np.asarray(tgt_matrix[rows], dtype=np.float32)
+        if src_index is not None:
+            neighbours, _ = src_index.search(targets, k=csls_k,
+                                             n_probe=n_probe)
+            neighbours[~np.isfinite(neighbours)] = np.nan
+            penalty = np.nan_to_num(np.nanmean(neighbours, axis=1))
+        else:
+            penalty = mean_top_k_similarity(
+                targets, np.asarray(src_matrix, dtype=np.float32), k=csls_k,
+                batch_size=batch_size)
+        scores = 2 * sims - penalty[np.searchsorted(rows, candidates)]
+        scores[candidates < 0] = -np.inf
+        predictions = np.take_along_axis(candidates,
+                                         top_k(scores, max(KS)), axis=1)
+    return precision_at_k(predictions, [gold[i] for i in queries])
+
+
+def index_recall(gold, src_matrix, tgt_matrix, tgt_index, n_probe=16,
+                 sample_size=200, seed=0):
+    """Return recall@10 of the index against exact (nn) search for a
+    sample of the source words of `gold`"""
+    queries = sorted(gold)
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(queries, min(sample_size, len(queries)),
+                                replace=False))
+    query_matrix = np.asarray(src_matrix[sample], dtype=np.float32)
+    _, exact_rows = exact_search(query_matrix, tgt_matrix, k=max(KS))
+    _, rows = tgt_index.search(query_matrix, k=max(KS), n_probe=n_probe)
+    return recall_at_k(rows, exact_rows)
+
+
+def parse_pair(pair):
+    """Split `src-tgt` (language codes may contain `-`, e.g. ja-ipadic)"""
+    for i, c in enumerate(pair):
+        if c == '-' and pair[:i] in LANGS and pair[i + 1:] in LANGS:
+            return pair[:i], pair[i + 1:]
+    raise ValueError('Unknown language pair: ' + pair)
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    if args.all:
+        pairs = sorted(parse_pair(path.basename(filename)[:-len('.mwe.txt')])
+                       for filename in glob.glob(path.join(args.dir_dict,
+                                                           '*.mwe.txt')))
+    elif args.pairs is not None:
+        pairs = [parse_pair(pair) for pair in args.pairs]
+    else:
+        logger.error('Specify --pairs or --all')
+        return 1
+
+    if args.index is not None and args.center:
+        logger.error('--center cannot be used with --index')
+        return 1
+
+    metrics = Metrics.from_args('evaluate_bli', args)
+    # Keep embeddings until their last direction
+    uses = defaultdict(int)
+    for src, tgt in pairs:
+        uses[src] += 1
+        uses[tgt] += 1
+    loaded = {}
+
+    def get(lang):
+        if lang not in loaded:
+            filename = args.emb.format(lang=lang)
+            with metrics.stage('read:' + lang) as stage:
+                emb = load_embeddings(filename, max_vocab=args.max_vocab)
+                if emb.normalized and not args.center:
+                    matrix = emb.matrix  # memory-mapped store
+                else:
+                    matrix = normalize(emb.matrix, center=args.center)
+                stage['items'] = len(emb)
+            if verbose:
+                logger.info('{}: {} words ({} dim) from {}'.format(
+                    lang, len(emb), matrix.shape[1], filename))
+            index = None
+            if args.index is not None:
+                index = IVFIndex.load(args.index.format(lang=lang))
+                if len(index) != len(emb):
+                    raise ValueError('{}: index of {} words for {} words'.format(
+                        lang, len(index), len(emb)))
+            loaded[lang] = (emb, matrix, index)
+        return loaded[lang]
+
+    report = []
+    print('\t'.join(['pair', 'method', 'queries', 'coverage']
+                    + ['P@{}'.format(k) for k in KS] + ['recall@10']))
+    for src_lang, tgt_lang in pairs:
+        name = '{}-{}'.format(src_lang, tgt_lang)
+        src, src_matrix, src_index = get(src_lang)
+        tgt, tgt_matrix, tgt_index = get(tgt_lang)
+        filename = path.join(args.dir_dict, name + '.mwe.txt')
+        gold, n_pairs, n_covered = read_dictionary(filename, src, tgt)
+        coverage = n_covered / max(n_pairs, 1)
+        recall = None
+        if tgt_index is not None and args.recall_sample > 0:
+            recall = index_recall(gold, src_matrix, tgt_matrix, tgt_index,
+                                  n_probe=args.n_probe,
+                                  sample_size=args.recall_sample)
+        for method in args.methods:
+            with metrics.stage('{}:{}'.format(name, method)) as stage:
+                if tgt_index is None:
+                    result = evaluate(gold, src_matrix, tgt_matrix,
+                                      method=method, csls_k=args.csls_k,
+                                      batch_size=args.batch_size)
+                else:
+                    result = evaluate_ann(
+                        gold, src_matrix, tgt_matrix, tgt_index,
+                        src_index=src_index, method=method,
+                        csls_k=args.csls_k, n_probe=args.n_probe,
+                        n_candidates=args.candidates,
+                        batch_size=args.batch_size)
+                stage['items'] = len(gold)
+            result['seconds'] = stage['wall_seconds']
+            result['recall@10'] = recall
+            print('\t'.join([name, method, str(len(gold)),
+                             '{:.3f}'.format(coverage)]
+                            + ['{:.4f}'.format(result['P@{}'.format(k)])
+                               for k in KS]
+                            + ['-' if recall is None
+                               else '{:.4f}'.format(recall)]), flush=True)
+            report.append(dict(pair=name, method=method, queries=len(gold),
+                               pairs=n_pairs, covered_pairs=n_covered,
+                               **result))
+        for lang in [src_lang, tgt_lang]:
+            uses[lang] -= 1
+            if uses[lang] == 0:
+                del loaded[lang]
+
+    if args.path_output is not None:
+        with open(args.path_output, 'w') as f:
+            json.dump(report, f, indent=2)
+    metrics.finish(logger if verbose else None)
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('BLI')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emb', required=True,
+                        help='path to embeddings with `{lang}` '
+                             '(e.g. emb/wiki.{lang}.mwe.vec)')
+    parser.add_argument('--pairs', nargs='+',
+                        help='directions to evaluate (e.g. en-es ja-ipadic-en)')
+    parser.add_argument('--all', action='store_true', default=False,
+                        help='all the dictionaries in --dict-dir')
+    parser.add_argument('--dict-dir', dest='dir_dict',
+                        default='data/wikt/mwe-dict',
+                        help='directory of {src}-{tgt}.mwe.txt dictionaries')
+    parser.add_argument('--methods', nargs='+', choices=['nn', 'csls'],
+                        default=['nn', 'csls'], help='retrieval methods')
+    parser.add_argument('--csls-k', type=int, default=10,
+                        help='number of neighbours for the CSLS penalty')
+    parser.add_argument('--max-vocab', type=int, default=0,
+                        help='read only the first words of embeddings '
+                             '(0: all)')
+    parser.add_argument('--center', action='store_true', default=False,
+                        help='mean-center embeddings (and renormalize)')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='number of queries scored at once')
+    parser.add_argument('--index',
+                        help='path to ANN indexes (ann_index.py) with '
+                             '`{lang}` (e.g. emb/wiki.{lang}.mwe.ivf)')
+    parser.add_argument('--n-probe', type=int, default=16,
+                        help='number of index lists probed for a query')
+    parser.add_argument('--candidates', type=int, default=100,
+                        help='number of index neighbours reranked by CSLS')
+    parser.add_argument('--recall-sample', type=int, default=200,
+                        help='number of queries to measure the recall@10 of '
+                             'the index against exact search with')
+    parser.add_argument('-o', '--output', dest='path_output',
+                        help='path to a JSON report')
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
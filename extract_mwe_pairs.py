@@ -7,19 +7,37 @@ Build a bilingual dictionarie with MWE entries.
 (Assume wn-wikt-*.tab files are in ./wikt/ and we write a resulting dictionary to wikt/mwe-dict)
 python extract_mwe_pairs.py --src en --tgt es -o wikt/mwe-dict/ -v
 
+Each lexicon is read once, so many pairs can be built in one run:
+python extract_mwe_pairs.py --src en --tgt ar bg de es -o wikt/mwe-dict/ -v
+python extract_mwe_pairs.py --src ar bg de es --tgt en -o wikt/mwe-dict/ -v
+python extract_mwe_pairs.py --all -o wikt/mwe-dict/ --workers 4 -v  # every available pair
 
-usage: extract_mwe_pairs.py [-h] [--dir DIR_WIKT] [--src SRC] --tgt TGT [-o DIR_OUTPUT]
-                            [--src-port SRC_PORT] [--tgt-port TGT_PORT] [-v]
+
+usage: extract_mwe_pairs.py [-h] [--dir DIR_WIKT] [--src SRC [SRC ...]]
+                            [--tgt TGT [TGT ...]] [--all] [-o DIR_OUTPUT]
+                            [--workers WORKERS] [--src-port SRC_PORT]
+                            [--tgt-port TGT_PORT] [--metrics PATH_METRICS]
+                            [--profile PROFILE [PROFILE ...]]
+                            [--profile-dir DIR_PROFILE] [--trace-memory] [-v]
 
 optional arguments:
   -h, --help            show this help message and exit
   --dir DIR_WIKT        path to a data directory
-  --src SRC             source language
-  --tgt TGT             target language
+  --src SRC [SRC ...]   source language(s)
+  --tgt TGT [TGT ...]   target language(s)
+  --all                 all pairs of languages whose lexicons exist
   -o DIR_OUTPUT, --output DIR_OUTPUT
                         path to an output directory
+  --workers WORKERS     number of worker processes writing dictionaries
   --src-port SRC_PORT
   --tgt-port TGT_PORT
+  --metrics PATH_METRICS
+                        path to a JSON report of per-stage metrics
+  --profile PROFILE [PROFILE ...]
+                        stages profiled with cProfile
+  --profile-dir DIR_PROFILE
+                        directory for cProfile outputs
+  --trace-memory        record peak Python memory of each stage
   -v, --verbose         verbose output
 """
 
@@ -28,6 +46,11 @@ from os import path
 import argparse
 import csv
 import logging
+import multiprocessing
+import sys
+
+from metrics import Metrics
+from metrics import add_metrics_arguments
 
 LANGS = {'ar': 'arb',
          'bg': 'bul',
@@ -43,6 +66,12 @@ LANGS = {'ar': 'arb',
          'tr': 'tur',
          'zh': 'cmn-simp'}
 
+verbose = False
+logger = None
+
+_index = None  # lang -> lexicon, shared with worker processes
+
+
 def init_logger(name='logger'):
     """Initialize a logger"""
     logger = logging.getLogger(name)
@@ -51,85 +80,122 @@ def init_logger(name='logger'):
     logging.basicConfig(format=log_fmt)
     return logger
 
-logger = init_logger('MWEDict')
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--dir', dest='dir_wikt', default='data/wikt',
-                    help='path to a data directory')
-parser.add_argument('--src', default='en',
-                    help='source language')
-parser.add_argument('--tgt', required=True, help='target language')
-parser.add_argument('-o', '--output', dest='dir_output', default='.',
-                    help='path to an output directory')
-parser.add_argument('--src-port', type=int, default=9000)
-parser.add_argument('--tgt-port', type=int, default=10000)
-parser.add_argument('-v', '--verbose',
-                    action='store_true', default=False,
-                    help='verbose output')
-args = parser.parse_args()
-verbose = args.verbose
-
-# source language
-path_src = path.join(args.dir_wikt,
-                     'wn-wikt-{}.split.tkn.tab'.format(LANGS[args.src]))
-# target langauge
-path_tgt = path.join(args.dir_wikt,
-                     'wn-wikt-{}.split.tkn.tab'.format(LANGS[args.tgt]))
-
-src_tab = list()
-tgt_tab = list()
-
-
-# Read lexicon
-src_lex = defaultdict(set)  # SynsetID (str) -> words (set)
-tgt_lex = defaultdict(set)
-
-if verbose:
-    logger.info('SRC: ' + path_src)
-    logger.info('TGT: ' + path_tgt)
-with open(path_src, 'r') as f:
-    next(f) # skip headings
-    reader = csv.reader(f, delimiter='\t')
-    for synset, _, word in reader:
-        if len(word) == 1:  # ignore one-char words
-            continue
-        src_lex[synset].add(word.lower())
-
-with open(path_tgt, 'r') as f:
-    next(f) # skip headings
-    reader = csv.reader(f, delimiter='\t')
-    for synset, _, word in reader:
-        if len(word) == 1:  # ignore one-char words
-            continue
-        tgt_lex[synset].add(word.lower())
-
-## Sort for the consistency (set -> list)
-for synset in src_lex:
-    src_lex[synset] = sorted(list(src_lex[synset]))
-for synset in tgt_lex:
-    tgt_lex[synset] = sorted(list(tgt_lex[synset]))
-
-
-# Get a list of SynsetIDs that exist in the both languages
-synset_shared = set(src_lex.keys()).intersection(tgt_lex.keys())
-if verbose:
-    logger.info('{} shared synsets'.format(len(synset_shared)))
-
-
-# Output
-path_output = path.join(args.dir_output,
-                        '{}-{}.mwe.txt'.format(args.src, args.tgt))
-counter = 0
-if verbose:
-    logger.info('Output: ' + path_output)
-with open(path_output, 'w') as f:
-    for synset in sorted(list(synset_shared)):
-        for src_word in src_lex[synset]:
-            # Ignore translations between single-token source words
-            if len(src_word.split('_')) == 1:
+
+def lexicon_path(dir_wikt, lang):
+    return path.join(dir_wikt, 'wn-wikt-{}.split.tkn.tab'.format(LANGS[lang]))
+
+
+def read_lexicon(filename):
+    """Read a tokenized lexicon and return SynsetID (str) -> sorted words"""
+    lex = defaultdict(set)
+    with open(filename, 'r') as f:
+        next(f) # skip headings
+        reader = csv.reader(f, delimiter='\t')
+        for synset, _, word in reader:
+            if len(word) == 1:  # ignore one-char words
                 continue
-            for tgt_word in tgt_lex[synset]:
-                f.write(src_word + ' ' + tgt_word + '\n')
-                counter += 1
-if verbose:
-    logger.info('Wrote {} entries'.format(counter))
+            lex[sys.intern(synset)].add(word.lower())
+
+    ## Sort for the consistency (set -> tuple)
+    return {synset: tuple(sorted(words)) for synset, words in lex.items()}
+
+
+def write_pairs(src_lex, tgt_lex, path_output):
+    """Write (MWE in src, word in tgt) pairs of shared synsets"""
+    # Get a list of SynsetIDs that exist in the both languages
+    synset_shared = set(src_lex.keys()).intersection(tgt_lex.keys())
+
+    counter = 0
+    with open(path_output, 'w') as f:
+        for synset in sorted(list(synset_shared)):
+            src_mwes = [src_word for src_word in src_lex[synset]
+                        # Ignore translations between single-token source words
+                        if len(src_word.split('_')) > 1]
+            for src_word in src_mwes:
+                f.write(''.join(src_word + ' ' + tgt_word + '\n'
+                                for tgt_word in tgt_lex[synset]))
+                counter += len(tgt_lex[synset])
+    return len(synset_shared), counter
+
+
+def _write_pair(task):
+    src, tgt, path_output = task
+    return write_pairs(_index[src], _index[tgt], path_output)
+
+
+def main(args):
+    global verbose, _index
+    verbose = args.verbose
+
+    if args.all:
+        langs = [lang for lang in sorted(LANGS)
+                 if path.exists(lexicon_path(args.dir_wikt, lang))]
+        pairs = [(src, tgt) for src in langs for tgt in langs if src != tgt]
+    elif args.tgt is not None:
+        pairs = [(src, tgt) for src in args.src for tgt in args.tgt
+                 if src != tgt]
+    else:
+        logger.error('Specify --tgt or --all')
+        return 1
+
+    metrics = Metrics.from_args('extract_mwe_pairs', args)
+    # Read each lexicon only once
+    _index = {}
+    with metrics.stage('read') as stage:
+        for lang in sorted(set(lang for pair in pairs for lang in pair)):
+            path_lex = lexicon_path(args.dir_wikt, lang)
+            if verbose:
+                logger.info('{}: {}'.format(lang, path_lex))
+            _index[lang] = read_lexicon(path_lex)
+        stage['items'] = sum(len(lex) for lex in _index.values())
+
+    tasks = [(src, tgt, path.join(args.dir_output,
+                                  '{}-{}.mwe.txt'.format(src, tgt)))
+             for src, tgt in pairs]
+    with metrics.stage('write') as stage:
+        if args.workers > 1 and len(tasks) > 1:
+            try:
+                ctx = multiprocessing.get_context('fork')
+            except ValueError:
+                ctx = multiprocessing.get_context()
+            pool = ctx.Pool(args.workers)
+            results = pool.imap(_write_pair, tasks)
+        else:
+            pool = None
+            results = map(_write_pair, tasks)
+        stage['items'] = 0
+        for (src, tgt, path_output), (n_shared, counter) in zip(tasks, results):
+            if verbose:
+                logger.info('{}-{}: {} shared synsets, wrote {} entries to {}'.format(
+                    src, tgt, n_shared, counter, path_output))
+            stage['items'] += counter
+        if pool is not None:
+            pool.close()
+            pool.join()
+    metrics.finish(logger if verbose else None)
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('MWEDict')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', dest='dir_wikt', default='data/wikt',
+                        help='path to a data directory')
+    parser.add_argument('--src', nargs='+', default=['en'],
+                        help='source language(s)')
+    parser.add_argument('--tgt', nargs='+', help='target language(s)')
+    parser.add_argument('--all', action='store_true', default=False,
+                        help='all pairs of languages whose lexicons exist')
+    parser.add_argument('-o', '--output', dest='dir_output', default='.',
+                        help='path to an output directory')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes writing dictionaries')
+    parser.add_argument('--src-port', type=int, default=9000)
+    parser.add_argument('--tgt-port', type=int, default=10000)
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
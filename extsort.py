@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""External (on-disk) sorting and merging of records with bounded memory.
+
+Records are pickled to temporary run files that are k-way merged with
+heapq.merge.
+"""
+
+from itertools import groupby
+import heapq
+import os
+import pickle
+import tempfile
+
+
+def write_run(records, dir_tmp=None):
+    """Write records to a temporary file and return its path"""
+    fd, path_run = tempfile.mkstemp(prefix='run.', suffix='.pkl', dir=dir_tmp)
+    with os.fdopen(fd, 'wb', buffering=1 << 20) as f:
+        pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+        for record in records:
+            pickler.dump(record)
+            pickler.clear_memo()
+    return path_run
+
+
+def read_run(path_run, remove=True):
+    """Yield records of a run file (removed once it is exhausted)"""
+    try:
+        with open(path_run, 'rb', buffering=1 << 20) as f:
+            unpickler = pickle.Unpickler(f)
+            while True:
+                try:
+                    yield unpickler.load()
+                except EOFError:
+                    break
+    finally:
+        if remove:
+            os.remove(path_run)
+
+
+def merge_runs(paths_run, key=None):
+    """k-way merge sorted run files"""
+    return heapq.merge(*[read_run(path_run) for path_run in paths_run],
+                       key=key)
+
+
+def external_sort(records, key=None, max_items=1000000, dir_tmp=None):
+    """Sort records holding at most `max_items` of them in memory"""
+    buff, paths_run = [], []
+    for record in records:
+        buff.append(record)
+        if len(buff) >= max_items:
+            buff.sort(key=key)
+            paths_run.append(write_run(buff, dir_tmp=dir_tmp))
+            buff = []
+    buff.sort(key=key)
+    if len(paths_run) == 0:
+        return iter(buff)
+    paths_run.append(write_run(buff, dir_tmp=dir_tmp))
+    return merge_runs(paths_run, key=key)
+
+
+def reduce_sorted(records, key, reduce):
+    """Combine adjacent records with the same key by `reduce(a, b)`"""
+    for _, group in groupby(records, key=key):
+        record = next(group)
+        for other in group:
+            record = reduce(record, other)
+        yield record
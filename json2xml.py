@@ -1,12 +1,32 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+"""Convert MWE lexicons in JSON format into mwetoolkit XML format.
+
+By default all the entries are loaded into memory. With `--sorted` (the
+lines of each input already in ascending code point order of their escaped
+`--col` values, which is checked while merging) the inputs are merged
+lazily; with `--max-entries N` they are sorted on disk in runs of N entries
+and merged. Both write the same XML as the default. A `.gz` output (or
+`--gzip`) is gzip-compressed.
+
+python json2xml.py data/mwelex/en-{eomw,parseme}.v1.json -o data/mwelex/en-eomw+parseme.v1.xml.gz --max-entries 1000000 -v
+"""
+
 from collections import defaultdict
+from itertools import groupby
 import argparse
+import heapq
 import json
 import logging
+import os
+import sys
 
+from extsort import external_sort
+from metrics import Metrics
+from metrics import add_metrics_arguments
 from utils import write_json2xml
+from utils import write_xml
 from utils import escape
 
 verbose = False
@@ -21,34 +41,98 @@ def init_logger(name='logger'):
     return logger
 
 
+def iter_keys(filename, col='lemma'):
+    """Yield escaped `col` values of a JSON lexicon"""
+    if verbose:
+        logger.info('Read ' + filename)
+    with open(filename) as f:
+        for line in f:
+            yield escape(json.loads(line)[col])
+
+
+def check_sorted(keys, filename):
+    """Yield keys, raising ValueError if one is smaller than the previous"""
+    prev = None
+    for i, key in enumerate(keys, start=1):
+        if prev is not None and key < prev:
+            raise ValueError('{}: line {} is not sorted ({!r} < {!r})'.format(
+                filename, i, key, prev))
+        prev = key
+        yield key
+
+
+def merge_keys(filenames, col='lemma', presorted=False, max_entries=1000000,
+               dir_tmp=None):
+    """Yield unique escaped `col` values of JSON lexicons in sorted order.
+    Presorted inputs raise ValueError if they are not sorted"""
+    if presorted:
+        keys = heapq.merge(*[check_sorted(iter_keys(filename, col=col),
+                                          filename)
+                             for filename in filenames])
+    else:
+        keys = external_sort((key for filename in filenames
+                              for key in iter_keys(filename, col=col)),
+                             max_items=max_entries, dir_tmp=dir_tmp)
+    for key, _ in groupby(keys):
+        yield key
+
+
 def main(args):
     global verbose
     verbose = args.verbose
 
+    metrics = Metrics.from_args('json2xml', args)
+    if args.presorted or args.max_entries is not None:
+        with metrics.stage('merge') as stage:
+            keys = merge_keys(args.path_input, col=args.col,
+                              presorted=args.presorted,
+                              max_entries=args.max_entries or 1000000,
+                              dir_tmp=args.dir_tmp)
+            # Written to a temporary file so that no partial output is left
+            path_tmp = args.path_output + '.tmp'
+            compress = args.gzip or args.path_output.endswith('.gz')
+            try:
+                counts = write_xml(path_tmp, keys, compress=compress)
+            except ValueError as e:
+                os.remove(path_tmp)
+                logger.error('{} (sort the input or drop --sorted)'.format(e))
+                return 1
+            os.replace(path_tmp, args.path_output)
+            stage['items'] = counts
+        if verbose:
+            logger.info('Wrote {} entries to {}'.format(counts, args.path_output))
+        metrics.finish(logger if verbose else None)
+        return 0
+
     if verbose:
         logger.info('Read ' + args.col)
     mwes = {}
     counts = 0
-    for filename in args.path_input:
-        if verbose:
-            logger.info('Read ' + filename)
-        with open(filename) as f:
-            for n_lines, line in enumerate(f, start=1):
-                dat = json.loads(line)
-                dat[args.col] = escape(dat[args.col])
-                if dat[args.col] in mwes:
-                    mwes[dat[args.col]]['freq'].append((dat['source'], dat['freq']))
-                    continue
-                mwes[dat[args.col]] = dat
-                freq = (mwes[dat[args.col]]['source'], mwes[dat[args.col]]['freq'])
-                mwes[dat[args.col]]['freq'] = [freq]
-                del mwes[dat[args.col]]['source']
-            counts += n_lines
+    with metrics.stage('read') as stage:
+        for filename in args.path_input:
+            if verbose:
+                logger.info('Read ' + filename)
+            with open(filename) as f:
+                for n_lines, line in enumerate(f, start=1):
+                    dat = json.loads(line)
+                    dat[args.col] = escape(dat[args.col])
+                    if dat[args.col] in mwes:
+                        mwes[dat[args.col]]['freq'].append((dat['source'], dat['freq']))
+                        continue
+                    mwes[dat[args.col]] = dat
+                    freq = (mwes[dat[args.col]]['source'], mwes[dat[args.col]]['freq'])
+                    mwes[dat[args.col]]['freq'] = [freq]
+                    del mwes[dat[args.col]]['source']
+                counts += n_lines
+        stage['items'] = counts
 
     if verbose:
         logger.info('Read {} entries'.format(counts))
         logger.info('Write {} entries to {}'.format(len(mwes), args.path_output))
-    write_json2xml(args.path_output, mwes)
+    with metrics.stage('write') as stage:
+        write_json2xml(args.path_output, mwes, compress=args.gzip)
+        stage['items'] = len(mwes)
+    metrics.finish(logger if verbose else None)
     return 0
 
 
@@ -59,8 +143,20 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', dest='path_output',
                         help='path to output file')
     parser.add_argument('--col', choices=['lemma'], default='lemma')
+    parser.add_argument('--sorted', dest='presorted',
+                        action='store_true', default=False,
+                        help='inputs are sorted by --col (escaped with '
+                             'utils.escape; checked); merge them lazily')
+    parser.add_argument('--max-entries', type=int,
+                        help='sort inputs on disk holding at most this many '
+                             'entries in memory')
+    parser.add_argument('--tmp-dir', dest='dir_tmp',
+                        help='directory for temporary files')
+    parser.add_argument('--gzip', action='store_true', default=False,
+                        help='gzip-compress the output')
+    add_metrics_arguments(parser)
     parser.add_argument('-v', '--verbose',
                         action='store_true', default=False,
                         help='verbose output')
     args = parser.parse_args()
-    main(args)
+    sys.exit(main(args))
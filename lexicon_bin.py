@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compact binary MWE lexicon that is memory-mapped on load.
+
+Convert JSON lexicons (utils.write_mwe_json / cupt2json.write_mwe_json):
+python lexicon_bin.py data/mwelex/en-{eomw,parseme}.v1.json -o data/mwelex/en-eomw+parseme.v1.bin -v
+
+Dump a binary lexicon in JSON format:
+python lexicon_bin.py data/mwelex/en-eomw+parseme.v1.bin --to-json -o en.json
+
+Layout (little-endian, every section 8-byte aligned):
+
+    header   MAGIC, then uint64 n_vocab, n_mwes, n_tokens and the byte offset
+             of each section below
+    vocab    uint32[n_vocab + 1] offsets into a UTF-8 blob of the interned
+             strings, sorted (so a string is looked up by binary search)
+    mwes     uint32[n_mwes + 1] offsets into the token arrays
+    token    uint32[n_tokens] vocabulary ids of surface forms
+    lemma    uint32[n_tokens] vocabulary ids of lemmas
+    pos      uint32[n_tokens] vocabulary ids of POS tags
+    freq     int64[n_mwes]
+    source   uint32[n_mwes] vocabulary id of `source`
+    tag      uint32[n_mwes] vocabulary id of `parseme_tag` ('' if none)
+
+Loading maps the file read-only and casts the sections to memoryviews, so
+nothing is parsed and processes loading the same file share its pages.
+"""
+
+from array import array
+import argparse
+import json
+import logging
+import mmap
+import struct
+import sys
+
+from metrics import Metrics
+from metrics import add_metrics_arguments
+from utils import read_mwe_json
+
+verbose = False
+logger = None
+
+MAGIC = b'MWELEX01'
+SECTIONS = ['vocab_offsets', 'vocab_blob', 'mwe_offsets', 'token', 'lemma',
+            'pos', 'freq', 'source', 'tag']
+HEADER = struct.Struct('<8s3Q{}Q'.format(len(SECTIONS)))
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+def _to_bytes(arr):
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def write_lexicon_bin(filename, entries):
+    """Write MWE entries (dicts as in the JSON lexicons) in binary format"""
+    entries = list(entries)
+    strings = {''}
+    for entry in entries:
+        for col in ['token', 'lemma', 'pos']:
+            strings.update(entry[col].split(' '))
+        strings.add(entry.get('source', 'n/a'))
+        strings.add(entry.get('parseme_tag', ''))
+    vocab = sorted(strings, key=lambda s: s.encode('utf_8'))
+    ids = {s: i for i, s in enumerate(vocab)}
+
+    vocab_offsets = array('I', [0])
+    blob = bytearray()
+    for s in vocab:
+        blob += s.encode('utf_8')
+        vocab_offsets.append(len(blob))
+
+    mwe_offsets = array('I', [0])
+    cols = {col: array('I') for col in ['token', 'lemma', 'pos']}
+    freq, source, tag = array('q'), array('I'), array('I')
+    for entry in entries:
+        seqs = {col: entry[col].split(' ') for col in cols}
+        n = len(seqs['lemma'])
+        if len(seqs['token']) != n or len(seqs['pos']) != n:
+            raise ValueError('Inconsistent number of tokens: {}'.format(entry))
+        for col, arr in cols.items():
+            arr.extend(ids[s] for s in seqs[col])
+        mwe_offsets.append(len(cols['lemma']))
+        freq.append(entry.get('freq', 0))
+        source.append(ids[entry.get('source', 'n/a')])
+        tag.append(ids[entry.get('parseme_tag', '')])
+
+    sections = [_to_bytes(vocab_offsets), bytes(blob), _to_bytes(mwe_offsets),
+                _to_bytes(cols['token']), _to_bytes(cols['lemma']),
+                _to_bytes(cols['pos']), _to_bytes(freq), _to_bytes(source),
+                _to_bytes(tag)]
+    offsets = []
+    pos = HEADER.size
+    for section in sections:
+        pos += -pos % 8
+        offsets.append(pos)
+        pos += len(section)
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(vocab), len(entries),
+                            len(cols['lemma']), *offsets))
+        for offset, section in zip(offsets, sections):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(section)
+    return len(vocab), len(entries)
+
+
+class BinaryLexicon(object):
+    """Read-only, memory-mapped view of a binary lexicon"""
+
+    def __init__(self, filename):
+        if sys.byteorder != 'little':
+            raise NotImplementedError('Big-endian hosts are not supported')
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.mm, 0)
+        if header[0] != MAGIC:
+            raise ValueError('Not a binary lexicon: ' + filename)
+        self.n_vocab, self.n_mwes, self.n_tokens = header[1:4]
+        offsets = dict(zip(SECTIONS, header[4:]))
+        mv = memoryview(self.mm)
+
+        def section(name, typecode, n):
+            size = array(typecode).itemsize
+            return mv[offsets[name]:offsets[name] + size * n].cast(typecode)
+
+        self.vocab_offsets = section('vocab_offsets', 'I', self.n_vocab + 1)
+        self.vocab_blob = mv[offsets['vocab_blob']:
+                             offsets['vocab_blob'] + self.vocab_offsets[-1]]
+        self.mwe_offsets = section('mwe_offsets', 'I', self.n_mwes + 1)
+        self.token = section('token', 'I', self.n_tokens)
+        self.lemma = section('lemma', 'I', self.n_tokens)
+        self.pos = section('pos', 'I', self.n_tokens)
+        self.freq = section('freq', 'q', self.n_mwes)
+        self.source = section('source', 'I', self.n_mwes)
+        self.tag = section('tag', 'I', self.n_mwes)
+
+    def __len__(self):
+        return self.n_mwes
+
+    def string(self, i):
+        """Return the i-th string in the vocabulary"""
+        return str(self.vocab_blob[self.vocab_offsets[i]:
+                                   self.vocab_offsets[i + 1]], 'utf_8')
+
+    def string_id(self, s):
+        """Return the vocabulary id of a string (binary search) or -1"""
+        key = s.encode('utf_8')
+        lo, hi = 0, self.n_vocab
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_vocab and self._bytes(lo) == key:
+            return lo
+        return -1
+
+    def _bytes(self, i):
+        return bytes(self.vocab_blob[self.vocab_offsets[i]:
+                                     self.vocab_offsets[i + 1]])
+
+    def ids(self, i, col='lemma'):
+        """Return vocabulary ids of the i-th MWE (a zero-copy memoryview,
+        which keeps the file mapped after close() while it is alive)"""
+        return getattr(self, col)[self.mwe_offsets[i]:self.mwe_offsets[i + 1]]
+
+    def sequences(self, col='lemma'):
+        """Yield each MWE as a tuple of strings"""
+        strings = {}
+        for i in range(self.n_mwes):
+            seq = []
+            for j in self.ids(i, col):
+                s = strings.get(j)
+                if s is None:
+                    s = strings[j] = self.string(j)
+                seq.append(s)
+            yield tuple(seq)
+
+    def entry(self, i):
+        """Return the i-th MWE as a dict in the JSON lexicon format"""
+        row = {col: ' '.join(self.string(j) for j in self.ids(i, col))
+               for col in ['token', 'lemma', 'pos']}
+        tag = self.string(self.tag[i])
+        if len(tag) > 0:
+            row['parseme_tag'] = tag
+        row['freq'] = self.freq[i]
+        row['source'] = self.string(self.source[i])
+        return row
+
+    def close(self):
+        """Release the sections and unmap the file. If views returned by
+        ids() are still alive, the file stays mapped until they and the
+        lexicon are garbage-collected"""
+        for name in ['vocab_offsets', 'vocab_blob', 'mwe_offsets', 'token',
+                     'lemma', 'pos', 'freq', 'source', 'tag']:
+            try:
+                getattr(self, name).release()
+            except BufferError:
+                pass
+        try:
+            self.mm.close()
+        except BufferError:
+            pass
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    metrics = Metrics.from_args('lexicon_bin', args)
+    if args.to_json:
+        with metrics.stage('write:json') as stage, \
+                open(args.path_output, 'w', encoding='utf_8') as f:
+            stage['items'] = 0
+            for path_input in args.path_input:
+                lex = BinaryLexicon(path_input)
+                for i in range(len(lex)):
+                    f.write(json.dumps(lex.entry(i), ensure_ascii=False) + '\n')
+                if verbose:
+                    logger.info('Read {} entries from {}'.format(
+                        len(lex), path_input))
+                stage['items'] += len(lex)
+                lex.close()
+        metrics.finish(logger if verbose else None)
+        return 0
+
+    def entries():
+        for path_input in args.path_input:
+            if verbose:
+                logger.info('Read ' + path_input)
+            yield from read_mwe_json(path_input)
+
+    with metrics.stage('write:bin') as stage:
+        n_vocab, n_mwes = write_lexicon_bin(args.path_output, entries())
+        stage['items'] = n_mwes
+    if verbose:
+        logger.info('Write {} entries ({} strings) to {}'.format(
+            n_mwes, n_vocab, args.path_output))
+    metrics.finish(logger if verbose else None)
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('LexBin')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path_input', nargs='+', help='path to input file')
+    parser.add_argument('-o', '--output', dest='path_output', required=True,
+                        help='path to output file')
+    parser.add_argument('--to-json', action='store_true', default=False,
+                        help='convert binary lexicon(s) into JSON')
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
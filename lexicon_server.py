@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Serve MWE lexicons for online pre-tokenization over HTTP (TCP or a Unix
+socket).
+
+python lexicon_server.py --lexicon en:data/mwelex/en-eomw.v1.json,data/mwelex/en-parseme.v1.json \
+    --lexicon ja:data/mwelex/ja-ipadic-eomw.v1.bin --socket /tmp/mwe.sock -i -v
+
+Lexicons of each language are compiled into a trie (as pretokenize.py) once.
+Requests and responses are JSON:
+
+POST /merge   {"lang": "en", "sentences": [["he", "took", "part"], "a b c"]}
+           -> {"sentences": [["he", "took_part"], "a b c"], "n_mwes": [1, 0]}
+POST /lookup  {"lang": "en", "ngrams": [["take", "part"], "in spite of"]}
+           -> {"is_mwe": [true, true]}
+POST /reload  {"lang": "en"} (all languages if omitted; also on SIGHUP)
+GET  /stats   -> request counts and p50/p99 latency (ms) of each endpoint,
+                 and the loaded lexicons
+
+A reload compiles the new lexicons while requests are served with the old
+ones, and then swaps them. `LexiconClient` is a Python client:
+
+client = LexiconClient(path_socket='/tmp/mwe.sock')
+client.merge('en', [['he', 'took', 'part', 'in', 'it']])
+"""
+
+from collections import deque
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from socketserver import UnixStreamServer
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from pretokenize import END
+from pretokenize import build_trie
+from pretokenize import load_lexicon
+from pretokenize import merge_mwes
+
+verbose = False
+logger = None
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+class LexiconIndex(object):
+    """Compiled MWE lexicons of a language"""
+
+    def __init__(self, filenames, col='lemma', lower=False):
+        self.filenames = list(filenames)
+        self.lower = lower
+        time_start = time.time()
+        mwes = load_lexicon(self.filenames, col=col, lower=lower)
+        self.trie = build_trie(mwes)
+        self.size = len(mwes)
+        self.loaded = time.time()
+        self.load_seconds = self.loaded - time_start
+
+    def merge(self, tokens, sep='_'):
+        """Return (tokens with MWEs joined by `sep`, # of MWEs)"""
+        return merge_mwes(tokens, self.trie, lower=self.lower, sep=sep)
+
+    def is_mwe(self, ngram):
+        node = self.trie
+        for token in ngram:
+            node = node.get(token.lower() if self.lower else token)
+            if node is None:
+                return False
+        return END in node
+
+    def info(self):
+        return {'files': self.filenames, 'mwes': self.size,
+                'loaded': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                        time.localtime(self.loaded)),
+                'load_seconds': self.load_seconds}
+
+
+class LatencyStats(object):
+    """Latencies of the last `window` requests of each endpoint"""
+
+    def __init__(self, window=10000):
+        self.window = window
+        self.latencies = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, seconds):
+        with self.lock:
+            if endpoint not in self.latencies:
+                self.latencies[endpoint] = deque(maxlen=self.window)
+                self.counts[endpoint] = 0
+            self.latencies[endpoint].append(seconds)
+            self.counts[endpoint] += 1
+
+    def summary(self):
+        with self.lock:
+            latencies = {k: sorted(v) for k, v in self.latencies.items()}
+            counts = dict(self.counts)
+        summary = {}
+        for endpoint, values in latencies.items():
+            pct = lambda p: 1000 * values[min(len(values) - 1,
+                                              int(p * len(values)))]
+            summary[endpoint] = {'requests': counts[endpoint],
+                                 'p50_ms': pct(0.50), 'p99_ms': pct(0.99),
+                                 'max_ms': 1000 * values[-1]}
+        return summary
+
+
+class LexiconService(object):
+    """Lexicon indexes of languages, reloaded without blocking requests"""
+
+    def __init__(self, lexicons, col='lemma', lower=False, sep='_'):
+        self.lexicons = lexicons  # language -> filenames
+        self.col = col
+        self.lower = lower
+        self.sep = sep
+        self.indexes = {}
+        self.stats = LatencyStats()
+        self.reload_lock = threading.Lock()
+        self.reload()
+
+    def reload(self, langs=None):
+        """Compile lexicons of `langs` and swap them in. If any of them
+        fails (e.g. a missing file), the old indexes are kept"""
+        with self.reload_lock:
+            langs = langs or sorted(self.lexicons)
+            for lang in langs:
+                if not isinstance(lang, str) or lang not in self.lexicons:
+                    raise ValueError('Unknown language: {}'.format(lang))
+            indexes = {lang: LexiconIndex(self.lexicons[lang], col=self.col,
+                                          lower=self.lower)
+                       for lang in langs}
+            for lang, index in indexes.items():
+                # Atomic swap: requests in flight keep the old index
+                self.indexes[lang] = index
+                if verbose:
+                    logger.info('{}: loaded {} MWEs in {:.1f} sec'.format(
+                        lang, index.size, index.load_seconds))
+
+    def index(self, lang):
+        if not isinstance(lang, str) or lang not in self.indexes:
+            raise ValueError('Unknown language: {}'.format(lang))
+        return self.indexes[lang]
+
+    def merge(self, lang, sentences):
+        index = self.index(lang)
+        outputs, counts = [], []
+        for sentence in sentences:
+            tokens = sentence.split() if isinstance(sentence, str) else sentence
+            tokens, n = index.merge(tokens, sep=self.sep)
+            outputs.append(' '.join(tokens) if isinstance(sentence, str)
+                           else tokens)
+            counts.append(n)
+        return {'sentences': outputs, 'n_mwes': counts}
+
+    def lookup(self, lang, ngrams):
+        index = self.index(lang)
+        return {'is_mwe': [index.is_mwe(ngram.split() if isinstance(ngram, str)
+                                        else ngram) for ngram in ngrams]}
+
+    def info(self):
+        return {'lexicons': {lang: index.info()
+                             for lang, index in sorted(self.indexes.items())},
+                'latency': self.stats.summary()}
+
+
+def check_sequences(items, name):
+    """Raise ValueError unless `items` is a list of strings or of lists of
+    tokens (non-blank strings; '' is the END key of the trie)"""
+    if not isinstance(items, list) or not all(
+            isinstance(item, str)
+            or (isinstance(item, list)
+                and all(isinstance(token, str) and token.strip() != ''
+                        for token in item))
+            for item in items):
+        raise ValueError('`{}` must be a list of strings or of lists of '
+                         'non-blank strings'.format(name))
+    return items
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def address_string(self):
+        return str(self.client_address)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf_8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.server.service.info())
+        else:
+            self.send_json(404, {'error': 'Not found: ' + self.path})
+
+    def do_POST(self):
+        time_start = time.perf_counter()
+        service = self.server.service
+        code, body = self.handle_post(service)
+        self.send_json(code, body)
+        # Failed requests are recorded as `PATH CODE` (`* 404` if unknown)
+        endpoint = self.path if code != 404 else '*'
+        if code != 200:
+            endpoint = '{} {}'.format(endpoint, code)
+        service.stats.add(endpoint, time.perf_counter() - time_start)
+
+    def handle_post(self, service):
+        """Return (status code, JSON body) of a POST request"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError('Negative Content-Length: {}'.format(length))
+        except ValueError as e:
+            self.close_connection = True  # the body cannot be skipped
+            return 400, {'error': str(e)}
+        data = self.rfile.read(length)  # read even if unused (keep-alive)
+        if self.path not in ['/merge', '/lookup', '/reload']:
+            return 404, {'error': 'Not found: ' + self.path}
+        try:
+            request = json.loads(data or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('The request must be a JSON object')
+            if self.path == '/merge':
+                return 200, service.merge(
+                    request['lang'],
+                    check_sequences(request['sentences'], 'sentences'))
+            if self.path == '/lookup':
+                return 200, service.lookup(
+                    request['lang'], check_sequences(request['ngrams'],
+                                                     'ngrams'))
+            langs = [request['lang']] if 'lang' in request else None
+        except KeyError as e:
+            return 400, {'error': 'Missing field: {}'.format(e)}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            if logger is not None:
+                logger.exception('{} failed'.format(self.path))
+            return 500, {'error': 'Internal error: {!r}'.format(e)}
+        try:
+            service.reload(langs)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            if logger is not None:
+                logger.error('Reload failed: {!r}'.format(e))
+            return 500, {'error': 'Reload failed: {}'.format(e)}
+        return 200, service.info()['lexicons']
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def make_server(service, host='127.0.0.1', port=8765, path_socket=None):
+    if path_socket is not None:
+        if os.path.exists(path_socket):
+            os.remove(path_socket)
+        server = ThreadingUnixHTTPServer(path_socket, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = service
+    return server
+
+
+class UnixHTTPConnection(HTTPConnection):
+
+    def __init__(self, path_socket, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path_socket = path_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path_socket)
+
+
+class LexiconClient(object):
+    """Client of a lexicon server (one persistent connection; use one client
+    per thread)"""
+
+    def __init__(self, host='127.0.0.1', port=8765, path_socket=None,
+                 timeout=10.0):
+        if path_socket is not None:
+            self.conn = UnixHTTPConnection(path_socket, timeout=timeout)
+        else:
+            self.conn = HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body).encode('utf_8')
+        headers = {} if data is None else {'Content-Type': 'application/json'}
+        self.conn.request(method, path, body=data, headers=headers)
+        response = self.conn.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError('{}: {}'.format(response.status,
+                                               result.get('error')))
+        return result
+
+    def merge(self, lang, sentences):
+        """Return sentences (lists of tokens or strings) with MWEs joined"""
+        return self.request('POST', '/merge', {'lang': lang,
+                                               'sentences': sentences})['sentences']
+
+    def is_mwe(self, lang, ngrams):
+        return self.request('POST', '/lookup', {'lang': lang,
+                                                'ngrams': ngrams})['is_mwe']
+
+    def reload(self, lang=None):
+        return self.request('POST', '/reload',
+                            {} if lang is None else {'lang': lang})
+
+    def stats(self):
+        return self.request('GET', '/stats')
+
+    def close(self):
+        self.conn.close()
+
+
+def parse_lexicons(specs):
+    """Parse `LANG:PATH[,PATH...]` into a dict from languages to files"""
+    lexicons = {}
+    for spec in specs:
+        lang, sep, filenames = spec.partition(':')
+        if len(sep) == 0:
+            raise ValueError('Expected LANG:PATH[,PATH...]: ' + spec)
+        lexicons.setdefault(lang, []).extend(filenames.split(','))
+    return lexicons
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    service = LexiconService(parse_lexicons(args.lexicon), col=args.col,
+                             lower=args.lower, sep=args.sep)
+    server = make_server(service, host=args.host, port=args.port,
+                         path_socket=args.path_socket)
+
+    def reload_all():
+        try:
+            service.reload()
+        except Exception as e:
+            logger.error('Reload failed (old lexicons kept): {!r}'.format(e))
+
+    def reload(signum, frame):
+        threading.Thread(target=reload_all, daemon=True).start()
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    if verbose:
+        logger.info('Listening on {}'.format(
+            args.path_socket or '{}:{}'.format(args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.path_socket is not None and os.path.exists(args.path_socket):
+            os.remove(args.path_socket)
+        if verbose:
+            logger.info('Latency: {}'.format(service.stats.summary()))
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('LexServer')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lexicon', nargs='+', required=True,
+                        help='LANG:PATH[,PATH...] (JSON or *.bin lexicons)')
+    parser.add_argument('--col', choices=['lemma', 'token'], default='lemma',
+                        help='lexicon field to match against tokens')
+    parser.add_argument('-i', '--ignore-case', dest='lower',
+                        action='store_true', default=False,
+                        help='lowercase lexicon entries and tokens')
+    parser.add_argument('--sep', default='_',
+                        help='separator for joining MWE tokens')
+    parser.add_argument('--host', default='127.0.0.1', help='host name')
+    parser.add_argument('--port', type=int, default=8765, help='port number')
+    parser.add_argument('--socket', dest='path_socket',
+                        help='path to a Unix socket (instead of TCP)')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per-stage instrumentation shared by the scripts.
+
+    metrics = Metrics.from_args('json2xml', args)
+    with metrics.stage('read') as stage:
+        ...
+        stage['items'] = n_entries
+    metrics.finish(logger if verbose else None)
+
+Each stage records wall time, CPU time, the peak RSS so far and items/sec.
+Scripts accept:
+
+  --metrics PATH        write a JSON report of the run
+  --profile STAGE ...   run these stages under cProfile
+                        (`{profile_dir}/{script}.{stage}.prof`)
+  --trace-memory        record the peak Python memory of each stage with
+                        tracemalloc (slow)
+"""
+
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss():
+    """Peak RSS (bytes) of this process or of its largest waited-for child,
+    whichever is larger (RUSAGE_CHILDREN reports the largest child, not a
+    sum, so the two are not added)"""
+    if resource is None:
+        return None
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return unit * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', dest='path_metrics',
+                        help='path to a JSON report of per-stage metrics')
+    parser.add_argument('--profile', nargs='+', default=[],
+                        help='stages profiled with cProfile')
+    parser.add_argument('--profile-dir', dest='dir_profile', default='.',
+                        help='directory for cProfile outputs')
+    parser.add_argument('--trace-memory', action='store_true', default=False,
+                        help='record peak Python memory of each stage')
+
+
+class Metrics(object):
+    """Metrics of the stages of a run"""
+
+    def __init__(self, script, profile=(), dir_profile='.',
+                 trace_memory=False, path_output=None):
+        self.script = script
+        self.profile = set(profile)
+        self.dir_profile = dir_profile
+        self.trace_memory = trace_memory
+        self.path_output = path_output
+        self.stages = []
+        self.time_start = time.time()
+        self.cpu_start = time.process_time()
+
+    @classmethod
+    def from_args(cls, script, args):
+        return cls(script,
+                   profile=getattr(args, 'profile', None) or (),
+                   dir_profile=getattr(args, 'dir_profile', '.'),
+                   trace_memory=getattr(args, 'trace_memory', False),
+                   path_output=getattr(args, 'path_metrics', None))
+
+    @contextmanager
+    def stage(self, name):
+        """Measure a stage. The caller may set `items` of the yielded dict"""
+        record = {'stage': name, 'items': None}
+        profiler = None
+        if name in self.profile:
+            profiler = cProfile.Profile()
+        if self.trace_memory:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            record['peak_rss_bytes'] = peak_rss()
+            if self.trace_memory:
+                record['peak_traced_bytes'] = \
+                    tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            if record['items'] is not None and record['wall_seconds'] > 0:
+                record['items_per_sec'] = \
+                    record['items'] / record['wall_seconds']
+            if profiler is not None:
+                os.makedirs(self.dir_profile, exist_ok=True)
+                record['profile'] = os.path.join(
+                    self.dir_profile, '{}.{}.prof'.format(self.script, name))
+                profiler.dump_stats(record['profile'])
+            self.stages.append(record)
+
+    def report(self):
+        return {'script': self.script,
+                'argv': sys.argv,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                         time.localtime(self.time_start)),
+                'wall_seconds': time.time() - self.time_start,
+                'cpu_seconds': time.process_time() - self.cpu_start,
+                'peak_rss_bytes': peak_rss(),
+                'stages': self.stages}
+
+    def finish(self, logger=None):
+        """Log a summary (if a logger is given) and write the report"""
+        report = self.report()
+        if logger is not None:
+            for record in self.stages:
+                msg = '[{}] {:.2f}s wall, {:.2f}s cpu'.format(
+                    record['stage'], record['wall_seconds'],
+                    record['cpu_seconds'])
+                if 'items_per_sec' in record:
+                    msg += ', {} items ({:.1f}/s)'.format(
+                        record['items'], record['items_per_sec'])
+                if record['peak_rss_bytes'] is not None:
+                    msg += ', peak RSS {:.1f} MiB'.format(
+                        record['peak_rss_bytes'] / (1 << 20))
+                logger.info(msg)
+        if self.path_output is not None:
+            with open(self.path_output, 'w') as f:
+                json.dump(report, f, indent=2)
+        return report
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""In-process OpenCC conversion of Chinese strings.
+
+tokenize_wn-wikt.py and wnwikt2json_udpipe.py convert their input surfaces
+(`--convert-input s2t`) and output tokens/lemmas (`--convert-output t2s`)
+field by field instead of piping whole files through the `opencc` CLI.
+Requires the OpenCC Python binding (`pip install opencc`, or
+`opencc-python-reimplemented`).
+
+As a drop-in replacement of `opencc -c s2t.json < IN > OUT`:
+
+python opencc_convert.py s2t < data/wikt/wn-wikt-cmn.split.tab > data/wikt/wn-wikt-cmn-trad.split.tab
+"""
+
+import argparse
+import sys
+
+CONFIGS = ['s2t', 't2s', 's2tw', 'tw2s', 's2hk', 'hk2s', 's2twp', 'tw2sp',
+           't2tw', 't2hk']
+
+_opencc = {}  # configuration -> OpenCC object (loaded once per process)
+
+
+def load_opencc(config):
+    """Return an OpenCC object of a configuration (`s2t` or `s2t.json`)"""
+    import opencc
+
+    name = config[:-len('.json')] if config.endswith('.json') else config
+    if name not in _opencc:
+        try:
+            _opencc[name] = opencc.OpenCC(name + '.json')
+        except Exception:  # opencc-python-reimplemented takes `s2t`
+            _opencc[name] = opencc.OpenCC(name)
+    return _opencc[name]
+
+
+class Converter(object):
+    """Memoized conversion of strings (ASCII strings are returned as they
+    are)"""
+
+    def __init__(self, config, max_entries=1000000):
+        self.config = config
+        self.opencc = load_opencc(config)
+        self.max_entries = max_entries
+        self.memo = {}
+
+    def __call__(self, s):
+        if s.isascii():
+            return s
+        try:
+            return self.memo[s]
+        except KeyError:
+            pass
+        converted = self.opencc.convert(s)
+        if len(self.memo) < self.max_entries:
+            self.memo[s] = converted
+        return converted
+
+
+def get_converter(config):
+    """Return a Converter, or None if `config` is None"""
+    if config is None:
+        return None
+    return Converter(config)
+
+
+def main(args):
+    convert = Converter(args.config)
+    for line in sys.stdin:
+        sys.stdout.write(convert(line))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', help='OpenCC configuration (e.g. s2t)')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Build MWE lexicons and bilingual dictionaries (the commands in README.md)
+with dependency tracking.
+
+A step is skipped when its outputs exist and neither its command, the
+contents of its inputs nor the Python script it runs (with the local modules
+it imports) have changed since the last successful run (recorded in
+`{dir_data}/.pipeline-state.json`). Independent steps (e.g. different
+languages) run concurrently up to `--jobs`.
+
+python pipeline.py --jobs 4 -v
+python pipeline.py --langs en es --dry-run
+"""
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from os import path
+import argparse
+import ast
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+verbose = False
+logger = None
+
+# language: (EOMW code, UDPipe model name)
+EOMW = {'ar': ('arb', 'arabic'),
+        'bg': ('bul', 'bulgarian'),
+        'de': ('deu', 'german'),
+        'en': ('eng', 'english'),
+        'es': ('spa', 'spanish'),
+        'he': ('heb', 'hebrew'),
+        'hi': ('hin', 'hindi'),
+        'ru': ('rus', 'russian'),
+        'tr': ('tur', 'turkish')}
+
+# language: PARSEME v1.1 splits
+PARSEME = {'bg': ['train', 'dev', 'test'],
+           'de': ['train', 'dev', 'test'],
+           'en': ['train', 'test'],
+           'es': ['train', 'dev', 'test'],
+           'he': ['train', 'dev', 'test'],
+           'hi': ['train', 'test'],
+           'tr': ['train', 'dev', 'test']}
+
+ALL_LANGS = sorted(EOMW) + ['ja-ipadic', 'ja-unidic', 'zh']
+
+UDPIPE_MODEL = '{}-ud-2.0-conll17-170315.udpipe'
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+class Step(object):
+    """A command that builds `outputs` from `inputs`.
+
+    `stdin`/`stdout` redirect the command from/to files (e.g. opencc)."""
+
+    def __init__(self, name, cmd, inputs, outputs, stdin=None, stdout=None):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.stdin = stdin
+        self.stdout = stdout
+        self.deps = set()
+
+    def __repr__(self):
+        return 'Step({})'.format(self.name)
+
+
+def python(script, *args):
+    return [sys.executable, script] + [str(arg) for arg in args]
+
+
+def plan(langs, dir_data='data', dir_models='udpipe_models',
+         dir_parseme='mwe-lexicon/PARSEME', path_cache=None,
+         opencc_cli=False):
+    """Return the list of steps for `langs` (in the order of README.md).
+    Chinese is converted in-process (opencc_convert.py) unless
+    `opencc_cli`."""
+    dir_wikt = path.join(dir_data, 'wikt')
+    dir_lex = path.join(dir_data, 'mwelex')
+    dir_dict = path.join(dir_wikt, 'mwe-dict')
+    wikt = lambda name: path.join(dir_wikt, 'wn-wikt-{}'.format(name))
+    lex = lambda name: path.join(dir_lex, name)
+    model = lambda name: path.join(dir_models, UDPIPE_MODEL.format(name))
+    cache = [] if path_cache is None else ['--cache', path_cache]
+    steps = []
+
+    # Split EOMW entries
+    codes = sorted(set([EOMW[lang][0] for lang in langs if lang in EOMW]
+                       + (['jpn'] if any(lang.startswith('ja')
+                                         for lang in langs) else [])
+                       + (['cmn'] if 'zh' in langs else [])))
+    steps.append(Step('split', python('split_eomw_entry.py', dir_wikt),
+                      [wikt(code) + '.tab' for code in codes],
+                      [wikt(code) + '.split.tab' for code in codes]))
+    if 'zh' in langs and opencc_cli:
+        steps.append(Step('opencc-s2t:zh', ['opencc', '-c', 's2t.json'],
+                          [wikt('cmn.split.tab')],
+                          [wikt('cmn-trad.split.tab')],
+                          stdin=wikt('cmn.split.tab'),
+                          stdout=wikt('cmn-trad.split.tab')))
+
+    # (1) MWE lists and (2) tokenized lexicons
+    for lang in langs:
+        if lang in EOMW:
+            code, name = EOMW[lang]
+            src = wikt(code) + '.split.tab'
+            steps.append(Step(
+                'json:' + lang,
+                python('wnwikt2json_udpipe.py', src, '-o',
+                       lex(f'{lang}-eomw.v1.json'), '--model', model(name),
+                       '--lang', lang, *cache),
+                [src, model(name)], [lex(f'{lang}-eomw.v1.json')]))
+            steps.append(Step(
+                'tokenize:' + lang,
+                python('tokenize_wn-wikt.py', src, '-o',
+                       wikt(code) + '.split.tkn.tab', '--lang', lang,
+                       '--model', model(name), *cache),
+                [src, model(name)], [wikt(code) + '.split.tkn.tab']))
+        elif lang == 'ja-unidic':
+            src = wikt('jpn.split.tab')
+            steps.append(Step(
+                'json:' + lang,
+                python('wnwikt2json_udpipe.py', src, '-o',
+                       lex('ja-unidic-eomw.v1.json'),
+                       '--model', model('japanese'), '--lang', 'ja', *cache),
+                [src, model('japanese')], [lex('ja-unidic-eomw.v1.json')]))
+            steps.append(Step(
+                'tokenize:' + lang,
+                python('tokenize_wn-wikt.py', src, '-o',
+                       wikt('jpn-unidic.split.tkn.tab'), '--lang', 'ja',
+                       '--model', model('japanese'), *cache),
+                [src, model('japanese')], [wikt('jpn-unidic.split.tkn.tab')]))
+        elif lang == 'ja-ipadic':
+            src = wikt('jpn.split.tab')
+            steps.append(Step(
+                'json:' + lang,
+                python('wnwikt2json_mecab.py', src, '-o',
+                       lex('ja-ipadic-eomw.v1.json'), '--dict', 'ipadic',
+                       *cache),
+                [src], [lex('ja-ipadic-eomw.v1.json')]))
+            steps.append(Step(
+                'tokenize:' + lang,
+                python('tokenize_wn-wikt.py', src, '-o',
+                       wikt('jpn-ipadic.split.tkn.tab'), '--lang', 'ja-ipadic',
+                       *cache),
+                [src], [wikt('jpn-ipadic.split.tkn.tab')]))
+        elif lang == 'zh' and not opencc_cli:
+            # Tokenize traditional characters and convert them back
+            src = wikt('cmn.split.tab')
+            opencc = ['--convert-input', 's2t', '--convert-output', 't2s']
+            steps.append(Step(
+                'json:' + lang,
+                python('wnwikt2json_udpipe.py', src, '-o',
+                       lex('zh-eomw.v1.json'), '--model', model('chinese'),
+                       '--lang', 'zh', *opencc, *cache),
+                [src, model('chinese')], [lex('zh-eomw.v1.json')]))
+            steps.append(Step(
+                'tokenize:' + lang,
+                python('tokenize_wn-wikt.py', src, '-o',
+                       wikt('cmn-simp.split.tkn.tab'), '--lang', 'zh',
+                       '--model', model('chinese'), *opencc, *cache),
+                [src, model('chinese')], [wikt('cmn-simp.split.tkn.tab')]))
+        elif lang == 'zh':
+            src = wikt('cmn-trad.split.tab')
+            steps.append(Step(
+                'json-trad:' + lang,
+                python('wnwikt2json_udpipe.py', src, '-o',
+                       lex('zh-trad-eomw.v1.json'),
+                       '--model', model('chinese'), '--lang', 'zh', *cache),
+                [src, model('chinese')], [lex('zh-trad-eomw.v1.json')]))
+            steps.append(Step('json:' + lang, ['opencc', '-c', 't2s.json'],
+                              [lex('zh-trad-eomw.v1.json')],
+                              [lex('zh-eomw.v1.json')],
+                              stdin=lex('zh-trad-eomw.v1.json'),
+                              stdout=lex('zh-eomw.v1.json')))
+            steps.append(Step(
+                'tokenize-trad:' + lang,
+                python('tokenize_wn-wikt.py', src, '-o',
+                       wikt('cmn-trad.split.tkn.tab'), '--lang', 'zh',
+                       '--model', model('chinese'), *cache),
+                [src, model('chinese')], [wikt('cmn-trad.split.tkn.tab')]))
+            steps.append(Step('tokenize:' + lang,
+                              ['opencc', '-c', 't2s.json'],
+                              [wikt('cmn-trad.split.tkn.tab')],
+                              [wikt('cmn-simp.split.tkn.tab')],
+                              stdin=wikt('cmn-trad.split.tkn.tab'),
+                              stdout=wikt('cmn-simp.split.tkn.tab')))
+        else:
+            raise ValueError('Unknown language: ' + lang)
+
+        path_json = lex(f'{lang}-eomw.v1.json')
+        steps.append(Step('xml:' + lang,
+                          python('json2xml.py', path_json, '-o',
+                                 lex(f'{lang}-eomw.v1.xml')),
+                          [path_json], [lex(f'{lang}-eomw.v1.xml')]))
+
+        # PARSEME
+        dir_cupt = path.join(dir_parseme, lang.upper())
+        if lang in PARSEME and path.isdir(dir_cupt):
+            cupts = [path.join(dir_cupt, f'{split}.cupt')
+                     for split in PARSEME[lang]]
+            path_parseme = lex(f'{lang}-parseme.v1.json')
+            steps.append(Step('parseme:' + lang,
+                              python('cupt2json.py', *cupts, '-o',
+                                     path_parseme, '--source',
+                                     'PARSEMEv1.1'),
+                              cupts, [path_parseme]))
+            steps.append(Step('xml-parseme:' + lang,
+                              python('json2xml.py', path_json, path_parseme,
+                                     '-o', lex(f'{lang}-eomw+parseme.v1.xml')),
+                              [path_json, path_parseme],
+                              [lex(f'{lang}-eomw+parseme.v1.xml')]))
+
+    # Bilingual dictionaries (en <-> L2)
+    tkn = {lang: step.outputs[0] for step in steps
+           for lang in langs if step.name == 'tokenize:' + lang}
+    if 'en' in langs:
+        for lang in langs:
+            if lang == 'en':
+                continue
+            for src, tgt in [('en', lang), (lang, 'en')]:
+                steps.append(Step(
+                    f'pairs:{src}-{tgt}',
+                    python('extract_mwe_pairs.py', '--dir', dir_wikt,
+                           '--src', src, '--tgt', tgt, '-o', dir_dict),
+                    [tkn[src], tkn[tgt]],
+                    [path.join(dir_dict, f'{src}-{tgt}.mwe.txt')]))
+
+    # Resolve dependencies from inputs/outputs
+    producers = {}
+    for step in steps:
+        for output in step.outputs:
+            producers[output] = step
+    for step in steps:
+        step.deps = set(producers[i] for i in step.inputs
+                        if i in producers and producers[i] is not step)
+    return steps
+
+
+def local_modules(script):
+    """Return the script and the modules next to it that it imports
+    (transitively)"""
+    dirname = path.dirname(script)
+    todo, seen = [script], set()
+    while len(todo) > 0:
+        filename = todo.pop()
+        if filename in seen:
+            continue
+        seen.add(filename)
+        with open(filename, 'rb') as f:
+            tree = ast.parse(f.read(), filename)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = path.join(dirname, name.split('.')[0] + '.py')
+                if path.exists(module):
+                    todo.append(module)
+    return sorted(seen)
+
+
+class State(object):
+    """Signatures of steps built successfully and memoized file digests"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.steps = {}
+        self.digests = {}
+        self.modules = {}
+        if path.exists(filename):
+            with open(filename) as f:
+                dat = json.load(f)
+            self.steps = dat.get('steps', {})
+            self.digests = dat.get('digests', {})
+
+    def digest(self, filename):
+        """SHA1 of a file (memoized by size and mtime)"""
+        st = os.stat(filename)
+        with self.lock:
+            memo = self.digests.get(filename)
+        if memo is not None and memo[0] == st.st_size \
+           and memo[1] == st.st_mtime:
+            return memo[2]
+        h = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        with self.lock:
+            self.digests[filename] = [st.st_size, st.st_mtime, h.hexdigest()]
+        return h.hexdigest()
+
+    def signature(self, step):
+        h = hashlib.sha1(json.dumps(
+            [step.cmd, step.stdin, step.stdout]).encode('utf_8'))
+        code = []
+        if step.cmd[0] == sys.executable and path.exists(step.cmd[1]):
+            with self.lock:
+                if step.cmd[1] not in self.modules:
+                    self.modules[step.cmd[1]] = local_modules(step.cmd[1])
+                code = self.modules[step.cmd[1]]
+        for filename in step.inputs + code:
+            h.update((filename + '\0' + self.digest(filename)).encode('utf_8'))
+        return h.hexdigest()
+
+    def is_up_to_date(self, step):
+        if not all(path.exists(output) for output in step.outputs):
+            return False
+        if not all(path.exists(i) for i in step.inputs):
+            return False
+        with self.lock:
+            signature = self.steps.get(step.name)
+        return signature == self.signature(step)
+
+    def update(self, step):
+        signature = self.signature(step)
+        with self.lock:
+            self.steps[step.name] = signature
+            for output in step.outputs:
+                self.digests.pop(output, None)
+            self.save()
+
+    def save(self):
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump({'steps': self.steps, 'digests': self.digests}, f,
+                      indent=1)
+        os.replace(self.filename + '.tmp', self.filename)
+
+
+def run_step(step, dir_metrics=None):
+    for output in step.outputs:
+        dirname = path.dirname(output)
+        if len(dirname) > 0:
+            os.makedirs(dirname, exist_ok=True)
+    cmd = step.cmd
+    if dir_metrics is not None and cmd[0] == sys.executable:
+        # Not part of the signature: metrics do not invalidate outputs
+        os.makedirs(dir_metrics, exist_ok=True)
+        cmd = cmd + ['--metrics', path.join(
+            dir_metrics, step.name.replace(':', '.') + '.json')]
+    stdin = open(step.stdin, 'rb') if step.stdin is not None else None
+    stdout = open(step.stdout, 'wb') if step.stdout is not None else None
+    try:
+        return subprocess.run(cmd, stdin=stdin, stdout=stdout).returncode
+    finally:
+        if stdin is not None:
+            stdin.close()
+        if stdout is not None:
+            stdout.close()
+
+
+def run(steps, state, jobs=1, force=False, dry_run=False, dir_metrics=None):
+    """Run steps whose dependencies are done, up to `jobs` at a time.
+    Python steps write their metrics (metrics.py) to `dir_metrics`.
+    Return the list of failed steps."""
+    done, failed, skipped = set(), [], 0
+    pending = list(steps)
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            for step in list(pending):
+                if any(dep in failed for dep in step.deps):
+                    logger.error(f'{step.name}: skipped (dependency failed)')
+                    pending.remove(step)
+                    failed.append(step)
+                    continue
+                if not step.deps.issubset(done):
+                    continue
+                pending.remove(step)
+                if not force and state.is_up_to_date(step):
+                    if verbose:
+                        logger.info(f'{step.name}: up to date')
+                    done.add(step)
+                    skipped += 1
+                    continue
+                if dry_run:
+                    logger.info('{}: {}'.format(step.name, ' '.join(step.cmd)))
+                    done.add(step)
+                    continue
+                missing = [i for i in step.inputs if not path.exists(i)]
+                if len(missing) > 0:
+                    logger.error('{}: missing input(s) {}'.format(
+                        step.name, ', '.join(missing)))
+                    failed.append(step)
+                    continue
+                if verbose:
+                    logger.info('{}: {}'.format(step.name, ' '.join(step.cmd)))
+                running[executor.submit(run_step, step, dir_metrics)] = step
+            if len(running) == 0:
+                continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                if future.result() == 0:
+                    state.update(step)
+                    done.add(step)
+                    if verbose:
+                        logger.info(f'{step.name}: done')
+                else:
+                    logger.error(f'{step.name}: failed')
+                    failed.append(step)
+    if verbose:
+        logger.info('{} steps: {} up to date, {} failed'.format(
+            len(steps), skipped, len(failed)))
+    return failed
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    steps = plan(args.langs, dir_data=args.dir_data,
+                 dir_models=args.dir_models, dir_parseme=args.dir_parseme,
+                 path_cache=args.path_cache, opencc_cli=args.opencc_cli)
+    if args.targets is not None:
+        targets = set()
+        queue = [step for step in steps
+                 if any(step.name.startswith(t) for t in args.targets)]
+        while len(queue) > 0:
+            step = queue.pop()
+            if step not in targets:
+                targets.add(step)
+                queue.extend(step.deps)
+        steps = [step for step in steps if step in targets]
+
+    state = State(path.join(args.dir_data, '.pipeline-state.json'))
+    failed = run(steps, state, jobs=args.jobs, force=args.force,
+                 dry_run=args.dry_run, dir_metrics=args.dir_metrics)
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('Pipeline')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--langs', nargs='+', default=ALL_LANGS,
+                        choices=ALL_LANGS, help='languages')
+    parser.add_argument('--targets', nargs='+',
+                        help='build only steps whose names start with these '
+                             '(e.g. `xml:en`, `pairs:`) and their dependencies')
+    parser.add_argument('--data', dest='dir_data', default='data',
+                        help='path to a data directory')
+    parser.add_argument('--models', dest='dir_models', default='udpipe_models',
+                        help='path to a directory of UDPipe models')
+    parser.add_argument('--parseme', dest='dir_parseme',
+                        default='mwe-lexicon/PARSEME',
+                        help='path to a PARSEME v1.1 directory')
+    parser.add_argument('--cache', dest='path_cache',
+                        help='path to an analysis cache (SQLite) file')
+    parser.add_argument('--opencc-cli', action='store_true', default=False,
+                        help='convert Chinese with the opencc command '
+                             '(without the OpenCC Python binding)')
+    parser.add_argument('--metrics-dir', dest='dir_metrics',
+                        help='directory for per-step metrics reports')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='maximum number of steps run concurrently')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='rebuild all steps')
+    parser.add_argument('-n', '--dry-run', action='store_true', default=False,
+                        help='print commands without running them')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
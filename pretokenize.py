@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Pre-tokenize MWEs in a (whitespace-tokenized) corpus with MWE lexicons.
+
+MWE entries of the lexicons (`lemma` or `token` column) are compiled into a
+token-level trie and the longest MWE starting at each position is joined with
+'_'.
+
+he took part in the meeting
+->
+he took_part_in the meeting
+
+python pretokenize.py corpus.txt --lexicon data/mwelex/en-{eomw,parseme}.v1.json -o corpus.mwe.txt -i -v
+
+With `--workers N`, each input file is split into byte ranges of about
+`--chunk-bytes` on line boundaries and the chunks are processed by N worker
+processes sharing the compiled trie (copy-on-write after fork). The output is
+written in the original order, or to one file per chunk with `--shard-output`.
+
+With `--max-gap N`, MWEs also match discontinuously, with up to N tokens in
+total between their components (`--gap-pos DET ADJ` restricts gap tokens to
+these POS tags, given as `word/TAG` tokens with `--tag-sep /`). A merged MWE
+takes the position of its first component and the gap tokens follow it:
+
+he made a quick decision  (lexicon: `make decision`, lemmatized corpus)
+->
+he made_decision a quick
+"""
+
+from functools import partial
+import argparse
+import codecs
+import gc
+import logging
+import multiprocessing
+import os
+import sys
+
+from lexicon_bin import BinaryLexicon
+from metrics import Metrics
+from metrics import add_metrics_arguments
+from utils import read_mwe_json
+
+verbose = False
+logger = None
+
+END = ''  # key of a terminal node (never a token after str.split())
+
+_worker_trie = None  # trie shared with worker processes
+
+
+def init_logger(name='logger'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    log_fmt = '%(asctime)s/%(name)s[%(levelname)s]: %(message)s'
+    logging.basicConfig(format=log_fmt)
+    return logger
+
+
+def read_sequences(filename, col='lemma'):
+    """Yield MWEs of a JSON or binary (*.bin, see lexicon_bin.py) lexicon
+    as tuples of strings"""
+    if filename.endswith('.bin'):
+        lex = BinaryLexicon(filename)
+        yield from lex.sequences(col)
+        lex.close()
+        return
+    for entry in read_mwe_json(filename):
+        yield tuple(entry[col].split())
+
+
+def load_lexicon(filenames, col='lemma', lower=False):
+    """Read MWE lexicons and return a set of token sequences"""
+    mwes = set()
+    for filename in filenames:
+        for mwe in read_sequences(filename, col=col):
+            if lower:
+                mwe = tuple(' '.join(mwe).lower().split())
+            if len(mwe) <= 1:
+                continue
+            mwes.add(mwe)
+    return mwes
+
+
+def build_trie(mwes):
+    """Compile token sequences into a token-level trie (nested dicts)"""
+    trie = {}
+    for mwe in mwes:
+        node = trie
+        for token in mwe:
+            node = node.setdefault(token, {})
+        node[END] = len(mwe)
+    return trie
+
+
+def find_mwes(keys, trie):
+    """Yield (start, end) spans of the longest non-overlapping MWEs"""
+    i, n = 0, len(keys)
+    while i < n:
+        node = trie.get(keys[i])
+        if node is None:
+            i += 1
+            continue
+        end = -1
+        j = i + 1
+        while True:
+            if END in node:
+                end = j
+            if j == n:
+                break
+            node = node.get(keys[j])
+            if node is None:
+                break
+            j += 1
+        if end < 0:
+            i += 1
+            continue
+        yield i, end
+        i = end
+
+
+def match_gappy_mwe(keys, node, i, max_gap=1, gap_ok=None):
+    """Return (positions, # of gaps) of the MWE starting at i (whose trie
+    node is `node`) with the most components (then the fewest gaps), or
+    (None, 0)"""
+    n = len(keys)
+    best, best_gaps = None, 0
+    states = [(node, 0, (i,))]
+    j = i + 1
+    while len(states) > 0 and j < n:
+        key = keys[j]
+        skip = gap_ok is None or gap_ok[j]
+        next_states = []
+        for node, gaps, positions in states:
+            child = node.get(key)
+            if child is not None:
+                matched = positions + (j,)
+                if END in child:
+                    if best is None or len(matched) > len(best) \
+                            or (len(matched) == len(best)
+                                and gaps < best_gaps):
+                        best, best_gaps = matched, gaps
+                    if len(child) > 1:  # longer MWEs continue
+                        next_states.append((child, gaps, matched))
+                else:
+                    next_states.append((child, gaps, matched))
+            if skip and gaps < max_gap:
+                next_states.append((node, gaps + 1, positions))
+        states = next_states
+        j += 1
+    return best, best_gaps
+
+
+def gap_match_is_better(keys, trie, best, best_gaps, max_gap=1, gap_ok=None):
+    """Whether an MWE starting in a gap of `best` has more components (or as
+    many with fewer gaps)"""
+    for k in range(best[0] + 1, best[-1]):
+        node = trie.get(keys[k])
+        if k in best or node is None \
+                or node.keys().isdisjoint(keys[k + 1:k + 2 + max_gap]):
+            continue
+        other, gaps = match_gappy_mwe(keys, node, k, max_gap=max_gap,
+                                      gap_ok=gap_ok)
+        if other is not None and (len(other) > len(best)
+                                  or (len(other) == len(best)
+                                      and gaps < best_gaps)):
+            return True
+    return False
+
+
+def find_gappy_mwes(keys, trie, max_gap=1, gap_ok=None):
+    """Yield position tuples of non-overlapping MWEs whose components are
+    separated by up to `max_gap` tokens in total.
+
+    From each start position, the trie is run as an automaton whose states
+    are (node, # of skipped tokens), so lookahead is bounded by the longest
+    MWE plus `max_gap` and states die as soon as they cannot be extended.
+    The MWE with the most components (then the fewest gaps) is taken,
+    unless an MWE starting in one of its gaps is better in the same order
+    (e.g. `take_part` in "take take part", so gap tokens are not moved
+    needlessly). A token at position j can be skipped only if `gap_ok[j]`.
+    Tokens of a matched MWE, including its gaps, are not matched again, so
+    MWEs do not nest."""
+    n = len(keys)
+    used = bytearray(n)
+    for i in range(n):
+        if used[i]:
+            continue
+        node = trie.get(keys[i])
+        if node is None:
+            continue
+        # The second component must be in the next max_gap + 1 tokens
+        if node.keys().isdisjoint(keys[i + 1:i + 2 + max_gap]):
+            continue
+        # Matches end before any unused i, so tokens after i are unused
+        best, best_gaps = match_gappy_mwe(keys, node, i, max_gap=max_gap,
+                                          gap_ok=gap_ok)
+        if best is None:
+            continue
+        if best_gaps > 0 and gap_match_is_better(keys, trie, best, best_gaps,
+                                                 max_gap=max_gap,
+                                                 gap_ok=gap_ok):
+            continue
+        for k in range(best[0], best[-1] + 1):
+            used[k] = 1
+        yield best
+
+
+def merge_gappy_mwes(tokens, trie, max_gap=1, gap_ok=None, lower=False,
+                     sep='_'):
+    """Join (possibly discontinuous) MWE tokens with `sep` at the position
+    of their first token and return (tokens, # of merged MWEs)"""
+    keys = [token.lower() for token in tokens] if lower else tokens
+    output = []
+    n_mwes = 0
+    prev = 0
+    # Spans of MWEs (first to last token) are disjoint and in order
+    for positions in find_gappy_mwes(keys, trie, max_gap=max_gap,
+                                     gap_ok=gap_ok):
+        start, end = positions[0], positions[-1] + 1
+        output.extend(tokens[prev:start])
+        output.append(sep.join([tokens[k] for k in positions]))
+        if len(positions) < end - start:
+            output.extend(tokens[k] for k in range(start, end)
+                          if k not in positions)
+        prev = end
+        n_mwes += 1
+    if n_mwes == 0:
+        return tokens, 0
+    output.extend(tokens[prev:])
+    return output, n_mwes
+
+
+def merge_mwes(tokens, trie, lower=False, sep='_', max_gap=0, gap_ok=None):
+    """Join MWE tokens with `sep` and return (tokens, # of merged MWEs)"""
+    if max_gap > 0:
+        return merge_gappy_mwes(tokens, trie, max_gap=max_gap, gap_ok=gap_ok,
+                                lower=lower, sep=sep)
+    keys = [token.lower() for token in tokens] if lower else tokens
+    output = []
+    n_mwes = 0
+    prev = 0
+    for start, end in find_mwes(keys, trie):
+        output.extend(tokens[prev:start])
+        output.append(sep.join(tokens[start:end]))
+        prev = end
+        n_mwes += 1
+    if n_mwes == 0:
+        return tokens, 0
+    output.extend(tokens[prev:])
+    return output, n_mwes
+
+
+def merge_line(line, trie, lower=False, sep='_', max_gap=0, gap_pos=None,
+               tag_sep=None):
+    """Merge MWEs in a line and return (tokens, # of merged MWEs).
+
+    With `tag_sep`, tokens are `word{tag_sep}TAG`; tags are only used to
+    restrict gap tokens to `gap_pos` and are dropped from the output."""
+    tokens = line.split()
+    gap_ok = None
+    if tag_sep is not None:
+        words, tags = [], []
+        for token in tokens:
+            word, found, tag = token.rpartition(tag_sep)
+            words.append(word if found else tag)
+            tags.append(tag if found else None)
+        tokens = words
+        if gap_pos is not None:
+            gap_ok = [tag in gap_pos for tag in tags]
+    return merge_mwes(tokens, trie, lower=lower, sep=sep, max_gap=max_gap,
+                      gap_ok=gap_ok)
+
+
+def pretokenize_lines(lines, trie, lower=False, sep='_', **kwargs):
+    """Yield pre-tokenized lines and the number of merged MWEs (`kwargs` are
+    passed to merge_line)"""
+    for line in lines:
+        tokens, n_mwes = merge_line(line, trie, lower=lower, sep=sep, **kwargs)
+        yield ' '.join(tokens) + '\n', n_mwes
+
+
+def split_chunks(filename, chunk_bytes):
+    """Split a file into (start, end) byte ranges on line boundaries"""
+    size = os.path.getsize(filename)
+    chunks = []
+    with open(filename, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def _init_worker(trie):
+    global _worker_trie
+    _worker_trie = trie
+
+
+def _pretokenize_chunk(task, lower=False, sep='_', **kwargs):
+    """Pre-tokenize a byte range of a file in a worker process"""
+    filename, start, end, path_shard = task
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf_8')
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    output = []
+    n_mwes = 0
+    for line in lines:
+        tokens, n = merge_line(line, _worker_trie, lower=lower, sep=sep,
+                               **kwargs)
+        output.append(' '.join(tokens))
+        n_mwes += n
+    output.append('')
+    output = '\n'.join(output)
+    if path_shard is None:
+        return output, len(lines), n_mwes
+    with open(path_shard, 'w', encoding='utf_8') as f:
+        f.write(output)
+    return None, len(lines), n_mwes
+
+
+def pretokenize_parallel(filenames, trie, of=None, path_output=None,
+                         workers=2, chunk_bytes=64 << 20,
+                         lower=False, sep='_', **kwargs):
+    """Pre-tokenize files with a process pool.
+
+    Results are written to `of` in the original order, or to
+    `{path_output}.{shard_id:05d}` files when `of` is None.
+    Return the numbers of lines and merged MWEs."""
+    tasks = []
+    for filename in filenames:
+        for start, end in split_chunks(filename, chunk_bytes):
+            path_shard = None
+            if of is None:
+                path_shard = '{}.{:05d}'.format(path_output, len(tasks))
+            tasks.append((filename, start, end, path_shard))
+    if verbose:
+        logger.info('{} chunks, {} workers'.format(len(tasks), workers))
+
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except ValueError:
+        ctx = multiprocessing.get_context()
+    gc.freeze()  # keep the trie pages shared with forked workers
+    n_lines, n_mwes = 0, 0
+    worker = partial(_pretokenize_chunk, lower=lower, sep=sep, **kwargs)
+    with ctx.Pool(workers, initializer=_init_worker,
+                  initargs=(trie,)) as pool:
+        for output, n, m in pool.imap(worker, tasks):
+            if output is not None:
+                of.write(output)
+            n_lines += n
+            n_mwes += m
+    gc.unfreeze()
+    return n_lines, n_mwes
+
+
+def open_corpus(filename):
+    if filename == '-':
+        return codecs.getreader('utf_8')(sys.stdin.buffer)
+    return open(filename, encoding='utf_8')
+
+
+def main(args):
+    global verbose
+    verbose = args.verbose
+
+    metrics = Metrics.from_args('pretokenize', args)
+    with metrics.stage('read') as stage:
+        mwes = load_lexicon(args.path_lexicon, col=args.col, lower=args.lower)
+        trie = build_trie(mwes)
+        stage['items'] = len(mwes)
+    if verbose:
+        logger.info('Compiled {} MWEs from {} lexicon(s)'.format(
+            len(mwes), len(args.path_lexicon)))
+    del mwes
+
+    if args.gap_pos is not None and args.tag_sep is None:
+        logger.error('--gap-pos requires --tag-sep')
+        return 1
+    match = {'max_gap': args.max_gap, 'tag_sep': args.tag_sep,
+             'gap_pos': None if args.gap_pos is None else set(args.gap_pos)}
+
+    if args.shard_output and args.path_output is None:
+        logger.error('--shard-output requires -o/--output')
+        return 1
+    parallel = (args.workers > 1 or args.shard_output) \
+        and '-' not in args.path_input
+    if (args.workers > 1 or args.shard_output) and not parallel:
+        logger.warning('Cannot shard stdin. Fall back to a single process')
+
+    with metrics.stage('pretokenize') as stage:
+        if args.shard_output and parallel:
+            n_lines, n_mwes = pretokenize_parallel(
+                args.path_input, trie, path_output=args.path_output,
+                workers=args.workers, chunk_bytes=args.chunk_bytes,
+                lower=args.lower, sep=args.sep, **match)
+        else:
+            if args.path_output is None:
+                of = codecs.getwriter('utf_8')(sys.stdout.buffer)
+            else:
+                of = open(args.path_output, 'w', encoding='utf_8',
+                          buffering=1 << 20)
+            if parallel:
+                n_lines, n_mwes = pretokenize_parallel(
+                    args.path_input, trie, of=of,
+                    workers=args.workers, chunk_bytes=args.chunk_bytes,
+                    lower=args.lower, sep=args.sep, **match)
+            else:
+                n_lines, n_mwes = 0, 0
+                for path_input in args.path_input:
+                    if verbose:
+                        logger.info('Read ' + path_input)
+                    with open_corpus(path_input) as f:
+                        for line, n in pretokenize_lines(f, trie, lower=args.lower,
+                                                         sep=args.sep, **match):
+                            of.write(line)
+                            n_lines += 1
+                            n_mwes += n
+            of.flush()
+            if args.path_output is not None:
+                of.close()
+        stage['items'] = n_lines
+
+    if verbose:
+        logger.info('Merged {} MWEs in {} lines ({:.1f} lines/sec)'.format(
+            n_mwes, n_lines, n_lines / max(stage['wall_seconds'], 1e-9)))
+    metrics.finish(logger if verbose else None)
+    return 0
+
+
+if __name__ == '__main__':
+    logger = init_logger('PreTok')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path_input', nargs='+',
+                        help='path to corpus file (`-` for stdin)')
+    parser.add_argument('--lexicon', dest='path_lexicon', nargs='+',
+                        required=True,
+                        help='path to MWE lexicon(s) in JSON or binary '
+                             '(*.bin) format')
+    parser.add_argument('--col', choices=['lemma', 'token'], default='lemma',
+                        help='lexicon field to match against corpus tokens')
+    parser.add_argument('-i', '--ignore-case', dest='lower',
+                        action='store_true', default=False,
+                        help='lowercase lexicon entries and corpus tokens '
+                             'before matching')
+    parser.add_argument('--sep', default='_',
+                        help='separator for joining MWE tokens')
+    parser.add_argument('--max-gap', type=int, default=0,
+                        help='maximum number of tokens between the components '
+                             'of a (discontinuous) MWE')
+    parser.add_argument('--gap-pos', nargs='+',
+                        help='POS tags of tokens allowed in gaps '
+                             '(requires --tag-sep)')
+    parser.add_argument('--tag-sep',
+                        help='separator of words and POS tags in corpus '
+                             'tokens (e.g. `/` for `word/TAG`)')
+    parser.add_argument('-o', '--output', dest='path_output',
+                        help='path to output file (default: stdout)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--chunk-bytes', type=int, default=64 << 20,
+                        help='approximate size of a chunk (in bytes) '
+                             'processed by a worker')
+    parser.add_argument('--shard-output', action='store_true', default=False,
+                        help='write one output file per chunk '
+                             '(OUTPUT.00000, OUTPUT.00001, ...) instead of '
+                             'concatenating them')
+    add_metrics_arguments(parser)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='verbose output')
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -9,18 +9,30 @@
 
 01050890-a	cmn:lemma	悲惨的
 01050890-a	cmn:lemma	痛苦的
+
+A line is split by the first separator in it (`,` or `，`). With `--workers N`
+files are processed in parallel:
+
+python split_eomw_entry.py data/wikt --workers 8 -v
 """
 
 from os import listdir
 from os import path
 import argparse
 import logging
+import multiprocessing
 import re
+import sys
+import time
+
+from metrics import Metrics
+from metrics import add_metrics_arguments
 
 verbose = False
 logger = None
 
 separators = {',', '，'}
+splitter = re.compile('|'.join(map(re.escape, sorted(separators))))
 
 
 def init_logger(name='logger'):
@@ -31,26 +43,61 @@ def init_logger(name='logger'):
     return logger
 
 
+def split_entry(line):
+    """Split the last field of a line by the first separator found in it"""
+    row = line.split('\t')
+    m = splitter.search(row[-1])
+    if m is None:
+        return [(row[0], row[1], row[-1].strip())]
+    return [(row[0], row[1], token.strip())
+            for token in row[-1].split(m.group())]
+
+
 def read_tab(filepath):
     with open(filepath) as f:
         for line in f:
+            yield from split_entry(line)
+
+
+def split_file(task):
+    """Split one file (as read_tab) writing `batch_size` rows at once.
+    Return (lang, # of rows, seconds)."""
+    lang, path_input, path_output, batch_size = task
+    time_start = time.perf_counter()
+    search = splitter.search
+    n_rows, buff = 0, []
+    append = buff.append
+    with open(path_input) as fi, \
+            open(path_output, 'w', buffering=1 << 20) as fo:
+        for line in fi:
             row = line.split('\t')
-            for sep in separators:
-                if sep in row[-1]:
-                    break
-            for token in row[-1].split(sep):
-                yield row[0], row[1], token.strip()
+            head = row[0] + '\t' + row[1] + '\t'
+            m = search(row[-1])
+            if m is None:
+                append(head + row[-1].strip() + '\n')
+            else:
+                for token in row[-1].split(m.group()):
+                    append(head + token.strip() + '\n')
+            if len(buff) >= batch_size:
+                fo.write(''.join(buff))
+                n_rows += len(buff)
+                buff.clear()
+        fo.write(''.join(buff))
+        n_rows += len(buff)
+    return lang, n_rows, time.perf_counter() - time_start
 
 
 def main(args):
     global verbose
     verbose = args.verbose
 
+    metrics = Metrics.from_args('split_eomw_entry', args)
     r_filename = re.compile(r'wn-wikt-([^\.]+).tab$')
 
     if verbose:
         logger.info('Read ' + args.dir_data)
-    for filename in listdir(args.dir_data):
+    tasks = []
+    for filename in sorted(listdir(args.dir_data)):
         m = r_filename.match(filename)
         if m is None:
             continue
@@ -59,10 +106,29 @@ def main(args):
         path_output = path.join(args.dir_data, f'wn-wikt-{lang}.split.tab')
         if verbose:
             logger.info(f'in={path_input}, out={path_output}')
-        with open(path_output, 'w') as f:
-            for dat in read_tab(path_input):
-                f.write('\t'.join(dat) + '\n')
-
+        tasks.append((lang, path_input, path_output, args.batch_size))
+    # Largest files first so that they do not finish last
+    tasks.sort(key=lambda task: path.getsize(task[1]), reverse=True)
+
+    with metrics.stage('split') as stage:
+        if args.workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(args.workers, len(tasks)))
+            results = pool.imap_unordered(split_file, tasks)
+        else:
+            pool = None
+            results = map(split_file, tasks)
+        stage['items'], stage['files'] = 0, {}
+        for lang, n_rows, seconds in results:
+            if verbose:
+                logger.info('{}: {} rows in {:.2f} sec ({:.1f} rows/sec)'.format(
+                    lang, n_rows, seconds, n_rows / max(seconds, 1e-9)))
+            stage['items'] += n_rows
+            stage['files'][lang] = {'items': n_rows, 'wall_seconds': seconds}
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    metrics.finish(logger if verbose else None)
     return 0
 
 
@@ -71,8 +137,13 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('dir_data', default='data/wikt',
                         help='path to EOMW directory',)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (one file each)')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='number of rows written at once')
+    add_metrics_arguments(parser)
     parser.add_argument('-v', '--verbose',
                         action='store_true', default=False,
                         help='verbose output')
     args = parser.parse_args()
-    main(args)
+    sys.exit(main(args))
@@ -2,10 +2,19 @@
 # -*- coding: utf-8 -*-
 
 
-from itertools import chain
 import argparse
 import logging
-import spacy_udpipe
+import sys
+
+from analysis_cache import DEFAULT_MAX_ENTRIES
+from analyzers import analyze_words
+from analyzers import open_cache
+from metrics import Metrics
+from metrics import add_metrics_arguments
+from opencc_convert import CONFIGS as OPENCC_CONFIGS
+from opencc_convert import get_converter
+from utils import read_tab_rows
+from utils import write_tokenized_tab
 
 verbose = False
 logger = None
@@ -30,65 +39,71 @@ def init_logger(name='logger'):
     return logger
 
 
-def setup_ja_tokenizer(dict_name):
-    import MeCab
-    import subprocess
-
-    if dict_name not in ['ipadic', 'unidic']:
-            logger.error('Unknown dictionary: ' + dict_name)
-            raise NotImplementedError
-    dir_dict = subprocess.check_output(
-        'mecab-config --dicdir'.split()).strip().decode('utf_8')
-    opt = ''
-    if dict_name == 'unidic':
-        opt += '--dicdir={}/unidic -Oipadic'.format(dir_dict)
-    mecab = MeCab.Tagger(opt)
-    if verbose:
-        logger.info(f'MeCab: {dict_name}')
-    tokenize = lambda w: [token.split('\t')[0]
-                          for token in mecab.parse(w).strip().split('\n')
-                          if token != 'EOS']
-    return tokenize
-
-
-def setup_udpipe_tokenizer(lang, path_model):
-    assert args.path_model is not None
-    if verbose:
-        logger.info(f'Load UDPipe model: {path_model}')
-    nlp = spacy_udpipe.load_from_path(lang, path_model)
-    tokenize = lambda w: [token.text for token in nlp(w)]
-    return tokenize
+def get_analyzer(lang):
+    """Return (analyzer, dictionary) for a language"""
+    if lang == 'ja-ipadic':
+        return 'mecab', lang.split('-')[1].lower()
+    return 'udpipe', None
 
 
 def main(args):
     global verbose
     verbose = args.verbose
 
-    if args.lang == 'ja-ipadic':
-        tokenize = setup_ja_tokenizer(args.lang.split('-')[1].lower())
-    else:
-        tokenize = setup_udpipe_tokenizer(args.lang, args.path_model)
-
+    metrics = Metrics.from_args('tokenize_wn-wikt', args)
     if verbose:
         logger.info('Read ' + args.path_input)
+    with metrics.stage('read') as stage:
+        rows, skipped = read_tab_rows(args.path_input)
+        convert = get_converter(args.convert_input)
+        if convert is not None:
+            for row in rows:
+                if isinstance(row, list):
+                    row[2] = convert(row[2])
+        # Tokenize each surface form only once
+        words = sorted(set(row[2] for row in rows if isinstance(row, list)))
+        stage['items'] = len(rows)
+    for i, line in skipped:
+        logger.warning('Skip [{}]'.format(i) + line)
+
+    if verbose:
+        logger.info('# of words: ' + str(len(words)))
+    analyzer, dictionary = get_analyzer(args.lang)
+    if verbose:
+        if analyzer == 'mecab':
+            logger.info(f'MeCab: {dictionary}')
+        else:
+            logger.info(f'Load UDPipe model: {args.path_model}')
+    cache = open_cache(args.path_cache, analyzer, lang=args.lang,
+                       path_model=args.path_model, dictionary=dictionary,
+                       max_entries=args.cache_size)
+    with metrics.stage('analysis') as stage:
+        tokenized = analyze_words(words, analyzer, lang=args.lang,
+                                  path_model=args.path_model,
+                                  dictionary=dictionary,
+                                  batch_size=args.batch_size,
+                                  workers=args.workers, cache=cache)
+        stage['items'] = len(words)
+    if cache is not None:
+        cache.close()
+        if verbose:
+            logger.info('Cache: {}'.format(cache.stats()))
+    if verbose:
+        logger.info('{}: tokenized {} words in {:.1f} sec ({:.1f} words/sec, '
+                    'batch_size={}, workers={})'.format(
+                        args.lang, len(words), stage['wall_seconds'],
+                        len(words) / max(stage['wall_seconds'], 1e-9),
+                        args.batch_size, args.workers))
+
+    if verbose:
         logger.info('Write to ' + args.path_output)
-    n_skipped = 0
-    with open(args.path_input) as f:
-        with open(args.path_output, 'w') as of:
-            for i, line in enumerate(f, start=1):
-                if line.startswith('#'):
-                    of.write(line)
-                    continue
-                row = line.strip().split('\t')
-                if len(row) < 3:
-                    logger.warning('Skip [{}]'.format(i) + line.strip())
-                    n_skipped += 1
-                    continue
-                tokens = tokenize(row[2])
-                row[2] = '_'.join(tokens)
-                of.write('\t'.join(row) + '\n')
-
-    logger.warning('Skipped {} lines'.format(n_skipped))
+    with metrics.stage('write') as stage:
+        write_tokenized_tab(args.path_output, rows, tokenized,
+                            convert=get_converter(args.convert_output))
+        stage['items'] = len(rows)
+
+    metrics.finish(logger if verbose else None)
+    logger.warning('Skipped {} lines'.format(len(skipped)))
     return 0
 
 
@@ -103,8 +118,25 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', dest='path_output',
                         required=True, help='path to output file')
     parser.add_argument('--port', type=int, default=9000, help='port number of StanfordCoreNLP Server')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='number of words tokenized at once')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes '
+                             '(each loads its own model)')
+    parser.add_argument('--cache', dest='path_cache',
+                        help='path to an analysis cache (SQLite) file')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_ENTRIES,
+                        help='maximum number of cached analyses')
+    parser.add_argument('--convert-input', choices=OPENCC_CONFIGS,
+                        help='convert surfaces with OpenCC before tokenizing '
+                             '(e.g. s2t)')
+    parser.add_argument('--convert-output', choices=OPENCC_CONFIGS,
+                        help='convert tokenized surfaces with OpenCC '
+                             '(e.g. t2s)')
+    add_metrics_arguments(parser)
     parser.add_argument('-v', '--verbose',
                         action='store_true', default=False,
                         help='verbose output')
     args = parser.parse_args()
-    main(args)
+    sys.exit(main(args))
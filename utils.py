@@ -1,6 +1,13 @@
 import codecs
+import csv
+import gzip
 import json
 
+# Strings read as NaN by pandas.read_table (its default `na_values`)
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
+             '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN',
+             'None', 'n/a', 'nan', 'null'}
+
 
 def escape(s):
     """Escape special characters for mwetoolkit formats."""
@@ -14,22 +21,49 @@ def escape(s):
     s = s.replace('\n', '&#10;')
     return s
 
-def write_json2xml(filename, mwes):
-    with open(filename, 'w') as f:
+def xml_entry(mwe):
+    """Return an <entry> element of a (space-separated, escaped) MWE"""
+    return '<entry>\n' \
+        + ''.join(' ' * 8 + '<w lemma="{}" />\n'.format(item)
+                  for item in mwe.split(' ')) \
+        + '</entry>\n\n'
+
+
+def write_xml(filename, mwes, compress=False, buffer_size=4096):
+    """Write MWEs (in the given order) in mwetoolkit XML format.
+
+    Entries are written in bulk every `buffer_size` entries, and the file is
+    gzip-compressed if `compress` or `filename` ends with `.gz`."""
+    if compress or filename.endswith('.gz'):
+        f = gzip.open(filename, 'wt', encoding='utf_8', compresslevel=6)
+    else:
+        f = open(filename, 'w', buffering=1 << 20)
+    with f:
         f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
                 '<!DOCTYPE dict SYSTEM "dtd/mwetoolkit-dict.dtd">\n'
                 '<!-- MWETOOLKIT: filetype="XML" -->\n'
                 '<dict>\n'
                 '<meta></meta>\n\n')
-        for mwe, entry in sorted(mwes.items(), key=lambda t: t[0]):
-            f.write('<entry>\n')
-            for item in mwe.split(' '):
-                f.write(' ' * 8 + '<w lemma="{}" />\n'.format(item))
-            f.write('</entry>\n\n')
+        buff = []
+        counter = 0
+        for mwe in mwes:
+            buff.append(xml_entry(mwe))
+            counter += 1
+            if len(buff) >= buffer_size:
+                f.write(''.join(buff))
+                buff = []
+        f.write(''.join(buff))
         f.write('</dict>\n')
+    return counter
 
 
-def write_mwe_json(filename, mwes, source='n/a'):
+def write_json2xml(filename, mwes, compress=False):
+    write_xml(filename, sorted(mwes), compress=compress)
+
+
+def write_mwe_json(filename, mwes, source='n/a', convert=None):
+    """Write counted MWE entries in JSON-lines format (token and lemma
+    fields converted by `convert` if given, e.g. an OpenCC Converter)"""
     with codecs.open(filename, 'w', encoding='utf_8') as f:
         for mwe, freq in sorted(mwes.items(), key=lambda t: t[1], reverse=True):
             try:
@@ -43,6 +77,85 @@ def write_mwe_json(filename, mwes, source='n/a'):
                 row['ner'] = ' '.join(ner)
             except:
                 pass
+            if convert is not None:
+                row['token'] = convert(row['token'])
+                row['lemma'] = convert(row['lemma'])
             row['freq'] = freq
             row['source'] = source
             f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def read_mwe_json(filename):
+    """Yield entries of an MWE lexicon in JSON-lines format"""
+    with codecs.open(filename, encoding='utf_8') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            yield json.loads(line)
+
+
+def read_tab_rows(filename):
+    """Read a wn-wikt-*.tab file and return (rows, skipped).
+
+    rows are lists of fields or comment lines (str) kept as they are;
+    skipped are (line number, line) with less than three fields."""
+    rows, skipped = [], []
+    with open(filename) as f:
+        for i, line in enumerate(f, start=1):
+            if line.startswith('#'):
+                rows.append(line)
+                continue
+            row = line.strip().split('\t')
+            if len(row) < 3:
+                skipped.append((i, line.strip()))
+                continue
+            rows.append(row)
+    return rows, skipped
+
+
+def read_tsv(filename, n_fields=3, comment='#'):
+    """Yield rows (the first `n_fields` fields) of a TSV file as
+    `pandas.read_table(names=..., comment=comment).dropna()` keeps them:
+    text after `comment` is ignored, and blank lines and rows with missing
+    fields or NA strings (NA_VALUES) are dropped."""
+    with open(filename, newline='') as f:
+        lines = (line.split(comment, 1)[0] if comment in line else line
+                 for line in f)
+        for row in csv.reader(lines, delimiter='\t'):
+            if len(row) < n_fields:
+                continue
+            row = row[:n_fields]
+            if any(field in NA_VALUES for field in row):
+                continue
+            yield row
+
+
+def read_surfaces(filename, use_pandas=False):
+    """Return (# of rows, unique surfaces) of a wn-wikt-*.tab file"""
+    if use_pandas:
+        import pandas as pd
+
+        df = pd.read_table(filename, names=['synset', 'type', 'surface'],
+                           comment='#')
+        df.dropna(inplace=True)
+        return len(df), set(df['surface'].unique())
+    n_rows, surfaces = 0, set()
+    for row in read_tsv(filename):
+        surfaces.add(row[2])
+        n_rows += 1
+    return n_rows, surfaces
+
+
+def write_tokenized_tab(filename, rows, analyses, convert=None):
+    """Write rows with surfaces replaced by their forms joined with '_'
+    (converted by `convert` if given)"""
+    with open(filename, 'w') as f:
+        for row in rows:
+            if isinstance(row, str):
+                f.write(row)
+                continue
+            tokens = '_'.join(t[0] for t in analyses[row[2]])
+            if convert is not None:
+                tokens = convert(tokens)
+            f.write('\t'.join(row[:2] + [tokens] + row[3:]) + '\n')
@@ -2,14 +2,17 @@
 # -*- coding: utf-8 -*-
 
 from collections import defaultdict
-from itertools import chain
-from tqdm import tqdm
-import subprocess
-import MeCab
 import argparse
 import logging
-import pandas as pd
-
+import sys
+
+from analysis_cache import DEFAULT_MAX_ENTRIES
+from analyzers import analyze_words_mecab
+from analyzers import open_cache
+from analyzers import to_mwe_entry
+from metrics import Metrics
+from metrics import add_metrics_arguments
+from utils import read_surfaces
 from utils import write_mwe_json
 
 verbose = False
@@ -28,52 +31,57 @@ def main(args):
     global verbose
     verbose = args.verbose
 
-    df = pd.read_table(args.path_input, names=['synset', 'type', 'surface'],
-                       comment='#')
-    df.dropna(inplace=True)
-    if verbose:
-        logger.info('Read {} lines from {}'.format(len(df), args.path_input))
-    words = sorted(df['surface'].unique())
+    if len(args.dict) != len(args.path_output):
+        logger.error('Give one output file for each dictionary')
+        return 1
 
+    metrics = Metrics.from_args('wnwikt2json_mecab', args)
+    with metrics.stage('read') as stage:
+        n_rows, surfaces = read_surfaces(args.path_input,
+                                         use_pandas=args.pandas)
+        words = sorted(surfaces)
+        stage['items'] = n_rows
     if verbose:
-        logger.info('# of words: ' + str(len(words)))
+        logger.info('Read {} lines from {}'.format(n_rows, args.path_input))
 
-    # Set up MeCab
     if verbose:
-        logger.info('MeCab: {}'.format(args.dict))
-    dir_dict = subprocess.check_output('mecab-config --dicdir'.split()).strip().decode('utf_8')
-    opt = ''
-    if args.dict == 'unidic':
-        opt += '--dicdir={}/unidic -Oipadic'.format(dir_dict)
-    mecab = MeCab.Tagger(opt)
-
-    counter = defaultdict(int)
-    for word in tqdm(words):
-        buff = []
-        for token in mecab.parse(word).split('\n'):
-            try:
-                form, feats = token.split('\t', 1)
-            except ValueError:
-                continue
-            feats = feats.split(',')
-            pos = feats[0]
-            if len(feats) == 9:
-                lemma = feats[6]
-            else:
-                lemma = form
-            if form in ['～', '…']:  # skip symbols
-                continue
-            buff.append('@@@'.join([form, lemma, pos]))
-
-        if len(buff) == 1:
-            continue
-        counter['\t'.join(buff)] += 1
-
+        logger.info('# of words: ' + str(len(words)))
 
+    # Set up MeCab (one Tagger per dictionary in each worker)
     if verbose:
-        logger.info('Write {} entries to {}'.format(len(counter), args.path_output))
-    write_mwe_json(args.path_output, counter, source='EOMW')
-
+        logger.info('MeCab: {}'.format(', '.join(args.dict)))
+    caches = {dictionary: open_cache(args.path_cache, 'mecab',
+                                     dictionary=dictionary,
+                                     max_entries=args.cache_size)
+              for dictionary in args.dict}
+    with metrics.stage('analysis') as stage:
+        analyses = analyze_words_mecab(words, args.dict,
+                                       batch_size=args.batch_size,
+                                       workers=args.workers, caches=caches)
+        stage['items'] = len(words)
+    for dictionary, cache in caches.items():
+        if cache is not None:
+            cache.close()
+            if verbose:
+                logger.info('Cache ({}): {}'.format(dictionary, cache.stats()))
+
+    for dictionary, path_output in zip(args.dict, args.path_output):
+        with metrics.stage('aggregation:' + dictionary) as stage:
+            counter = defaultdict(int)
+            for word in words:
+                entry = to_mwe_entry(analyses[dictionary][word], 'mecab')
+                if entry is None:
+                    continue
+                counter[entry] += 1
+            stage['items'] = len(words)
+
+        if verbose:
+            logger.info('Write {} entries to {}'.format(len(counter), path_output))
+        with metrics.stage('write:' + dictionary) as stage:
+            write_mwe_json(path_output, counter, source='EOMW')
+            stage['items'] = len(counter)
+
+    metrics.finish(logger if verbose else None)
     return 0
 
 
@@ -81,12 +89,27 @@ if __name__ == '__main__':
     logger = init_logger('MWE')
     parser = argparse.ArgumentParser()
     parser.add_argument('path_input', help='path to input file')
-    parser.add_argument('--dict', choices=['ipadic', 'unidic'], default='ipadic',
-                        help='MeCab dictionary')
-    parser.add_argument('-o', '--output', dest='path_output',
-                        required=True, help='path to output file')
+    parser.add_argument('--dict', nargs='+', choices=['ipadic', 'unidic'],
+                        default=['ipadic'],
+                        help='MeCab dictionaries (analyzed in one pass)')
+    parser.add_argument('-o', '--output', dest='path_output', nargs='+',
+                        required=True,
+                        help='path to output file (one for each dictionary)')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='number of words analyzed at once')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes '
+                             '(each loads its own Taggers)')
+    parser.add_argument('--cache', dest='path_cache',
+                        help='path to an analysis cache (SQLite) file')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_ENTRIES,
+                        help='maximum number of cached analyses')
+    parser.add_argument('--pandas', action='store_true', default=False,
+                        help='read the input with pandas')
+    add_metrics_arguments(parser)
     parser.add_argument('-v', '--verbose',
                         action='store_true', default=False,
                         help='verbose output')
     args = parser.parse_args()
-    main(args)
+    sys.exit(main(args))
@@ -2,13 +2,19 @@
 # -*- coding: utf-8 -*-
 
 from collections import defaultdict
-from itertools import chain
-from tqdm import tqdm
 import argparse
 import logging
-import pandas as pd
-import spacy_udpipe
-
+import sys
+
+from analysis_cache import DEFAULT_MAX_ENTRIES
+from analyzers import analyze_words
+from analyzers import open_cache
+from analyzers import to_mwe_entry
+from metrics import Metrics
+from metrics import add_metrics_arguments
+from opencc_convert import CONFIGS as OPENCC_CONFIGS
+from opencc_convert import get_converter
+from utils import read_surfaces
 from utils import write_mwe_json
 
 verbose = False
@@ -27,12 +33,17 @@ def main(args):
     global verbose
     verbose = args.verbose
 
-    df = pd.read_table(args.path_input, names=['synset', 'type', 'surface'],
-                       comment='#')
-    df.dropna(inplace=True)
+    metrics = Metrics.from_args('wnwikt2json_udpipe', args)
+    with metrics.stage('read') as stage:
+        n_rows, surfaces = read_surfaces(args.path_input,
+                                         use_pandas=args.pandas)
+        convert = get_converter(args.convert_input)
+        if convert is not None:
+            surfaces = set(map(convert, surfaces))
+        words = sorted(surfaces)
+        stage['items'] = n_rows
     if verbose:
-        logger.info('Read {} lines from {}'.format(len(df), args.path_input))
-    words = sorted(df['surface'].unique())
+        logger.info('Read {} lines from {}'.format(n_rows, args.path_input))
 
     if verbose:
         logger.info('# of words: ' + str(len(words)))
@@ -40,27 +51,37 @@ def main(args):
     # Set up an UDPipe model
     if verbose:
         logger.info(f'Load UDPipe model: {args.path_model}')
-    nlp = spacy_udpipe.load_from_path(args.lang, args.path_model)
-
-    counter = defaultdict(int)
-    for word in tqdm(words):
-        buff = []
-        for token in nlp(word):
-            form, lemma, pos, tag = token.text, token.lemma_, token.pos_, token.tag_
-            if not isinstance(lemma, str) or len(lemma) == 0:
-                lemma = form
-            if form in ['～', '…']:  # skip symbols
+    cache = open_cache(args.path_cache, 'udpipe', lang=args.lang,
+                       path_model=args.path_model,
+                       max_entries=args.cache_size)
+    with metrics.stage('analysis') as stage:
+        analyses = analyze_words(words, 'udpipe', lang=args.lang,
+                                 path_model=args.path_model,
+                                 batch_size=args.batch_size,
+                                 workers=args.workers, cache=cache)
+        stage['items'] = len(words)
+    if cache is not None:
+        cache.close()
+        if verbose:
+            logger.info('Cache: {}'.format(cache.stats()))
+
+    with metrics.stage('aggregation') as stage:
+        counter = defaultdict(int)
+        for word in words:
+            entry = to_mwe_entry(analyses[word], 'udpipe')
+            if entry is None:
                 continue
-            buff.append('@@@'.join([form, lemma.lower(), f'{pos}-{tag}']))
-
-        if len(buff) == 1:
-            continue
-        counter['\t'.join(buff)] += 1
+            counter[entry] += 1
+        stage['items'] = len(words)
 
     if verbose:
         logger.info('Write {} entries to {}'.format(len(counter), args.path_output))
-    write_mwe_json(args.path_output, counter, source='EOMW')
+    with metrics.stage('write') as stage:
+        write_mwe_json(args.path_output, counter, source='EOMW',
+                       convert=get_converter(args.convert_output))
+        stage['items'] = len(counter)
 
+    metrics.finish(logger if verbose else None)
     return 0
 
 
@@ -74,8 +95,27 @@ if __name__ == '__main__':
                         help='language')
     parser.add_argument('-o', '--output', dest='path_output',
                         required=True, help='path to output file')
+    parser.add_argument('--cache', dest='path_cache',
+                        help='path to an analysis cache (SQLite) file')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_ENTRIES,
+                        help='maximum number of cached analyses')
+    parser.add_argument('--pandas', action='store_true', default=False,
+                        help='read the input with pandas')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='number of words analyzed at once')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes '
+                             '(each loads its own model)')
+    parser.add_argument('--convert-input', choices=OPENCC_CONFIGS,
+                        help='convert surfaces with OpenCC before analysis '
+                             '(e.g. s2t)')
+    parser.add_argument('--convert-output', choices=OPENCC_CONFIGS,
+                        help='convert tokens and lemmas of entries with '
+                             'OpenCC (e.g. t2s)')
+    add_metrics_arguments(parser)
     parser.add_argument('-v', '--verbose',
                         action='store_true', default=False,
                         help='verbose output')
     args = parser.parse_args()
-    main(args)
+    sys.exit(main(args))